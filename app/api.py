@@ -1,3 +1,4 @@
+import asyncio
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 
@@ -5,21 +6,83 @@ from fastapi import FastAPI, HTTPException, Request
 from tortoise import Tortoise
 
 from app import logging
-from app.clients import twitch
+from app.cache import CacheRegistry
+from app.clients.http import SPOTIFY_ACCOUNTS_URL, SPOTIFY_API_URL, TWITCH_API_URL, TWITCH_ID_URL, HttpClients
+from app.clients.spotify import SpotifyClient
+from app.clients.twitch import TwitchClient
 from app.configuration import Configuration
 from app.identity.jwt import Jwt
 from app.services.authorization import Authorization
-from app.exception_handlers import exception_handler
+from app.exception_handlers import exception_handler, no_active_device_handler, token_refresh_pending_handler
+from app.exceptions import NoActiveDeviceException, TokenRefreshPendingException
+from app.middleware.jwt_middleware import JwtMiddleware
 from app.routers import twitch_router, spotify_router
 from app.routers.oauth import oauth_router
 from app.services.identity import Identity
+from app.services.invalidation import InvalidationBus, InvalidationKind
+from app.services.now_playing import NowPlaying
+from app.services.now_playing_stream import NowPlayingStream
+from app.services.scheduler import PollScheduler
+from app.services.token_refresher import TokenRefresher
+from app.services.token_warmup import warm_access_tokens
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     configuration = Configuration()
-    token_manager = Authorization(configuration)
-    identity = Identity(configuration)
+    http_clients = HttpClients.from_configuration(configuration)
+    spotify_client = SpotifyClient.from_configuration(configuration, http_clients)
+    twitch_client = TwitchClient(
+        configuration.twitch_client_id,
+        configuration.twitch_client_secret,
+        http_clients,
+    )
+    caches = CacheRegistry()
+    invalidation = InvalidationBus(
+        caches,
+        reconnect_delay=configuration.invalidation_reconnect_delay,
+        keepalive=configuration.invalidation_keepalive,
+    )
+    token_manager = Authorization(configuration, twitch_client, spotify_client, invalidation)
+    identity = Identity(configuration, invalidation)
+    now_playing = NowPlaying(configuration.now_playing_max_ttl)
+    invalidation.subscribe(
+        InvalidationKind.NowPlaying,
+        lambda key: now_playing.invalidate(*key),
+    )
+    poll_scheduler = PollScheduler(
+        min_interval=configuration.poll_min_interval,
+        max_interval=configuration.poll_max_interval,
+        max_backoff=configuration.poll_max_backoff,
+        idle_timeout=configuration.poll_idle_timeout,
+        max_concurrency=configuration.poll_max_concurrency,
+    )
+    now_playing_stream = NowPlayingStream(
+        token_manager,
+        spotify_client,
+        now_playing,
+        poll_scheduler,
+        queue_size=configuration.now_playing_stream_queue_size,
+    )
+
+    token_refresher = TokenRefresher(
+        token_manager,
+        interval=configuration.token_refresh_interval,
+        window=configuration.token_refresh_window,
+        concurrency=configuration.token_refresh_concurrency,
+        jitter=configuration.token_refresh_jitter,
+        batch_size=configuration.token_refresh_batch_size,
+        max_backoff=configuration.token_refresh_max_backoff,
+    )
+
+    caches.register("spotify_devices", spotify_client.device_cache)
+    caches.register("spotify_search", spotify_client.search_cache)
+    caches.register("spotify_tracks", spotify_client.track_cache)
+    caches.register("now_playing", now_playing)
+    caches.register("access_tokens", token_manager.access_tokens)
+    caches.register("api_tokens", token_manager.api_tokens)
+    caches.register("verified_jwts", identity.verified_jwts)
+    caches.register("rotated_refresh_tokens", identity.rotated_refresh_tokens)
 
     # Configure logging
     logging.configure_logging(configuration.log_level)
@@ -32,12 +95,49 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     app.state.configuration = configuration
     app.state.token_manager = token_manager
     app.state.identity = identity
+    app.state.http_clients = http_clients
+    app.state.spotify_client = spotify_client
+    app.state.twitch_client = twitch_client
+    app.state.now_playing = now_playing
+    app.state.now_playing_stream = now_playing_stream
+    app.state.poll_scheduler = poll_scheduler
+    app.state.caches = caches
+    app.state.invalidation = invalidation
+
+    # Open connections to the upstream hosts before serving traffic
+    if configuration.http_warmup:
+        await http_clients.warmup([
+            SPOTIFY_API_URL,
+            SPOTIFY_ACCOUNTS_URL,
+            TWITCH_API_URL,
+            TWITCH_ID_URL,
+        ])
 
     # get background tasks
-    app.state.background_tasks = []
+    app.state.background_tasks = [
+        asyncio.create_task(poll_scheduler.run(now_playing_stream.refresh)),
+        asyncio.create_task(token_refresher.run()),
+        asyncio.create_task(invalidation.run()),
+    ]
+
+    # Prefill the access token cache before we report ready
+    if configuration.token_warmup:
+        await warm_access_tokens(
+            token_manager,
+            invalidation,
+            budget=configuration.token_warmup_budget,
+            active_days=configuration.token_warmup_active_days,
+            batch_size=configuration.token_warmup_batch_size,
+        )
 
     yield
 
+    for task in app.state.background_tasks:
+        task.cancel()
+
+    await asyncio.gather(*app.state.background_tasks, return_exceptions=True)
+    await poll_scheduler.close()
+    await http_clients.aclose()
     await Tortoise.close_connections()
 
 
@@ -47,3 +147,7 @@ api.include_router(twitch_router)
 api.include_router(spotify_router)
 
 api.add_exception_handler(Exception, exception_handler)
+api.add_exception_handler(NoActiveDeviceException, no_active_device_handler)
+api.add_exception_handler(TokenRefreshPendingException, token_refresh_pending_handler)
+
+api.add_middleware(JwtMiddleware)
@@ -0,0 +1,4 @@
+from app.cache.registry import Cache, CacheRegistry
+from app.cache.sized import SizedTTLCache
+from app.cache.single_flight import SingleFlight, coalesced
+from app.cache.ttl import AsyncTTLCache, CacheStats
@@ -0,0 +1,31 @@
+from typing import Protocol
+
+from app.cache.ttl import CacheStats
+
+
+class Cache(Protocol):
+    @property
+    def stats(self) -> CacheStats:
+        ...
+
+    def clear(self) -> None:
+        ...
+
+
+class CacheRegistry:
+    """
+    Named, process-local caches; used to expose hit/miss counters and to flush
+    everything at once.
+    """
+    def __init__(self) -> None:
+        self.caches: dict[str, Cache] = {}
+
+    def register(self, name: str, cache: Cache) -> None:
+        self.caches[name] = cache
+
+    def stats(self) -> dict[str, CacheStats]:
+        return {name: cache.stats for name, cache in self.caches.items()}
+
+    def clear(self) -> None:
+        for cache in self.caches.values():
+            cache.clear()
@@ -0,0 +1,54 @@
+import asyncio
+import functools
+from typing import Any, Awaitable, Callable, Hashable, TypeVar
+
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into a single in-flight call;
+    every caller awaits the same result (or exception). Nothing is kept once the
+    call completes.
+    """
+    def __init__(self) -> None:
+        self.in_flight: dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self.in_flight.get(key)
+
+        if not task:
+            task = asyncio.ensure_future(fn())
+            task.add_done_callback(functools.partial(self.forget, key))
+
+            self.in_flight[key] = task
+
+        # A cancelled caller must not cancel the call for everyone else
+        return await asyncio.shield(task)
+
+    def forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+
+        # Retrieve the exception so it isn't reported as never retrieved when
+        # every caller has gone away
+        if not task.cancelled():
+            task.exception()
+
+
+def coalesced(method: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    """
+    Coalesces concurrent calls to a method with identical arguments; the
+    instance must provide a `single_flight` attribute.
+    """
+    @functools.wraps(method)
+    async def wrapper(self: Any, *args: Hashable, **kwargs: Hashable) -> T:
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+
+        return await self.single_flight.do(
+            key,
+            lambda: method(self, *args, **kwargs),
+        )
+
+    return wrapper
@@ -0,0 +1,48 @@
+import time
+from typing import Callable, Hashable, TypeVar
+
+from app.cache.ttl import AsyncTTLCache, CacheStats
+
+
+T = TypeVar("T")
+
+
+class SizedTTLCache(AsyncTTLCache[T]):
+    """
+    LRU + TTL cache bounded by both entry count and total size in bytes, as
+    reported by `sizeof` for each entry.
+    """
+    def __init__(
+        self,
+        max_entries: int,
+        max_bytes: int,
+        ttl: float,
+        sizeof: Callable[[T], int],
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        # cachetools evicts least recently used entries once the summed sizes
+        # exceed `maxsize`
+        super().__init__(maxsize=max_bytes, ttl=ttl, timer=timer, getsizeof=sizeof)
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+
+    def set(self, key: Hashable, value: T) -> None:
+        # Anything larger than the whole cache is simply not cached
+        if self.sizeof(value) > self.max_bytes:
+            return
+
+        self.cache[key] = value
+
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem()
+
+    @property
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            size=len(self.cache),
+            bytes=self.cache.currsize,
+        )
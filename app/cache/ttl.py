@@ -0,0 +1,69 @@
+from dataclasses import dataclass
+import time
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+from cachetools import TTLCache
+
+
+T = TypeVar("T")
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    size: int = 0
+    bytes: int | None = None
+
+
+class AsyncTTLCache(Generic[T]):
+    """
+    TTL cache for the *results* of coroutines. `cachetools.cached` can't be used
+    on async functions; it caches the coroutine object rather than its result.
+    """
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        timer: Callable[[], float] = time.monotonic,
+        getsizeof: Callable[[T], int] | None = None,
+    ) -> None:
+        self.cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl, timer=timer, getsizeof=getsizeof)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> T | None:
+        value = self.cache.get(key)
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return value
+
+    def set(self, key: Hashable, value: T) -> None:
+        self.cache[key] = value
+
+    def invalidate(self, key: Hashable) -> None:
+        self.cache.pop(key, None)
+
+    def clear(self) -> None:
+        self.cache.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[T]]) -> T:
+        value = self.get(key)
+
+        if value is None:
+            value = await loader()
+            self.set(key, value)
+
+        return value
+
+    @property
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            size=len(self.cache),
+        )
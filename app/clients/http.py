@@ -0,0 +1,89 @@
+import asyncio
+import logging
+
+import httpx
+
+from app.configuration import Configuration
+
+
+SPOTIFY_API_URL = "https://api.spotify.com"
+SPOTIFY_ACCOUNTS_URL = "https://accounts.spotify.com"
+TWITCH_API_URL = "https://api.twitch.tv"
+TWITCH_ID_URL = "https://id.twitch.tv"
+
+
+logger = logging.getLogger(__name__)
+
+
+class HttpClients:
+    """
+    Long-lived, keep-alive HTTP clients; one per upstream host. Each host gets
+    its own connection pool so a slow upstream can't starve the others.
+    """
+    def __init__(
+        self,
+        limits: httpx.Limits | None = None,
+        timeout: httpx.Timeout | None = None,
+        http2: bool = False,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ) -> None:
+        self.limits = limits or httpx.Limits()
+        self.timeout = timeout or httpx.Timeout(5.0)
+        self.http2 = http2
+        self.transport = transport
+        self.clients: dict[str, httpx.AsyncClient] = {}
+
+    @classmethod
+    def from_configuration(cls, configuration: Configuration) -> "HttpClients":
+        return cls(
+            limits=httpx.Limits(
+                max_connections=configuration.http_max_connections,
+                max_keepalive_connections=configuration.http_max_keepalive_connections,
+                keepalive_expiry=configuration.http_keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(
+                configuration.http_timeout,
+                connect=configuration.http_connect_timeout,
+            ),
+            http2=configuration.http2,
+        )
+
+    def get(self, base_url: str) -> httpx.AsyncClient:
+        client = self.clients.get(base_url)
+
+        if not client or client.is_closed:
+            client = httpx.AsyncClient(
+                base_url=base_url,
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=self.http2,
+                transport=self.transport,
+            )
+
+            self.clients[base_url] = client
+
+        return client
+
+    async def warmup(self, base_urls: list[str]) -> None:
+        """
+        Opens a connection to each host ahead of the first real request so the
+        TCP + TLS handshake isn't paid on a user's request.
+        """
+        async def connect(base_url: str) -> None:
+            try:
+                await self.get(base_url).head("/")
+            except httpx.HTTPError as e:
+                logger.warning(
+                    f"Failed to warm up connection to {base_url}: {e}",
+                    extra={
+                        "base_url": base_url,
+                    },
+                )
+
+        await asyncio.gather(*(connect(base_url) for base_url in base_urls))
+
+    async def aclose(self) -> None:
+        clients = list(self.clients.values())
+        self.clients.clear()
+
+        await asyncio.gather(*(client.aclose() for client in clients))
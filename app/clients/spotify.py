@@ -1,17 +1,18 @@
 from base64 import b64encode
+from typing import Hashable
 
-from cachetools import cached, TTLCache
 import httpx
 from pydantic import BaseModel
 
+from app.cache import AsyncTTLCache, SingleFlight, SizedTTLCache, coalesced
+from app.configuration import Configuration
+from app.exceptions import NoActiveDeviceException
 from app.models.oauth_token import OAuthToken
+from app.clients.http import SPOTIFY_ACCOUNTS_URL, SPOTIFY_API_URL, HttpClients
 from app.clients.oauth_client import OAuthClient
 from app.models.spotify import CurrentlyPlaying, Track, Device
 
 
-TTL_CACHE = TTLCache(maxsize=1024, ttl=300)
-
-
 class AvailableDevicePayload(BaseModel):
     devices: list[Device]
 
@@ -21,7 +22,7 @@ class AvailableDevicePayload(BaseModel):
 
 
 class QueuePayload(BaseModel):
-    currently_playing: Track
+    currently_playing: Track | None = None
     queue: list[Track]
 
 
@@ -31,22 +32,134 @@ class SearchTracks(BaseModel):
 
 class SearchPayload(BaseModel):
     tracks: SearchTracks
-    
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.casefold().split())
+
+
+def player_error_reason(response: httpx.Response) -> str | None:
+    # {"error": {"status": 404, "message": "...", "reason": "NO_ACTIVE_DEVICE"}}
+    try:
+        return response.json()["error"]["reason"]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def track_id_from_uri(uri: str) -> str:
+    # spotify:track:4iV5W9uYEdYUVa79Axb7Rh
+    return uri.rsplit(":", 1)[-1]
+
+
+# Rough per-entry cost of a Track and its nested models, excluding the strings
+TRACK_OVERHEAD = 1024
+
+
+def track_size(track: Track) -> int:
+    """
+    A cheap estimate of the memory held by a track; measuring it exactly
+    (e.g. by serializing it) would cost more than the cache saves.
+    """
+    strings = len(track.name) + len(track.album.name) + len(track.uri)
+    strings += sum(len(artist.name) for artist in track.artists)
+
+    return TRACK_OVERHEAD + strings
+
+
+class TrackCache(SizedTTLCache[Track]):
+    """
+    Holds validated tracks, so a hit costs nothing beyond the lookup; entries
+    are sized with `track_size`.
+    """
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float) -> None:
+        super().__init__(
+            max_entries=max_entries,
+            max_bytes=max_bytes,
+            ttl=ttl,
+            sizeof=track_size,
+        )
+
 
 class SpotifyClient(OAuthClient):
     def __init__(
         self,
         client_id: str,
         client_secret: str,
+        http_clients: HttpClients | None = None,
+        device_cache_ttl: float = 5.0,
+        search_cache: TrackCache | None = None,
+        track_cache: TrackCache | None = None,
+        search_limit: int = 1,
+        search_market: str | None = "from_token",
     ) -> None:
         self.client_id = client_id
         self.client_secret = client_secret
-        self.url = "https://api.twitch.tv/helix"
-        self.client = httpx.AsyncClient()
-    
+        self.search_limit = search_limit
+        self.search_market = search_market
+        self.http_clients = http_clients or HttpClients()
+        self.single_flight = SingleFlight()
+
+        # Keyed by access token, which is unique per user
+        self.device_cache: AsyncTTLCache[AvailableDevicePayload] = AsyncTTLCache(
+            maxsize=1024,
+            ttl=device_cache_ttl,
+        )
+
+        # Keyed by market and normalized search query; see `search_key`
+        self.search_cache = search_cache or TrackCache(
+            max_entries=10_000,
+            max_bytes=4 * 1024 * 1024,
+            ttl=3600,
+        )
+
+        # Keyed by track id; track metadata is effectively immutable
+        self.track_cache = track_cache or TrackCache(
+            max_entries=10_000,
+            max_bytes=8 * 1024 * 1024,
+            ttl=86400,
+        )
+
+    @classmethod
+    def from_configuration(cls, configuration: Configuration, http_clients: HttpClients) -> "SpotifyClient":
+        return cls(
+            configuration.spotify_client_id,
+            configuration.spotify_client_secret,
+            http_clients,
+            device_cache_ttl=configuration.spotify_device_cache_ttl,
+            search_cache=TrackCache(
+                max_entries=configuration.spotify_search_cache_max_entries,
+                max_bytes=configuration.spotify_search_cache_max_bytes,
+                ttl=configuration.spotify_search_cache_ttl,
+            ),
+            track_cache=TrackCache(
+                max_entries=configuration.spotify_track_cache_max_entries,
+                max_bytes=configuration.spotify_track_cache_max_bytes,
+                ttl=configuration.spotify_track_cache_ttl,
+            ),
+            search_limit=configuration.spotify_search_limit,
+            search_market=configuration.spotify_search_market,
+        )
+
+    @property
+    def api(self) -> httpx.AsyncClient:
+        return self.http_clients.get(SPOTIFY_API_URL)
+
+    @property
+    def accounts(self) -> httpx.AsyncClient:
+        return self.http_clients.get(SPOTIFY_ACCOUNTS_URL)
+
+    def check_player_response(self, access_token: str, response: httpx.Response) -> None:
+        # Spotify responds with a 404 when there's no active device; the cached
+        # device list is stale at that point. Other 404s (e.g. an unknown
+        # track) are errors like any other
+        if response.status_code == 404 and player_error_reason(response) == "NO_ACTIVE_DEVICE":
+            self.device_cache.invalidate(access_token)
+            raise NoActiveDeviceException()
+
+        response.raise_for_status()
 
     async def exchange_code_for_token(self, redirect_uri: str, code: str) -> OAuthToken:
-        url = "https://accounts.spotify.com/api/token"
+        url = "/api/token"
 
         data = {
             "client_id": self.client_id,
@@ -56,18 +169,18 @@ class SpotifyClient(OAuthClient):
             "redirect_uri": redirect_uri,
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                headers={"Content-Type": "application/x-www-form-urlencoded"},
-                data=data,
-            )
+        response = await self.accounts.post(
+            url,
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            data=data,
+        )
 
-            response.raise_for_status()
-            return OAuthToken(**response.json())
+        response.raise_for_status()
+        return OAuthToken.model_validate_json(response.content)
     
+    @coalesced
     async def refresh_token(self, refresh_token: str) -> OAuthToken:
-        url = "https://accounts.spotify.com/api/token"
+        url = "/api/token"
         auth = b64encode(f"{self.client_id}:{self.client_secret}".encode()).decode()
 
         data = {
@@ -76,127 +189,180 @@ class SpotifyClient(OAuthClient):
             "refresh_token": refresh_token,
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                headers={
-                    "Content-Type": "application/x-www-form-urlencoded",
-                    "Authorization": f"Basic {auth}",
-                },
-                data=data,
-                timeout=4,
-            )
-
-            response.raise_for_status()
-            return OAuthToken(**response.json())
+        response = await self.accounts.post(
+            url,
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+                "Authorization": f"Basic {auth}",
+            },
+            data=data,
+            timeout=4,
+        )
+
+        response.raise_for_status()
+        return OAuthToken.model_validate_json(response.content)
     
-    @cached(TTL_CACHE)
     async def get_available_devices(self, access_token: str) -> AvailableDevicePayload:
-        url = "https://api.spotify.com/v1/me/player/devices"
+        return await self.device_cache.get_or_load(
+            access_token,
+            lambda: self.fetch_available_devices(access_token),
+        )
+
+    @coalesced
+    async def fetch_available_devices(self, access_token: str) -> AvailableDevicePayload:
+        url = "/v1/me/player/devices"
         headers = {
             "Authorization": f"Bearer {access_token}",
         }
     
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
-            response.raise_for_status()
+        response = await self.api.get(url, headers=headers)
+        response.raise_for_status()
 
-            return AvailableDevicePayload(**response.json())
+        return AvailableDevicePayload.model_validate_json(response.content)
 
-    async def get_current_song(self, access_token: str, device_id: str) -> CurrentlyPlaying:
-        url = "https://api.spotify.com/v1/me/player/currently-playing"
+    @coalesced
+    async def get_current_song(self, access_token: str, device_id: str | None = None) -> CurrentlyPlaying | None:
+        url = "/v1/me/player/currently-playing"
         headers = {
             "Authorization": f"Bearer {access_token}",
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
-            response.raise_for_status()
+        response = await self.api.get(url, headers=headers)
+        response.raise_for_status()
 
-            return CurrentlyPlaying(**response.json())
+        # Spotify responds with 204 No Content when nothing is playing
+        if response.status_code == 204 or not response.content:
+            return None
+
+        return CurrentlyPlaying.model_validate_json(response.content)
     
-    async def get_next_songs(self, access_token: str, device_id: str) -> QueuePayload:
-        url = "https://api.spotify.com/v1/me/player/queue"
+    @coalesced
+    async def get_next_songs(self, access_token: str, device_id: str | None = None) -> QueuePayload:
+        url = "/v1/me/player/queue"
         headers = {
             "Authorization": f"Bearer {access_token}",
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
-            response.raise_for_status()
+        response = await self.api.get(url, headers=headers)
+        self.check_player_response(access_token, response)
 
-            return QueuePayload(**response.json())
+        return QueuePayload.model_validate_json(response.content)
     
     async def pause_song(self, access_token: str) -> None:
-        url = "https://api.spotify.com/v1/me/player/pause"
+        url = "/v1/me/player/pause"
         headers = {
             "Authorization": f"Bearer {access_token}",
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.put(url, headers=headers)
-            response.raise_for_status()
+        response = await self.api.put(url, headers=headers)
+        self.check_player_response(access_token, response)
 
     async def resume_song(self, access_token: str) -> None:
-        url = "https://api.spotify.com/v1/me/player/play"
+        url = "/v1/me/player/play"
         headers = {
             "Authorization": f"Bearer {access_token}",
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.put(url, headers=headers)
-            response.raise_for_status()
+        response = await self.api.put(url, headers=headers)
+        self.check_player_response(access_token, response)
 
     async def skip_song(self, access_token: str) -> None:
-        url = "https://api.spotify.com/v1/me/player/next"
+        url = "/v1/me/player/next"
         headers = {
             "Authorization": f"Bearer {access_token}",
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers)
-            response.raise_for_status()
+        response = await self.api.post(url, headers=headers)
+        self.check_player_response(access_token, response)
     
+    @coalesced
     async def search_songs(self, access_token: str, query: str) -> SearchPayload:
-        url = "https://api.spotify.com/v1/search"
+        url = "/v1/search"
         headers = {
             "Authorization": f"Bearer {access_token}",
         }
 
+        # Only the tracks are used; asking for artists and albums as well more
+        # than triples the response size
         query_params = {
             "q": query,
-            "type": "track,artist,album",
+            "type": "track",
+            "limit": self.search_limit,
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers, params=query_params)
-            response.raise_for_status()
+        if self.search_market:
+            query_params["market"] = self.search_market
+
+        response = await self.api.get(url, headers=headers, params=query_params)
+        response.raise_for_status()
 
-            return SearchPayload(**response.json())
+        return SearchPayload.model_validate_json(response.content)
     
+    def search_key(self, query: str, access_token: str | None = None) -> Hashable | None:
+        """
+        Search results depend on the market. A configured market is shared by
+        all users; with `from_token` the market is the user's own, so results
+        are only reused for the same access token.
+        """
+        if self.search_market == "from_token":
+            return ("from_token", access_token, normalize_query(query)) if access_token else None
+
+        return (self.search_market, normalize_query(query))
+
+    def get_cached_search(self, query: str, access_token: str | None = None) -> Track | None:
+        key = self.search_key(query, access_token)
+        return self.search_cache.get(key) if key else None
+
+    async def search_track(self, access_token: str, query: str) -> Track | None:
+        """
+        Returns the first track matching the query.
+        """
+        key = self.search_key(query, access_token)
+        track = self.search_cache.get(key)
+
+        if track:
+            return track
+
+        search_payload = await self.search_songs(access_token, query)
+        track = next(iter(search_payload.tracks.items), None)
+
+        if track:
+            self.search_cache.set(key, track)
+            self.track_cache.set(track_id_from_uri(track.uri), track)
+
+        return track
+
     async def get_track(self, access_token: str, track_id: str) -> Track:
-        url = f"https://api.spotify.com/v1/tracks/{track_id}"
+        track = self.track_cache.get(track_id)
+
+        if not track:
+            track = await self.fetch_track(access_token, track_id)
+            self.track_cache.set(track_id, track)
+
+        return track
+
+    @coalesced
+    async def fetch_track(self, access_token: str, track_id: str) -> Track:
+        url = f"/v1/tracks/{track_id}"
         headers = {
             "Authorization": f"Bearer {access_token}",
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
-            response.raise_for_status()
+        response = await self.api.get(url, headers=headers)
+        response.raise_for_status()
 
-            return Track(**response.json())
+        return Track.model_validate_json(response.content)
     
     async def enqueue_song(self, access_token: str, uri: str) -> None:
-        url = "https://api.spotify.com/v1/me/player/queue"
+        url = "/v1/me/player/queue"
         headers = {
             "Authorization": f"Bearer {access_token}",
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url, 
-                headers=headers, 
-                params={"uri": uri},
-            )
-            
-            response.raise_for_status()
+        response = await self.api.post(
+            url, 
+            headers=headers, 
+            params={"uri": uri},
+        )
+
+        self.check_player_response(access_token, response)
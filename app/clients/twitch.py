@@ -1,6 +1,8 @@
 from pydantic import BaseModel, ConfigDict
 import httpx
 
+from app.cache import SingleFlight, coalesced
+from app.clients.http import TWITCH_API_URL, TWITCH_ID_URL, HttpClients
 from app.models.oauth_token import OAuthToken
 from app.models.twitch import ChannelChatMessageSubscriptionCondition, EventSubConditionBase, EventType, TransportMethod
 from app.clients.oauth_client import OAuthClient
@@ -56,14 +58,23 @@ class TwitchClient(OAuthClient):
         self,
         client_id: str,
         client_secret: str,
+        http_clients: HttpClients | None = None,
     ) -> None:
         self.client_id = client_id
         self.client_secret = client_secret
-        self.url = "https://api.twitch.tv/helix"
-        self.client = httpx.AsyncClient()
-    
+        self.http_clients = http_clients or HttpClients()
+        self.single_flight = SingleFlight()
+
+    @property
+    def api(self) -> httpx.AsyncClient:
+        return self.http_clients.get(TWITCH_API_URL)
+
+    @property
+    def id(self) -> httpx.AsyncClient:
+        return self.http_clients.get(TWITCH_ID_URL)
+
     async def exchange_code_for_token(self, redirect_uri: str, code: str) -> OAuthToken:
-        url = "https://id.twitch.tv/oauth2/token"
+        url = "/oauth2/token"
 
         data = {
             "client_id": self.client_id,
@@ -73,18 +84,18 @@ class TwitchClient(OAuthClient):
             "redirect_uri": redirect_uri,
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                headers={"Content-Type": "application/x-www-form-urlencoded"},
-                data=data,
-            )
+        response = await self.id.post(
+            url,
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            data=data,
+        )
 
-            response.raise_for_status()
-            return OAuthToken(**response.json())
+        response.raise_for_status()
+        return OAuthToken(**response.json())
 
+    @coalesced
     async def refresh_token(self, refresh_token: str) -> OAuthToken:
-        url = "https://id.twitch.tv/oauth2/token"
+        url = "/oauth2/token"
 
         data = {
             "client_id": self.client_id,
@@ -93,60 +104,58 @@ class TwitchClient(OAuthClient):
             "refresh_token": refresh_token,
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                headers={"Content-Type": "application/x-www-form-urlencoded"},
-                data=data,
-                timeout=4,
-            )
+        response = await self.id.post(
+            url,
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            data=data,
+            timeout=4,
+        )
 
-            response.raise_for_status()
-            return response.json()
+        response.raise_for_status()
+        return OAuthToken(**response.json())
         
+    @coalesced
     async def validate_token(self, token: str) -> TokenValidationResponse:
-        url = "https://id.twitch.tv/oauth2/validate"
+        url = "/oauth2/validate"
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                url,
-                headers={"Authorization": f"Bearer {token}"},
-            )
+        response = await self.id.get(
+            url,
+            headers={"Authorization": f"Bearer {token}"},
+        )
 
-            response.raise_for_status()
-            return TokenValidationResponse(**response.json())
+        response.raise_for_status()
+        return TokenValidationResponse(**response.json())
     
+    @coalesced
     async def get_client_credentials(self) -> ClientCredentials:
-        url = "https://id.twitch.tv/oauth2/token"
-
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                data={
-                    "client_id": self.client_id,
-                    "client_secret": self.client_secret,
-                    "grant_type": "client_credentials",
-                },
-            )
-
-            response.raise_for_status()
-            return ClientCredentials(**response.json())
+        url = "/oauth2/token"
+
+        response = await self.id.post(
+            url,
+            data={
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+                "grant_type": "client_credentials",
+            },
+        )
+
+        response.raise_for_status()
+        return ClientCredentials(**response.json())
     
     async def subscribe_to_event(self, subscription: EventSubSubscription) -> EventSubSubscription:
-        url = "https://api.twitch.tv/helix/eventsub/subscriptions"
+        url = "/helix/eventsub/subscriptions"
 
         # get an access token
         client_credentials = await self.get_client_credentials()
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                headers={
-                    "Authorization": f"Bearer {client_credentials.access_token}",
-                    "Client-ID": self.client_id,
-                },
-                json=subscription.model_dump(),
-            )
-
-            response.raise_for_status()
-            return EventSubSubscription(**response.json())
+        response = await self.api.post(
+            url,
+            headers={
+                "Authorization": f"Bearer {client_credentials.access_token}",
+                "Client-ID": self.client_id,
+            },
+            json=subscription.model_dump(),
+        )
+
+        response.raise_for_status()
+        return EventSubSubscription(**response.json())
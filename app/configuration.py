@@ -39,3 +39,71 @@ class Configuration(BaseSettings):
     
     is_local: bool = False
     jwt_expiration: int = 3600
+
+    # Asymmetric session JWTs ("EdDSA" or "ES256"); see JwtKeyring. The keys
+    # are a JWK set (JSON) of private keys, published at /.well-known/jwks.json
+    jwt_algorithm: str = "HS256"
+    jwt_signing_keys: str | None = None
+    jwt_signing_key_id: str | None = None
+    jwks_max_age: int = 300
+
+    # Per-host connection pool limits and timeouts for upstream HTTP clients
+    http_max_connections: int = 20
+    http_max_keepalive_connections: int = 10
+    http_keepalive_expiry: float = 60.0
+    http_timeout: float = 5.0
+    http_connect_timeout: float = 2.0
+    http2: bool = False # requires the `h2` package
+    http_warmup: bool = True
+
+    spotify_search_limit: int = 1
+    # "from_token" searches in each user's own market, so cached results aren't
+    # shared between users; a fixed market (e.g. "US") shares them
+    spotify_search_market: str | None = "from_token"
+    spotify_device_cache_ttl: float = 5.0
+    spotify_search_cache_ttl: float = 3600.0
+    spotify_search_cache_max_entries: int = 10_000
+    spotify_search_cache_max_bytes: int = 4 * 1024 * 1024
+    spotify_track_cache_ttl: float = 86400.0
+    spotify_track_cache_max_entries: int = 10_000
+    spotify_track_cache_max_bytes: int = 8 * 1024 * 1024
+    now_playing_max_ttl: float = 30.0
+    now_playing_stream_queue_size: int = 8
+    now_playing_stream_keepalive: float = 15.0
+
+    # Playback polling; see PollScheduler
+    poll_min_interval: float = 2.0
+    poll_max_interval: float = 30.0
+    poll_max_backoff: float = 60.0
+    poll_idle_timeout: float = 300.0
+    poll_max_concurrency: int = 10
+
+    # Background OAuth token refresh; see TokenRefresher
+    token_refresh_interval: float = 60.0
+    token_refresh_window: int = 600
+    token_refresh_concurrency: int = 5
+    token_refresh_jitter: float = 10.0
+    token_refresh_batch_size: int = 500
+    token_refresh_max_backoff: float = 3600.0
+    token_refresh_lease: float = 10.0
+    token_refresh_wait: float = 5.0
+
+    # Access token cache warmup at startup; see warm_access_tokens
+    token_warmup: bool = False
+    token_warmup_budget: float = 5.0
+    token_warmup_active_days: int = 7
+    token_warmup_batch_size: int = 500
+
+    # API token authentication
+    api_token_cache_max_entries: int = 10_000
+    api_token_cache_ttl: float = 300.0
+    api_token_negative_cache_ttl: float = 30.0
+    # Seconds between writes of an API token's last_used_at, per worker
+    api_token_last_used_interval: float = 3600.0
+
+    # Seconds a rotated session refresh token keeps resolving to its successor
+    refresh_token_grace_period: float = 10.0
+
+    # Cross-worker cache invalidation; see InvalidationBus
+    invalidation_reconnect_delay: float = 1.0
+    invalidation_keepalive: float = 30.0
@@ -4,6 +4,8 @@ import logging
 from fastapi import Request
 from fastapi.responses import JSONResponse
 
+from app.exceptions import NoActiveDeviceException, TokenRefreshPendingException
+
 
 logger = logging.getLogger(__name__)
 
@@ -19,3 +21,18 @@ def exception_handler(_: Request, exc: Exception) -> JSONResponse:
         status_code=500, 
         content={"error": "Internal server error"}
     )
+
+
+def no_active_device_handler(_: Request, __: NoActiveDeviceException) -> JSONResponse:
+    return JSONResponse(
+        status_code=200,
+        content={"message": "No active device found"},
+    )
+
+
+def token_refresh_pending_handler(_: Request, __: TokenRefreshPendingException) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"message": "Token refresh in progress, try again shortly"},
+        headers={"Retry-After": "1"},
+    )
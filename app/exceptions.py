@@ -0,0 +1,15 @@
+class NoActiveDeviceException(Exception):
+    """
+    Raised when a Spotify player command fails because the user has no active
+    device.
+    """
+    pass
+
+
+class TokenRefreshPendingException(Exception):
+    """
+    Raised when a user's token has expired and another worker's refresh of it
+    didn't finish in time, or the provider couldn't be reached to refresh it;
+    the request can be retried shortly.
+    """
+    pass
@@ -1,20 +1,134 @@
 from __future__ import annotations
+from dataclasses import dataclass
+import functools
+import hashlib
 import json
-from typing import Self
+import time
+from typing import TYPE_CHECKING, Any, Callable, Self
+from cachetools import TLRUCache
 from fastapi import HTTPException, Request
 
 from joserfc import jwt, errors
+from joserfc.jwk import GuestProtocol, Key, KeySet, OctKey
 import pendulum
 from pydantic import BaseModel
 
+from app.cache import CacheStats
+
+if TYPE_CHECKING:
+    from app.configuration import Configuration
+
+
+ASYMMETRIC_ALGORITHMS = ("EdDSA", "ES256")
+
 
 class TokenException(Exception):
     pass
 
 
+@functools.lru_cache(maxsize=8)
+def import_key(secret: str | bytes) -> OctKey:
+    return OctKey.import_key(secret)
+
+
+def signing_key(key: str | bytes | OctKey) -> OctKey:
+    return key if isinstance(key, OctKey) else import_key(key)
+
+
+class JwtKeyring:
+    """
+    Keys for asymmetrically signed (EdDSA or ES256) JWTs, which other services
+    can verify with the public keys alone.
+
+    The signing key is the first in `keys` unless `signing_key_id` is given;
+    every key verifies. To rotate, publish the new key (verification only) for
+    at least the JWKS max-age, then sign with it, and drop the old key once its
+    tokens have expired. JWTs without a key ID are verified against the HS256
+    `secret`, so sessions from before the switch stay valid.
+    """
+    def __init__(
+        self,
+        algorithm: str,
+        keys: KeySet,
+        signing_key_id: str | None = None,
+        secret: OctKey | None = None,
+    ) -> None:
+        if algorithm not in ASYMMETRIC_ALGORITHMS:
+            raise ValueError(f"Unsupported JWT algorithm: {algorithm}")
+
+        if not keys.keys:
+            raise ValueError("No JWT signing keys configured")
+
+        self.algorithm = algorithm
+        self.keys = keys
+        self.signing_key: Key = keys.get_by_kid(signing_key_id) if signing_key_id else keys.keys[0]
+        self.secret = secret
+        self.algorithms = [algorithm, "HS256"] if secret else [algorithm]
+
+    @classmethod
+    def from_configuration(cls, configuration: Configuration) -> JwtKeyring | None:
+        if configuration.jwt_algorithm == "HS256":
+            return None
+
+        if not configuration.jwt_signing_keys:
+            raise ValueError(f"jwt_signing_keys is required for {configuration.jwt_algorithm}")
+
+        return cls(
+            configuration.jwt_algorithm,
+            # keys without a `kid` get their thumbprint
+            KeySet.import_key_set(json.loads(configuration.jwt_signing_keys)),
+            signing_key_id=configuration.jwt_signing_key_id,
+            secret=import_key(configuration.jwt_secret_key),
+        )
+
+    def header(self, header: dict[str, Any]) -> dict[str, Any]:
+        return {**header, "alg": self.algorithm, "kid": self.signing_key.kid}
+
+    def verification_key(self, token: GuestProtocol) -> Key:
+        header = token.headers()
+        kid = header.get("kid")
+
+        if kid is None:
+            if self.secret and header.get("alg") == "HS256":
+                return self.secret
+
+            raise errors.InvalidKeyIdError()
+
+        return self.keys.get_by_kid(kid)
+
+    def public_keys(self) -> list[dict[str, Any]]:
+        return [
+            {**key.as_dict(private=False), "use": "sig", "alg": self.algorithm}
+            for key in self.keys.keys
+        ]
+
+
+JwtKey = str | bytes | OctKey | JwtKeyring
+
+
+@dataclass(frozen=True)
+class Jwks:
+    """
+    The serialized public key set, built once and served as is.
+    """
+    body: bytes
+    etag: str
+
+    @classmethod
+    def from_keyring(cls, keyring: JwtKeyring | None) -> Jwks:
+        keys = keyring.public_keys() if keyring else []
+        body = json.dumps({"keys": keys}, separators=(",", ":")).encode("utf-8")
+
+        return cls(
+            body=body,
+            etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+        )
+
+
 class JwtHeader(BaseModel):
     alg: str = "HS256"
     typ: str = "JWT"
+    kid: str | None = None
 
 
 class JwtPayload(BaseModel):
@@ -42,17 +156,30 @@ class Jwt(BaseModel):
             ),
         )
     
-    def encode(self, secret: str) -> str:
+    def encode(self, key: JwtKey) -> str:
+        header = self.header.model_dump(exclude_none=True)
+
+        if isinstance(key, JwtKeyring):
+            return jwt.encode(
+                key.header(header),
+                self.claims.model_dump(),
+                key.signing_key,
+                algorithms=[key.algorithm],
+            )
+
         return jwt.encode(
-            self.header.model_dump(),
+            header,
             self.claims.model_dump(),
-            secret,
+            signing_key(key),
         )
     
     @classmethod
-    def decode(cls, token: str, secret: str) -> Jwt:
+    def decode(cls, token: str, key: JwtKey) -> Jwt:
         try:
-            decoded_jwt = jwt.decode(token, secret)
+            if isinstance(key, JwtKeyring):
+                decoded_jwt = jwt.decode(token, key.verification_key, algorithms=key.algorithms)
+            else:
+                decoded_jwt = jwt.decode(token, signing_key(key))
         except errors.JoseError as e:
             raise TokenException(
                 f" Invalid token: {e}",
@@ -85,6 +212,50 @@ class AccessToken(BaseModel):
             ) from e
 
 
+class VerifiedJwtCache:
+    """
+    Maps a session cookie to its already verified JWT, so a cookie seen again
+    skips parsing and signature verification. Keyed by a digest of the cookie;
+    entries expire with the JWT.
+    """
+    def __init__(self, maxsize: int = 10_000, timer: Callable[[], float] = time.time) -> None:
+        self.tokens: TLRUCache = TLRUCache(
+            maxsize=maxsize,
+            ttu=lambda _key, jwt, _now: jwt.claims.exp,
+            timer=timer,
+        )
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(cookie: str) -> bytes:
+        return hashlib.sha256(cookie.encode("utf-8")).digest()
+
+    def get(self, cookie: str) -> Jwt | None:
+        jwt = self.tokens.get(self.key(cookie))
+
+        if jwt:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        return jwt
+
+    def set(self, cookie: str, jwt: Jwt) -> None:
+        self.tokens[self.key(cookie)] = jwt
+
+    def clear(self) -> None:
+        self.tokens.clear()
+
+    @property
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            size=len(self.tokens),
+        )
+
+
 def jwt_dependency(request: Request) -> Jwt:
     try:
         jwt: Jwt = request.state.jwt
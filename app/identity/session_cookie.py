@@ -0,0 +1,57 @@
+from __future__ import annotations
+from dataclasses import dataclass
+
+from pydantic import ValidationError
+
+from app.identity.jwt import AccessToken, TokenException
+
+
+VERSION = "v1"
+
+
+@dataclass(frozen=True)
+class SessionCookie:
+    """
+    The `access_token` cookie: `v1.<refresh token>.<jwt>`. Both tokens are
+    already base64url, so the cookie needs no quoting and is parsed with a
+    single split; the JWT is the remainder, dots and all.
+
+    Cookies in the previous format, a JSON `AccessToken`, are still read.
+    """
+    refresh_token: str
+    access_token: str
+
+    @classmethod
+    def from_access_token(cls, access_token: AccessToken) -> SessionCookie:
+        return cls(
+            refresh_token=access_token.refresh_token,
+            access_token=access_token.access_token,
+        )
+
+    def encode(self) -> str:
+        return f"{VERSION}.{self.refresh_token}.{self.access_token}"
+
+    @classmethod
+    def decode(cls, cookie: str) -> SessionCookie:
+        if cookie.startswith("{"):
+            return cls.decode_legacy(cookie)
+
+        version, _, rest = cookie.partition(".")
+        refresh_token, _, access_token = rest.partition(".")
+
+        if version != VERSION or not refresh_token or not access_token:
+            raise TokenException("Invalid session cookie")
+
+        return cls(
+            refresh_token=refresh_token,
+            access_token=access_token,
+        )
+
+    @classmethod
+    def decode_legacy(cls, cookie: str) -> SessionCookie:
+        try:
+            return cls.from_access_token(AccessToken.from_json(cookie))
+        except ValidationError as e:
+            raise TokenException(
+                f"Invalid session cookie: {e}",
+            ) from e
@@ -1,8 +1,8 @@
 from app.api import api
 
 # routes
+from app.routers.api_token import create_api_token
 from app.routers.healthcheck import healthcheck
+from app.routers.jwks import jwks
+from app.routers.metrics import cache_metrics
 from app.routers.userinfo import userinfo
-
-# middleware
-from app.middleware.jwt_middleware import jwt_middleware
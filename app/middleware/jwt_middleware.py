@@ -1,63 +1,118 @@
-from typing import Any
-from fastapi import HTTPException, Request, Response
+from typing import Iterable
+
+from fastapi import Request, Response
 import pendulum
-from app.api import api
-from app.configuration import Configuration
-from app.identity.jwt import AccessToken, Jwt, TokenException
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.identity.jwt import Jwt, TokenException
+from app.identity.session_cookie import SessionCookie
 from app.services.identity import Identity
 
 
-@api.middleware("http")
-async def jwt_middleware(request: Request, call_next: Any) -> Response:
-    configuration: Configuration = request.app.state.configuration
-    identity: Identity = request.app.state.identity
-
-    new_access_token: AccessToken | None = None
-    now = pendulum.now()
-    
-    if hasattr(request.state, "jwt"):
-        del request.state.jwt
-    
-    # get the jwt cookie from the request
-    access_token_raw = request.cookies.get("access_token")
-
-    if not access_token_raw:
-        return await call_next(request)
-    
-    try:
-        access_token: AccessToken = AccessToken.from_json(access_token_raw)
-        jwt: Jwt = Jwt.decode(access_token.access_token, configuration.jwt_secret_key)
-    except TokenException:
-        response: Response = await call_next(request)
-        response.delete_cookie("access_token")
-        
-        return response
-
-    # check the jwt for expiration; if it's expired,
-    # try to refresh it
-    if jwt.claims.exp < now.int_timestamp:
-        new_access_token = await identity.refresh_token(access_token.refresh_token)
-        
-        # If the refresh token is invalid, we should delete the cookie
-        if not new_access_token:
-            response: Response = await call_next(request)
-            response.delete_cookie("access_token")
-            
-            return response
-        
-    # Set request state to the new jwt
-    request.state.jwt = jwt
-    response: Response = await call_next(request)
-
-    # If we have a new access token, we should set the cookie
-    if new_access_token:
-        response.set_cookie(
-            "access_token",
-            new_access_token.access_token,
-            max_age=new_access_token.expires_in,
-            httponly=True,
-            secure=False,
-            # samesite="lax",
-        )
-    
-    return response
+# Routes that use the session cookie; everything else (the API token routes,
+# webhooks, health checks) skips the middleware entirely
+SESSION_PATHS = (
+    "/userinfo",
+    "/api-token",
+    "/oauth/spotify",
+    "/twitch/subscribe-me-bitch",
+)
+
+
+class JwtMiddleware:
+    """
+    Reads the session cookie into `request.state.jwt`, refreshing the JWT when
+    it has expired. A plain ASGI middleware, so requests to paths outside of
+    `session_paths` pass straight through.
+    """
+    def __init__(self, app: ASGIApp, session_paths: Iterable[str] = SESSION_PATHS) -> None:
+        self.app = app
+
+        session_paths = [path.rstrip("/") for path in session_paths]
+        self.session_paths = frozenset(session_paths)
+        self.session_path_prefixes = tuple(f"{path}/" for path in session_paths)
+
+    def needs_session(self, path: str) -> bool:
+        return path in self.session_paths or path.startswith(self.session_path_prefixes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.needs_session(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
+        cookies = await self.authenticate(request)
+
+        if not cookies:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookies(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+
+                for value in cookies:
+                    headers.append("set-cookie", value)
+
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookies)
+
+    async def authenticate(self, request: Request) -> list[str]:
+        """
+        Sets `request.state.jwt` from the session cookie. Returns the
+        `set-cookie` headers to add to the response.
+        """
+        identity: Identity = request.app.state.identity
+        cookie = Response()
+
+        if hasattr(request.state, "jwt"):
+            del request.state.jwt
+
+        # get the jwt cookie from the request
+        access_token_raw = request.cookies.get("access_token")
+
+        if not access_token_raw:
+            return []
+
+        # A cookie we've already verified, and whose JWT hasn't expired
+        jwt = identity.verified_jwts.get(access_token_raw)
+
+        if jwt:
+            request.state.jwt = jwt
+            return []
+
+        try:
+            session = SessionCookie.decode(access_token_raw)
+            jwt = Jwt.decode(session.access_token, identity.jwt_key)
+        except TokenException:
+            cookie.delete_cookie("access_token")
+            return cookie.headers.getlist("set-cookie")
+
+        # check the jwt for expiration; if it's expired,
+        # try to refresh it
+        if jwt.claims.exp < pendulum.now().int_timestamp:
+            new_access_token = await identity.refresh_token(session.refresh_token)
+
+            # If the refresh token is invalid, we should delete the cookie
+            if not new_access_token:
+                cookie.delete_cookie("access_token")
+                return cookie.headers.getlist("set-cookie")
+
+            access_token_raw = SessionCookie.from_access_token(new_access_token).encode()
+            jwt = Jwt.decode(new_access_token.access_token, identity.jwt_key)
+            cookie.set_cookie(
+                "access_token",
+                access_token_raw,
+                max_age=new_access_token.expires_in,
+                httponly=True,
+                secure=False,
+                # samesite="lax",
+            )
+
+        # Set request state to the new jwt
+        request.state.jwt = jwt
+        identity.verified_jwts.set(access_token_raw, jwt)
+
+        return cookie.headers.getlist("set-cookie")
@@ -1,3 +1,5 @@
+from typing import Self
+
 from pydantic import BaseModel
 
 
@@ -25,9 +27,36 @@ class Track(BaseModel):
     album: Album
     artists: list[Artist]
     uri: str
+    duration_ms: int | None = None
 
 
 class CurrentlyPlaying(BaseModel):
     currently_playing_type: str
     is_playing: bool
     item: Track
+    progress_ms: int | None = None
+
+    @property
+    def duration_ms(self) -> int | None:
+        return self.item.duration_ms
+
+    @property
+    def remaining_ms(self) -> int | None:
+        if self.progress_ms is None or self.duration_ms is None:
+            return None
+
+        return max(self.duration_ms - self.progress_ms, 0)
+
+
+class Song(BaseModel):
+    album_title: str
+    song_title: str
+    artists: str
+
+    @classmethod
+    def from_currently_playing_item(cls, currently_playing: Track) -> Self:
+        return cls(
+            album_title=currently_playing.album.name,
+            song_title=currently_playing.name,
+            artists=", ".join(artist.name for artist in currently_playing.artists),
+        )
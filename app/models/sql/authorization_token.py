@@ -16,6 +16,8 @@ class AuthorizationToken(Model):
     refresh_token = fields.TextField()
     invalid_token = fields.BooleanField(default=False)
     expires_at = fields.DatetimeField()
+    refresh_lease_until = fields.DatetimeField(null=True)
 
     class Meta:
         table = "authorization_token"
+        unique_together = (("user", "origin"),)
@@ -0,0 +1 @@
+from app.repositories.tokens import ApiTokenAuthorization, AuthorizationTokenRecord, TokenRepository
@@ -0,0 +1,179 @@
+from datetime import datetime
+from typing import Any, AsyncIterator
+
+from tortoise import connections
+
+from app.models.sql.authorization_token import Origin
+
+
+API_TOKEN = """
+SELECT user_id FROM api_token WHERE token_hash = $1 AND invalidated_at IS NULL
+"""
+
+AUTHORIZATION_TOKEN = """
+SELECT id, user_id, origin, access_token, refresh_token, invalid_token, expires_at
+FROM authorization_token
+WHERE user_id = $1 AND origin = $2
+"""
+
+# API token -> user -> authorization token in one round trip
+API_TOKEN_AUTHORIZATION = """
+SELECT
+    api_token.user_id,
+    authorization_token.id,
+    authorization_token.origin,
+    authorization_token.access_token,
+    authorization_token.refresh_token,
+    authorization_token.invalid_token,
+    authorization_token.expires_at
+FROM api_token
+LEFT JOIN authorization_token
+    ON authorization_token.user_id = api_token.user_id
+    AND authorization_token.origin = $2
+WHERE api_token.token_hash = $1 AND api_token.invalidated_at IS NULL
+"""
+
+
+# Valid tokens of users who've signed in to the dashboard or used an API
+# token (the overlay) since $2. Not when the token was last written: the
+# background refresher rewrites every valid token, active user or not
+ACTIVE_AUTHORIZATION_TOKENS = """
+SELECT id, user_id, origin, access_token, refresh_token, invalid_token, expires_at
+FROM authorization_token
+WHERE NOT invalid_token
+    AND expires_at > $1
+    AND (
+        EXISTS (
+            SELECT 1 FROM refresh_token
+            WHERE refresh_token.user_id = authorization_token.user_id
+                AND refresh_token.created_at >= $2
+        )
+        OR EXISTS (
+            SELECT 1 FROM api_token
+            WHERE api_token.user_id = authorization_token.user_id
+                AND api_token.last_used_at >= $2
+        )
+    )
+LIMIT $3
+"""
+
+
+class AuthorizationTokenRecord:
+    """
+    A read-only row of `authorization_token`, with the same attributes as the
+    `AuthorizationToken` model.
+    """
+    __slots__ = ("id", "user_id", "origin", "access_token", "refresh_token", "invalid_token", "expires_at")
+
+    def __init__(
+        self,
+        id: int,
+        user_id: int,
+        origin: Origin,
+        access_token: str,
+        refresh_token: str,
+        invalid_token: bool,
+        expires_at: datetime,
+    ) -> None:
+        self.id = id
+        self.user_id = user_id
+        self.origin = origin
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.invalid_token = invalid_token
+        self.expires_at = expires_at
+
+    @classmethod
+    def from_row(cls, row: Any) -> "AuthorizationTokenRecord":
+        return cls(
+            row["id"],
+            row["user_id"],
+            Origin(row["origin"]),
+            row["access_token"],
+            row["refresh_token"],
+            row["invalid_token"],
+            row["expires_at"],
+        )
+
+
+class ApiTokenAuthorization:
+    __slots__ = ("user_id", "authorization_token")
+
+    def __init__(self, user_id: int, authorization_token: AuthorizationTokenRecord | None) -> None:
+        self.user_id = user_id
+        self.authorization_token = authorization_token
+
+
+class TokenRepository:
+    """
+    Hot-path token lookups, run directly on the asyncpg pool behind Tortoise.
+    asyncpg prepares and caches each statement per connection, and rows are
+    read into slotted records rather than ORM models.
+    """
+    def __init__(self, connection_name: str = "default") -> None:
+        self.connection_name = connection_name
+
+    async def fetchrow(self, query: str, *args: Any) -> Any:
+        client = connections.get(self.connection_name)
+
+        async with client.acquire_connection() as connection:
+            return await connection.fetchrow(query, *args)
+
+    async def get_api_token(self, token_hash: bytes) -> int | None:
+        """
+        The user an API token belongs to, if it's valid.
+        """
+        row = await self.fetchrow(API_TOKEN, token_hash)
+        return row["user_id"] if row else None
+
+    async def get_authorization_token(self, user_id: int, origin: Origin) -> AuthorizationTokenRecord | None:
+        row = await self.fetchrow(AUTHORIZATION_TOKEN, user_id, str(origin))
+        return AuthorizationTokenRecord.from_row(row) if row else None
+
+    async def get_api_token_authorization(self, token_hash: bytes, origin: Origin) -> ApiTokenAuthorization | None:
+        """
+        The user an API token belongs to, along with their authorization token
+        for `origin` if they have one.
+        """
+        row = await self.fetchrow(API_TOKEN_AUTHORIZATION, token_hash, str(origin))
+
+        if not row:
+            return None
+
+        return ApiTokenAuthorization(
+            row["user_id"],
+            AuthorizationTokenRecord.from_row(row) if row["id"] is not None else None,
+        )
+
+    async def stream_active_authorization_tokens(
+        self,
+        expires_after: datetime,
+        active_since: datetime,
+        limit: int,
+        batch_size: int,
+    ) -> AsyncIterator[list[AuthorizationTokenRecord]]:
+        """
+        Streams the valid authorization tokens of recently active users through
+        a server-side cursor, in batches of `batch_size`.
+        """
+        client = connections.get(self.connection_name)
+
+        async with client.acquire_connection() as connection:
+            async with connection.transaction():
+                batch: list[AuthorizationTokenRecord] = []
+
+                async for row in connection.cursor(
+                    ACTIVE_AUTHORIZATION_TOKENS,
+                    expires_after,
+                    active_since,
+                    limit,
+                    prefetch=batch_size,
+                ):
+                    batch.append(AuthorizationTokenRecord.from_row(row))
+
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+
+                if batch:
+                    yield batch
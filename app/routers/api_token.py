@@ -0,0 +1,23 @@
+from typing import Annotated
+from fastapi import Depends, Request
+from fastapi.responses import JSONResponse
+
+from app.api import api
+from app.identity.jwt import Jwt, jwt_dependency
+from app.services.authorization import Authorization
+
+
+@api.post("/api-token")
+async def create_api_token(request: Request, jwt: Annotated[Jwt, Depends(jwt_dependency)]) -> JSONResponse:
+    """
+    Issues a new API token, revoking the user's previous ones. Only the digest
+    is stored, so this response is the only time the token is shown.
+    """
+    authorization: Authorization = request.app.state.token_manager
+    token = await authorization.rotate_api_token(jwt.claims.user_id)
+
+    return JSONResponse(
+        status_code=201,
+        content={"token": token},
+        headers={"Cache-Control": "no-store"},
+    )
@@ -0,0 +1,25 @@
+from fastapi import Request, Response
+
+from app.api import api
+from app.configuration import Configuration
+from app.identity.jwt import Jwks
+
+
+@api.get("/.well-known/jwks.json")
+async def jwks(request: Request) -> Response:
+    configuration: Configuration = request.app.state.configuration
+    jwks: Jwks = request.app.state.identity.jwks
+
+    headers = {
+        "Cache-Control": f"public, max-age={configuration.jwks_max_age}",
+        "ETag": jwks.etag,
+    }
+
+    if request.headers.get("if-none-match") == jwks.etag:
+        return Response(status_code=304, headers=headers)
+
+    return Response(
+        content=jwks.body,
+        media_type="application/json",
+        headers=headers,
+    )
@@ -0,0 +1,17 @@
+from dataclasses import asdict
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+from app.api import api
+from app.cache import CacheRegistry
+
+
+@api.get("/metrics/caches")
+async def cache_metrics(request: Request) -> JSONResponse:
+    caches: CacheRegistry = request.app.state.caches
+
+    return JSONResponse(
+        status_code=200,
+        content={name: asdict(stats) for name, stats in caches.stats().items()},
+    )
@@ -10,6 +10,8 @@ from app.clients.twitch import TwitchClient
 from app.configuration import Configuration
 from app.identity.jwt import Jwt, jwt_dependency
 from app.services.authorization import Authorization
+from app.services.invalidation import InvalidationBus, InvalidationKind
+from app.services.now_playing import NowPlaying
 from app.models.sql.authorization_token import Origin
 from app.models.sql.user import User
 
@@ -47,10 +49,9 @@ async def spotify_oauth_callback(
 ) -> JSONResponse:
     configuration: Configuration = request.app.state.configuration
     authorization: Authorization = request.app.state.token_manager
-    spotify_client = SpotifyClient(
-        configuration.spotify_client_id,
-        configuration.spotify_client_secret,
-    )
+    spotify_client: SpotifyClient = request.app.state.spotify_client
+    now_playing: NowPlaying = request.app.state.now_playing
+    invalidation: InvalidationBus = request.app.state.invalidation
 
     user_id = jwt.claims.user_id
 
@@ -87,6 +88,10 @@ async def spotify_oauth_callback(
         token,
     )
 
+    # A newly linked account may be playing something else entirely
+    now_playing.invalidate(user_id)
+    await invalidation.publish(InvalidationKind.NowPlaying, user_id)
+
     # redirect to frontend
     return RedirectResponse(
         url=configuration.frontend_url,
@@ -6,6 +6,7 @@ import pendulum
 
 from app.clients.twitch import TwitchClient
 from app.configuration import Configuration
+from app.identity.session_cookie import SessionCookie
 from app.services.authorization import Authorization
 from app.models.sql.authorization_token import Origin
 from app.models.sql.user import User
@@ -29,10 +30,7 @@ async def twitch_oauth_callback(
     token_manager: Authorization = request.app.state.token_manager
     identity: Identity = request.app.state.identity
 
-    client = TwitchClient(
-        configuration.twitch_client_id, 
-        configuration.twitch_client_secret,
-    )
+    client: TwitchClient = request.app.state.twitch_client
 
     redirect_uri = configuration.redirect_host + "/oauth/twitch/callback"
     frontend_url = configuration.frontend_url.rstrip("/")
@@ -82,16 +80,16 @@ async def twitch_oauth_callback(
                 username=username,
             )
 
-        # Add the access token to the database and generate an API token
+        # Add the access token to the database; API tokens are issued on
+        # request, see /api-token
         await token_manager.upsert_access_token(Origin.Twitch, user.id, token)
-        await token_manager.generate_api_token(user.id)
 
         # Generate an access token for the user
         access_token = await identity.create_access_token(user)
 
         response.set_cookie(
             "access_token",
-            access_token.model_dump_json(),
+            SessionCookie.from_access_token(access_token).encode(),
             max_age=access_token.expires_in,
             httponly=True,
             secure=False,
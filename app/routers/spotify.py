@@ -1,101 +1,170 @@
-from typing import Annotated, Self
+import asyncio
+from dataclasses import dataclass
+from typing import Annotated
 from urllib.parse import urlparse
-from fastapi import Depends, HTTPException, Request, Response
-from fastapi.responses import JSONResponse
+import httpx
+from fastapi import Depends, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from app.clients.spotify import SpotifyClient
-from app.configuration import Configuration
-from app.models.spotify import Track
-from app.models.sql.api_token import ApiToken
+from app.exceptions import NoActiveDeviceException
+from app.models.spotify import CurrentlyPlaying, Device, Song, Track
 from app.models.sql.authorization_token import Origin
 
 from app.routers import spotify_router
-from app.services.authorization import Authorization
+from app.services.authorization import AuthenticatedApiToken, Authorization
+from app.services.invalidation import InvalidationBus, InvalidationKind
+from app.services.now_playing import NowPlaying
+from app.services.now_playing_stream import NowPlayingStream
+from app.services.scheduler import PollScheduler
 
 
-class Song(BaseModel):
-    album_title: str
-    song_title: str
-    artists: str
+# Give Spotify a moment to apply a player change before polling it again
+PLAYER_CHANGE_POLL_DELAY = 1.0
 
-    @classmethod
-    def from_currently_playing_item(cls, currently_playing: Track) -> Self:
-        return cls(
-            album_title=currently_playing.album.name,
-            song_title=currently_playing.name,
-            artists=", ".join(artist.name for artist in currently_playing.artists),
-        )
+PLAYER_STATE_FIELDS = {"current", "queue", "device"}
+
+
+class PlayerState(BaseModel):
+    current: Song | None = None
+    is_playing: bool | None = None
+    queue: list[Song] | None = None
+    device: Device | None = None
+
+
+@dataclass
+class PlayerContext:
+    """
+    Everything a Spotify route needs to talk to a user's player, resolved once
+    per request.
+    """
+    user_id: int
+    access_token: str
+    spotify_client: SpotifyClient
+    now_playing: NowPlaying
+    now_playing_stream: NowPlayingStream
+    poll_scheduler: PollScheduler
+    invalidation: InvalidationBus
+
+    async def player_changed(self) -> None:
+        self.now_playing.invalidate(self.user_id)
+        await self.invalidation.publish(InvalidationKind.NowPlaying, self.user_id)
 
+        # Only users with a stream open here are polled; don't start polling
+        # for anyone else
+        if self.now_playing_stream.has_subscribers(self.user_id):
+            self.poll_scheduler.touch(self.user_id, delay=PLAYER_CHANGE_POLL_DELAY)
 
-async def get_api_token(request: Request) -> ApiToken:
+
+async def get_api_token(request: Request) -> AuthenticatedApiToken:
+    authorization: Authorization = request.app.state.token_manager
     token = request.query_params.get("token")
 
     if not token:
         raise HTTPException(status_code=401, detail="Unauthorized")
     
-    api_token = await ApiToken.get_or_none(token=token)
+    # The user's Spotify token comes back in the same query
+    api_token = await authorization.authenticate_api_token(token, Origin.Spotify)
 
     if not api_token:
         raise HTTPException(status_code=401, detail="Unauthorized")
-    
+
     return api_token
 
 
-@spotify_router.get("/current-song")
-async def get_current_song(request: Request, api_token: Annotated[ApiToken, Depends(get_api_token)]) -> Song:
+def get_spotify_client(request: Request) -> SpotifyClient:
+    return request.app.state.spotify_client
+
+
+async def resolve_player_context(request: Request, api_token: AuthenticatedApiToken) -> PlayerContext:
     authorization: Authorization = request.app.state.token_manager
-    configuration: Configuration = request.app.state.configuration
-    spotify_client = SpotifyClient(
-        configuration.spotify_client_id,
-        configuration.spotify_client_secret,
+    access_token = await authorization.get_access_token(Origin.Spotify, api_token.user_id)
+
+    if not access_token:
+        raise HTTPException(status_code=403, detail="Spotify is not connected")
+
+    return PlayerContext(
+        user_id=api_token.user_id,
+        access_token=access_token,
+        spotify_client=request.app.state.spotify_client,
+        now_playing=request.app.state.now_playing,
+        now_playing_stream=request.app.state.now_playing_stream,
+        poll_scheduler=request.app.state.poll_scheduler,
+        invalidation=request.app.state.invalidation,
     )
 
-    access_token = await authorization.get_access_token(Origin.Spotify, api_token.user_id)
-    devices = await spotify_client.get_available_devices(access_token)
-    active_device = devices.active_device
 
-    if not active_device:
-        return Response(
-            status_code=200,
-            content={"message": "No active device found"},
-        )
+async def get_player_context(
+    request: Request,
+    api_token: Annotated[AuthenticatedApiToken, Depends(get_api_token)],
+) -> PlayerContext:
+    return await resolve_player_context(request, api_token)
 
-    current_song = await spotify_client.get_current_song(
-        access_token,
-        active_device.id,
-    )
 
-    return Song.from_currently_playing_item(current_song.item)
+# No device pre-checks in these routes; Spotify's own 404 on a player command
+# raises NoActiveDeviceException, which is handled in app.exception_handlers.
 
 
-@spotify_router.get("/next-song")
-async def get_next_songs(request: Request, api_token: Annotated[ApiToken, Depends(get_api_token)]) -> Song:
-    authorization: Authorization = request.app.state.token_manager
-    configuration: Configuration = request.app.state.configuration
-    spotify_client = SpotifyClient(
-        configuration.spotify_client_id,
-        configuration.spotify_client_secret,
-    )
+@spotify_router.get("/current-song")
+async def get_current_song(
+    request: Request,
+    api_token: Annotated[AuthenticatedApiToken, Depends(get_api_token)],
+) -> Song:
+    now_playing: NowPlaying = request.app.state.now_playing
+    song = now_playing.get(api_token.user_id)
 
-    access_token = await authorization.get_access_token(Origin.Spotify, api_token.user_id)
-    devices = await spotify_client.get_available_devices(access_token)
-    active_device = devices.active_device
+    if song:
+        return song
+
+    player = await resolve_player_context(request, api_token)
+    current_song = await player.spotify_client.get_current_song(player.access_token)
 
-    if not active_device:
-        return Response(
+    if not current_song:
+        return JSONResponse(
             status_code=200,
-            content={"message": "No active device found"},
+            content={"message": "No song is currently playing"},
         )
 
-    queue_payload = await spotify_client.get_next_songs(
-        access_token,
-        active_device.id,
+    return now_playing.update(player.user_id, current_song)
+
+
+@spotify_router.get("/now-playing/stream")
+async def now_playing_stream(
+    request: Request,
+    api_token: Annotated[AuthenticatedApiToken, Depends(get_api_token)],
+) -> StreamingResponse:
+    stream: NowPlayingStream = request.app.state.now_playing_stream
+    keepalive_interval: float = request.app.state.configuration.now_playing_stream_keepalive
+
+    async def events():
+        async with stream.subscribe(api_token.user_id) as subscription:
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), keepalive_interval)
+                except asyncio.TimeoutError:
+                    # SSE comment; keeps proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+
+                yield event.encode()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
     )
 
+
+@spotify_router.get("/next-song")
+async def get_next_songs(player: Annotated[PlayerContext, Depends(get_player_context)]) -> Song:
+    queue_payload = await player.spotify_client.get_next_songs(player.access_token)
     next_song = next(iter(queue_payload.queue), None)
 
     if not next_song:
-        return Response(
+        return JSONResponse(
             status_code=404,
             content={"message": "No next song found"},
         )
@@ -103,86 +172,101 @@ async def get_next_songs(request: Request, api_token: Annotated[ApiToken, Depend
     return Song.from_currently_playing_item(next_song)
 
 
-@spotify_router.post("/pause-song")
-async def pause(request: Request, api_token: Annotated[ApiToken, Depends(get_api_token)]) -> Response:
-    authorization: Authorization = request.app.state.token_manager
-    configuration: Configuration = request.app.state.configuration
-    spotify_client = SpotifyClient(
-        configuration.spotify_client_id,
-        configuration.spotify_client_secret,
-    )
+@spotify_router.get("/player-state", response_model_exclude_unset=True)
+async def get_player_state(
+    player: Annotated[PlayerContext, Depends(get_player_context)],
+    fields: str = "current,queue,device",
+    limit: Annotated[int, Query(ge=0, le=20)] = 3,
+) -> PlayerState:
+    """
+    The current song, the next `limit` queued songs and the active device in
+    a single response. `fields` is a comma separated subset of
+    `current,queue,device`.
+    """
+    selected = {field.strip() for field in fields.split(",") if field.strip()}
+
+    if not selected or not selected <= PLAYER_STATE_FIELDS:
+        return JSONResponse(
+            status_code=400,
+            content={"message": f"fields must be a subset of {','.join(sorted(PLAYER_STATE_FIELDS))}"},
+        )
 
-    access_token = await authorization.get_access_token(Origin.Spotify, api_token.user_id)
-    devices = await spotify_client.get_available_devices(access_token)
-    active_device = devices.active_device
+    spotify_client = player.spotify_client
 
-    if not active_device:
-        return Response(
-            status_code=200,
-            content={"message": "No active device found"},
-        )
+    async def current() -> CurrentlyPlaying | None:
+        return await spotify_client.get_current_song(player.access_token)
 
-    await spotify_client.pause_song(access_token)
-    return Response(status_code=204)
+    async def queue() -> list[Track]:
+        try:
+            queue_payload = await spotify_client.get_next_songs(player.access_token)
+        except NoActiveDeviceException:
+            return []
 
-@spotify_router.post("/resume-song")
-async def resume(request: Request, api_token: Annotated[ApiToken, Depends(get_api_token)]) -> Response:
-    authorization: Authorization = request.app.state.token_manager
-    configuration: Configuration = request.app.state.configuration
-    spotify_client = SpotifyClient(
-        configuration.spotify_client_id,
-        configuration.spotify_client_secret,
-    )
+        return queue_payload.queue[:limit]
 
-    access_token = await authorization.get_access_token(Origin.Spotify, api_token.user_id)
-    devices = await spotify_client.get_available_devices(access_token)
-    active_device = devices.active_device
+    async def device() -> Device | None:
+        devices = await spotify_client.get_available_devices(player.access_token)
+        return devices.active_device
 
-    if not active_device:
-        return JSONResponse(
-            status_code=200,
-            content={"message": "No active device found"},
-        )
+    fetchers = {"current": current, "queue": queue, "device": device}
+    names = [name for name in fetchers if name in selected]
+    results = dict(zip(names, await asyncio.gather(*(fetchers[name]() for name in names))))
+
+    state = PlayerState()
+
+    if "current" in results:
+        currently_playing: CurrentlyPlaying | None = results["current"]
+
+        state.current = player.now_playing.update(player.user_id, currently_playing) if currently_playing else None
+        state.is_playing = currently_playing.is_playing if currently_playing else False
+
+    if "queue" in results:
+        state.queue = [Song.from_currently_playing_item(track) for track in results["queue"]]
+
+    if "device" in results:
+        state.device = results["device"]
+
+    return state
+
+
+@spotify_router.post("/pause-song")
+async def pause(player: Annotated[PlayerContext, Depends(get_player_context)]) -> Response:
+    await player.spotify_client.pause_song(player.access_token)
+    await player.player_changed()
 
-    await spotify_client.resume_song(access_token)
     return Response(status_code=204)
 
-@spotify_router.post("/skip-song")
-async def skip(request: Request, api_token: Annotated[ApiToken, Depends(get_api_token)]) -> Response:
-    authorization: Authorization = request.app.state.token_manager
-    configuration: Configuration = request.app.state.configuration
-    spotify_client = SpotifyClient(
-        configuration.spotify_client_id,
-        configuration.spotify_client_secret,
-    )
 
-    access_token = await authorization.get_access_token(Origin.Spotify, api_token.user_id)
-    devices = await spotify_client.get_available_devices(access_token)
-    active_device = devices.active_device
+@spotify_router.post("/resume-song")
+async def resume(player: Annotated[PlayerContext, Depends(get_player_context)]) -> Response:
+    await player.spotify_client.resume_song(player.access_token)
+    await player.player_changed()
 
-    if not active_device:
-        return Response(
-            status_code=200,
-            content={"message": "No active device found"},
-        )
+    return Response(status_code=204)
+
+
+@spotify_router.post("/skip-song")
+async def skip(player: Annotated[PlayerContext, Depends(get_player_context)]) -> Response:
+    await player.spotify_client.skip_song(player.access_token)
+    await player.player_changed()
 
-    await spotify_client.skip_song(access_token)
     return Response(status_code=204)
 
 
 @spotify_router.get("/search-song")
-async def search_songs(request: Request, api_token: Annotated[ApiToken, Depends(get_api_token)], query: str) -> Song:
-    authorization: Authorization = request.app.state.token_manager
-    configuration: Configuration = request.app.state.configuration
-    spotify_client = SpotifyClient(
-        configuration.spotify_client_id,
-        configuration.spotify_client_secret,
-    )
+async def search_songs(
+    request: Request,
+    api_token: Annotated[AuthenticatedApiToken, Depends(get_api_token)],
+    spotify_client: Annotated[SpotifyClient, Depends(get_spotify_client)],
+    query: str,
+) -> Song:
+    # With a fixed search market, a cached search doesn't need the user's
+    # access token at all
+    first_song = spotify_client.get_cached_search(query)
 
-    access_token = await authorization.get_access_token(Origin.Spotify, api_token.user_id)
-    search_payload = await spotify_client.search_songs(access_token, query)
-
-    first_song = next(iter(search_payload.tracks.items), None)
+    if not first_song:
+        player = await resolve_player_context(request, api_token)
+        first_song = await spotify_client.search_track(player.access_token, query)
 
     if not first_song:
         return JSONResponse(
@@ -194,15 +278,8 @@ async def search_songs(request: Request, api_token: Annotated[ApiToken, Depends(
 
 
 @spotify_router.post("/enqueue-song")
-async def enqueue_song(request: Request, api_token: Annotated[ApiToken, Depends(get_api_token)], song: str) -> Song:
-    authorization: Authorization = request.app.state.token_manager
-    configuration: Configuration = request.app.state.configuration
-    spotify_client = SpotifyClient(
-        configuration.spotify_client_id,
-        configuration.spotify_client_secret,
-    )
-
-    access_token = await authorization.get_access_token(Origin.Spotify, api_token.user_id)
+async def enqueue_song(player: Annotated[PlayerContext, Depends(get_player_context)], song: str) -> Song:
+    spotify_client = player.spotify_client
     track: Track | None = None
     # if the song is a spotify url, parse the url and get the spotify fragment
     # spotify:track:4iV5W9uYEdYUVa79Axb7Rh
@@ -226,19 +303,32 @@ async def enqueue_song(request: Request, api_token: Annotated[ApiToken, Depends(
             )
         
         song_id = fragment[-1]
-        track = await spotify_client.get_track(access_token, song_id)
-    else:
-        search_payload = await spotify_client.search_songs(access_token, song)
-        track = next(iter(search_payload.tracks.items), None)
 
-        if not track:
+        # Looking the track up first validates the id; a bad one mustn't be
+        # queued. Tracks are cached, so this is usually free
+        try:
+            track = await spotify_client.get_track(player.access_token, song_id)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code not in (400, 404):
+                raise
+
             return JSONResponse(
                 status_code=404,
                 content={"message": "No songs found"},
             )
 
-    # enqueue the song
-    await spotify_client.enqueue_song(access_token, track.uri)
-    return Song.from_currently_playing_item(track)
+        await spotify_client.enqueue_song(player.access_token, f"spotify:track:{song_id}")
+
+        return Song.from_currently_playing_item(track)
 
+    track = await spotify_client.search_track(player.access_token, song)
+
+    if not track:
+        return JSONResponse(
+            status_code=404,
+            content={"message": "No songs found"},
+        )
 
+    # enqueue the song
+    await spotify_client.enqueue_song(player.access_token, track.uri)
+    return Song.from_currently_playing_item(track)
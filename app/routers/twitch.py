@@ -96,10 +96,7 @@ async def twitch_webhook(request: Request):
 @twitch_router.get("/subscribe-me-bitch")
 async def subscribe_me(request: Request, jwt: Annotated[Jwt, Depends(jwt_dependency)]) -> Response:
     configuration: Configuration = request.app.state.configuration
-    client = TwitchClient(
-        configuration.twitch_client_id, 
-        configuration.twitch_client_secret,
-    )
+    client: TwitchClient = request.app.state.twitch_client
 
     user: User = await User.get(id=jwt.claims.user_id)
 
@@ -1,27 +1,71 @@
+import asyncio
+from contextlib import aclosing
+from dataclasses import dataclass
+from datetime import datetime
 import logging
 import secrets
+import time
+from typing import Callable
 import httpx
 
+from cachetools import LRUCache, TTLCache
 from pydantic import BaseModel
 import pendulum
-from tortoise.transactions import in_transaction
+from tortoise import connections, BaseDBAsyncClient
+from tortoise.expressions import Q
+from app.cache import CacheStats
 from app.clients.oauth_client import OAuthClient
 
 from app.clients.twitch import TwitchClient
 from app.clients.spotify import SpotifyClient
 from app.configuration import Configuration
+from app.exceptions import TokenRefreshPendingException
 from app.models.encrypted import Encrypted
 from app.models.oauth_token import OAuthToken
 from app.models.sql.api_token import ApiToken
 from app.models.sql.authorization_token import AuthorizationToken, Origin
+from app.repositories import AuthorizationTokenRecord, TokenRepository
+from app.services.invalidation import InvalidationBus, InvalidationKind
 
 
 REDUCED_EXPIRATION = 60
+REFRESH_POLL_INTERVAL = 0.1
+
+UPSERT_ACCESS_TOKEN = """
+INSERT INTO authorization_token (user_id, origin, access_token, refresh_token, expires_at, invalid_token)
+VALUES ($1, $2, $3, $4, $5, FALSE)
+ON CONFLICT (user_id, origin) DO UPDATE SET
+    access_token = EXCLUDED.access_token,
+    refresh_token = EXCLUDED.refresh_token,
+    expires_at = EXCLUDED.expires_at,
+    invalid_token = FALSE,
+    refresh_lease_until = NULL
+RETURNING id
+"""
+
+INVALIDATE_API_TOKEN = """
+UPDATE api_token SET invalidated_at = $3
+WHERE user_id = $1 AND token_hash = $2 AND invalidated_at IS NULL
+"""
+
+TOUCH_API_TOKEN = """
+UPDATE api_token SET last_used_at = $2
+WHERE token_hash = $1 AND invalidated_at IS NULL
+"""
+
+INVALIDATE_USER_API_TOKENS = """
+UPDATE api_token SET invalidated_at = $2
+WHERE user_id = $1 AND invalidated_at IS NULL
+"""
 
 
 logger = logging.getLogger(__name__)
 
 
+def hash_api_token(token: str) -> bytes:
+    return bytes.fromhex(Encrypted.hash(token))
+
+
 class AccessToken(BaseModel):
     access_token: str
     expires_at: pendulum.DateTime
@@ -30,19 +74,162 @@ class AccessToken(BaseModel):
         arbitrary_types_allowed: bool = True
 
 
+class AccessTokenCache:
+    """
+    Process-local cache of decrypted access tokens, keyed by (service, user).
+    Entries are served until they're within REDUCED_EXPIRATION of expiring.
+    """
+    def __init__(self, maxsize: int = 10_000) -> None:
+        self.tokens: LRUCache = LRUCache(maxsize=maxsize)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, service: Origin, user_id: int) -> str | None:
+        token: AccessToken | None = self.tokens.get((service, user_id))
+
+        if not token or token.expires_at <= pendulum.now().add(seconds=REDUCED_EXPIRATION):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return token.access_token
+
+    def set(self, service: Origin, user_id: int, access_token: str, expires_at: datetime) -> None:
+        self.tokens[(service, user_id)] = AccessToken(
+            access_token=access_token,
+            expires_at=pendulum.instance(expires_at),
+        )
+
+    def invalidate(self, service: Origin, user_id: int) -> None:
+        self.tokens.pop((service, user_id), None)
+
+    def clear(self) -> None:
+        self.tokens.clear()
+
+    @property
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            size=len(self.tokens),
+        )
+
+
+@dataclass(frozen=True)
+class AuthenticatedApiToken:
+    user_id: int
+
+
+class ApiTokenCache:
+    """
+    Process-local cache of API token digest -> user. Unknown and invalidated tokens are
+    cached too, for `negative_ttl`, so a bad token can't be used to hammer the
+    database.
+    """
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        negative_ttl: float,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.tokens: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl, timer=timer)
+        self.unknown_tokens: TTLCache = TTLCache(maxsize=maxsize, ttl=negative_ttl, timer=timer)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token_hash: bytes) -> AuthenticatedApiToken | None:
+        api_token = self.tokens.get(token_hash)
+
+        if api_token:
+            self.hits += 1
+
+        return api_token
+
+    def is_unknown(self, token_hash: bytes) -> bool:
+        unknown = token_hash in self.unknown_tokens
+
+        if unknown:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        return unknown
+
+    def set(self, token_hash: bytes, api_token: AuthenticatedApiToken | None) -> None:
+        if api_token:
+            self.tokens[token_hash] = api_token
+        else:
+            self.unknown_tokens[token_hash] = True
+
+    def invalidate(self, token_hash: bytes) -> None:
+        self.tokens.pop(token_hash, None)
+        self.unknown_tokens.pop(token_hash, None)
+
+    def invalidate_user(self, user_id: int) -> None:
+        for token_hash, api_token in list(self.tokens.items()):
+            if api_token.user_id == user_id:
+                self.tokens.pop(token_hash, None)
+
+    def clear(self) -> None:
+        self.tokens.clear()
+        self.unknown_tokens.clear()
+
+    @property
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            size=len(self.tokens) + len(self.unknown_tokens),
+        )
+
+
 class Authorization:
-    def __init__(self, configuration: Configuration) -> None:
+    def __init__(
+        self,
+        configuration: Configuration,
+        twitch_client: TwitchClient | None = None,
+        spotify_client: SpotifyClient | None = None,
+        invalidation: InvalidationBus | None = None,
+    ) -> None:
         self.configuration = configuration
         self.client_mapping = {
-            Origin.Twitch: TwitchClient(
+            Origin.Twitch: twitch_client or TwitchClient(
                 configuration.twitch_client_id,
                 configuration.twitch_client_secret,
             ),
-            Origin.Spotify: SpotifyClient(
+            Origin.Spotify: spotify_client or SpotifyClient(
                 configuration.spotify_client_id,
                 configuration.spotify_client_secret,
             ),
         }
+        self.repository = TokenRepository()
+        self.access_tokens = AccessTokenCache()
+        self.api_tokens = ApiTokenCache(
+            maxsize=configuration.api_token_cache_max_entries,
+            ttl=configuration.api_token_cache_ttl,
+            negative_ttl=configuration.api_token_negative_cache_ttl,
+        )
+        # API tokens whose last_used_at this worker has written recently
+        self.api_token_uses: TTLCache = TTLCache(
+            maxsize=configuration.api_token_cache_max_entries,
+            ttl=configuration.api_token_last_used_interval,
+        )
+        self.invalidation = invalidation
+
+        if invalidation:
+            invalidation.subscribe(
+                InvalidationKind.AccessToken,
+                lambda key: self.access_tokens.invalidate(*key),
+            )
+            invalidation.subscribe(
+                InvalidationKind.ApiToken,
+                lambda key: self.api_tokens.invalidate_user(*key),
+            )
+
+    async def publish_invalidation(self, kind: InvalidationKind, *key) -> None:
+        if self.invalidation:
+            await self.invalidation.publish(kind, *key)
     
     async def upsert_access_token(
         self,
@@ -55,27 +242,18 @@ class Authorization:
         access_token = encrypted.encrypt(token.access_token)
         refresh_token = encrypted.encrypt(token.refresh_token)
 
-        existing_token = (
-            await AuthorizationToken
-                .filter(user_id=user_id, origin=service)
-                .first()
+        # A new grant replaces whatever was there, including an invalid token
+        connection: BaseDBAsyncClient = connections.get("default")
+        rows = await connection.execute_query_dict(
+            UPSERT_ACCESS_TOKEN,
+            [user_id, str(service), access_token, refresh_token, expires_at],
         )
+        authorization_token = await AuthorizationToken.get(id=rows[0]["id"])
 
-        if not existing_token:
-            existing_token = await AuthorizationToken(
-                user_id=user_id,
-                origin=service,
-                access_token=access_token,
-                refresh_token=refresh_token,
-                expires_at=expires_at,
-            )
+        self.access_tokens.set(service, user_id, token.access_token, expires_at)
+        await self.publish_invalidation(InvalidationKind.AccessToken, service, user_id)
 
-        existing_token.access_token = access_token
-        existing_token.refresh_token = refresh_token
-        existing_token.expires_at = expires_at
-
-        await existing_token.save()
-        return existing_token
+        return authorization_token
 
     async def get_access_token(self, service: Origin, user_id: str) -> str | None:
         expire_ts = pendulum.now().add(seconds=REDUCED_EXPIRATION)
@@ -92,84 +270,347 @@ class Authorization:
             )
 
             return None
-        
-        async with in_transaction():
-            token = (
-                await AuthorizationToken
-                    .filter(user_id=user_id, origin=service)
-                    .select_for_update() # lock the row
-                    .first()
+
+        cached_token = self.access_tokens.get(service, user_id)
+
+        if cached_token:
+            return cached_token
+
+        # Only take the refresh lease when the token actually needs refreshing
+        token = await self.repository.get_authorization_token(user_id, service)
+
+        if not token or token.invalid_token:
+            return None
+
+        # if the token is not expired (and won't expire in the next minute)
+        if token.expires_at > expire_ts:
+            access_token = encrypted.decrypt(token.access_token)
+            self.access_tokens.set(service, user_id, access_token, token.expires_at)
+
+            return access_token
+
+        return await self.refresh_access_token(service, user_id)
+
+    async def refresh_access_token(
+        self,
+        service: Origin,
+        user_id: str,
+        refresh_before: int = REDUCED_EXPIRATION,
+    ) -> str | None:
+        """
+        Refreshes a token expiring within `refresh_before` seconds. A token
+        that's still valid is returned as is.
+
+        No row lock or transaction is held while calling the provider; instead
+        the refreshing worker takes a lease on the row. Callers that find the
+        lease taken get the current token while it's still valid, or wait for
+        the lease holder to finish.
+        """
+        expire_ts = pendulum.now().add(seconds=refresh_before)
+        encrypted = Encrypted(self.configuration.aes_encryption_key)
+
+        token = await self.repository.get_authorization_token(user_id, service)
+
+        if not token or token.invalid_token:
+            return None
+
+        # another worker may have refreshed the token in the meantime
+        if token.expires_at > expire_ts:
+            access_token = encrypted.decrypt(token.access_token)
+            self.access_tokens.set(service, user_id, access_token, token.expires_at)
+
+            return access_token
+
+        lease_until = await self.acquire_refresh_lease(token)
+
+        if lease_until:
+            return await self.refresh_leased_token(token, lease_until)
+
+        # Someone else is refreshing; the current token is good enough if it
+        # hasn't expired yet
+        if token.expires_at > pendulum.now():
+            return encrypted.decrypt(token.access_token)
+
+        return await self.wait_for_refresh(service, user_id, token.expires_at)
+
+    async def acquire_refresh_lease(self, token: AuthorizationTokenRecord) -> datetime | None:
+        """
+        Takes the refresh lease on a token, unless another worker holds it or
+        has already refreshed the token. Returns the lease deadline.
+        """
+        now = pendulum.now()
+        lease_until = now.add(seconds=self.configuration.token_refresh_lease)
+
+        updated = await (
+            AuthorizationToken
+                .filter(
+                    Q(refresh_lease_until__isnull=True) | Q(refresh_lease_until__lt=now),
+                    id=token.id,
+                    invalid_token=False,
+                    expires_at=token.expires_at,
+                )
+                .update(refresh_lease_until=lease_until)
+        )
+
+        return lease_until if updated else None
+
+    async def refresh_leased_token(self, token: AuthorizationTokenRecord, lease_until: datetime) -> str | None:
+        client: OAuthClient = self.client_mapping.get(token.origin)
+        encrypted = Encrypted(self.configuration.aes_encryption_key)
+
+        # Only write if we still hold the lease
+        leased = AuthorizationToken.filter(id=token.id, refresh_lease_until=lease_until)
+
+        try:
+            new_token: OAuthToken = await client.refresh_token(
+                encrypted.decrypt(
+                    token.refresh_token,
+                )
             )
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code in (400, 401):
+                self.access_tokens.invalidate(token.origin, token.user_id)
 
-            if not token or token.invalid_token:
-                return None
-            
-            # if the token is not expired (and won't expire in the next minute)
-            if token.expires_at > expire_ts:
-                return encrypted.decrypt(token.access_token)
-            
-            try:
-                new_token: OAuthToken = await client.refresh_token(
-                    encrypted.decrypt(
-                        token.refresh_token,
-                    )
+                logger.info(
+                    f"A user's token is invalid, marking as such: {e}",
+                    extra={
+                        "token_id": token.id,
+                        "user_id": token.user_id,
+                        "service": str(token.origin),
+                    },
                 )
-            except httpx.HTTPStatusError as e:
-                if e.response.status_code in (400, 401):
-                    token.invalid_token = True
-
-                    logger.info(
-                        f"A user's token is invalid, marking as such: {e}",
-                        extra={
-                            "token_id": token.id,
-                            "user_id": user_id,
-                            "service": str(service),
-                        },
-                    )
-
-                    await token.save()
-                else:
-                    logger.exception(
-                        f"An error occurred while refreshing token: {e}",
-                        extra={
-                            "error": e,
-                            "token_id": token.id,
-                            "user_id": user_id,
-                        },
-                    )
-                
+
+                await leased.update(invalid_token=True, refresh_lease_until=None)
+                await self.publish_invalidation(InvalidationKind.AccessToken, token.origin, token.user_id)
+            else:
+                logger.exception(
+                    f"An error occurred while refreshing token: {e}",
+                    extra={
+                        "error": e,
+                        "token_id": token.id,
+                        "user_id": token.user_id,
+                    },
+                )
+
+                await leased.update(refresh_lease_until=None)
+
+            return None
+        except httpx.TransportError as e:
+            # Timeouts included; the provider may well answer a retry
+            logger.warning(
+                f"Couldn't reach the provider to refresh a token: {e!r}",
+                extra={
+                    "token_id": token.id,
+                    "user_id": token.user_id,
+                    "service": str(token.origin),
+                },
+            )
+
+            await leased.update(refresh_lease_until=None)
+            raise TokenRefreshPendingException() from e
+        except Exception:
+            await leased.update(refresh_lease_until=None)
+            raise
+
+        expires_at = pendulum.now().add(seconds=new_token.expires_in)
+        refresh_token = encrypted.encrypt(new_token.refresh_token) if new_token.refresh_token else token.refresh_token
+
+        updated = await leased.update(
+            access_token=encrypted.encrypt(new_token.access_token),
+            refresh_token=refresh_token,
+            expires_at=expires_at,
+            refresh_lease_until=None,
+        )
+
+        if not updated:
+            logger.warning(
+                "Refresh lease expired before the refreshed token was saved",
+                extra={
+                    "token_id": token.id,
+                    "user_id": token.user_id,
+                    "service": str(token.origin),
+                },
+            )
+
+            # The provider may have rotated the refresh token, which would make
+            # the stored one useless; save ours regardless, leaving whoever
+            # holds the lease now to it
+            await AuthorizationToken.filter(id=token.id).update(
+                access_token=encrypted.encrypt(new_token.access_token),
+                refresh_token=refresh_token,
+                expires_at=expires_at,
+            )
+
+        self.access_tokens.set(token.origin, token.user_id, new_token.access_token, expires_at)
+        await self.publish_invalidation(InvalidationKind.AccessToken, token.origin, token.user_id)
+
+        return new_token.access_token
+
+    async def wait_for_refresh(
+        self,
+        service: Origin,
+        user_id: str,
+        expires_at: datetime,
+    ) -> str | None:
+        """
+        Polls until the lease holder has saved a new token, for at most
+        `token_refresh_wait` seconds. Raises `TokenRefreshPendingException`
+        if it hasn't by then.
+        """
+        encrypted = Encrypted(self.configuration.aes_encryption_key)
+        attempts = max(int(self.configuration.token_refresh_wait / REFRESH_POLL_INTERVAL), 1)
+
+        for _ in range(attempts):
+            await asyncio.sleep(REFRESH_POLL_INTERVAL)
+
+            token = await self.repository.get_authorization_token(user_id, service)
+
+            if not token or token.invalid_token:
                 return None
-            
-            encrypted = Encrypted(self.configuration.aes_encryption_key)
-            access_token = encrypted.encrypt(new_token.access_token)
-            refresh_token = encrypted.encrypt(new_token.refresh_token) if new_token.refresh_token else token.refresh_token
 
-            token.access_token = access_token
-            token.refresh_token = refresh_token
-            token.expires_at = pendulum.now().add(seconds=new_token.expires_in)
+            if token.expires_at > expires_at:
+                access_token = encrypted.decrypt(token.access_token)
+                self.access_tokens.set(service, user_id, access_token, token.expires_at)
+
+                return access_token
 
-            await token.save()
-            return new_token.access_token
+        raise TokenRefreshPendingException()
     
+    async def warm_access_tokens(self, active_since: datetime, batch_size: int) -> int:
+        """
+        Prefills the access token cache with the valid tokens of users active
+        since `active_since`, skipping any that can't be decrypted. Returns the
+        number of tokens cached.
+        """
+        encrypted = Encrypted(self.configuration.aes_encryption_key)
+        expires_after = pendulum.now().add(seconds=REDUCED_EXPIRATION)
+        warmed = 0
+
+        batches = self.repository.stream_active_authorization_tokens(
+            expires_after,
+            active_since,
+            limit=self.access_tokens.tokens.maxsize,
+            batch_size=batch_size,
+        )
+
+        # closes the cursor straight away if we're cancelled part way through
+        async with aclosing(batches):
+            async for batch in batches:
+                for token in batch:
+                    try:
+                        access_token = encrypted.decrypt(token.access_token)
+                    except ValueError as e:
+                        # Left to the request path, like any other cache miss
+                        logger.warning(
+                            f"Skipping an access token that couldn't be decrypted: {e}",
+                            extra={
+                                "token_id": token.id,
+                                "user_id": token.user_id,
+                                "service": str(token.origin),
+                            },
+                        )
+                        continue
+
+                    self.access_tokens.set(token.origin, token.user_id, access_token, token.expires_at)
+                    warmed += 1
+
+                # decrypting is CPU-bound; let other tasks run between batches
+                await asyncio.sleep(0)
+
+        return warmed
+
     async def generate_api_token(self, user_id: str) -> str:
         token = secrets.token_urlsafe(32)
+        token_hash = hash_api_token(token)
 
-        result = await ApiToken.create(
+        # Only the digest is stored; the caller has the only copy of the token
+        await ApiToken.create(
             user_id=user_id,
-            token=token,
+            token_hash=token_hash,
+        )
+        self.api_tokens.invalidate(token_hash)
+
+        return token
+
+    async def rotate_api_token(self, user_id: str) -> str:
+        """
+        Revokes the user's API tokens and issues a new one.
+        """
+        connection: BaseDBAsyncClient = connections.get("default")
+        await connection.execute_query(
+            INVALIDATE_USER_API_TOKENS,
+            [user_id, pendulum.now(tz='UTC')],
         )
 
-        return result.token
+        self.api_tokens.invalidate_user(user_id)
+        await self.publish_invalidation(InvalidationKind.ApiToken, user_id)
+
+        return await self.generate_api_token(user_id)
+
+    async def find_api_token(self, token_hash: bytes, origin: Origin | None = None) -> AuthenticatedApiToken | None:
+        """
+        Looks up an API token; with an `origin`, the user's authorization token
+        for it is fetched in the same query and cached for the request's
+        `get_access_token`.
+        """
+        if not origin:
+            user_id = await self.repository.get_api_token(token_hash)
+            return AuthenticatedApiToken(user_id=user_id) if user_id is not None else None
+
+        result = await self.repository.get_api_token_authorization(token_hash, origin)
+
+        if not result:
+            return None
+
+        token = result.authorization_token
+
+        if token and not token.invalid_token and token.expires_at > pendulum.now().add(seconds=REDUCED_EXPIRATION):
+            encrypted = Encrypted(self.configuration.aes_encryption_key)
+            access_token = encrypted.decrypt(token.access_token)
+            self.access_tokens.set(origin, result.user_id, access_token, token.expires_at)
+
+        return AuthenticatedApiToken(user_id=result.user_id)
+
+    async def authenticate_api_token(self, token: str, origin: Origin | None = None) -> AuthenticatedApiToken | None:
+        token_hash = hash_api_token(token)
+        api_token = self.api_tokens.get(token_hash)
+
+        if not api_token:
+            if self.api_tokens.is_unknown(token_hash):
+                return None
+
+            api_token = await self.find_api_token(token_hash, origin)
+            self.api_tokens.set(token_hash, api_token)
+
+        if api_token:
+            await self.touch_api_token(token_hash)
+
+        return api_token
+
+    async def touch_api_token(self, token_hash: bytes) -> None:
+        """
+        Records that an API token was used, which is what the access token
+        warmup goes by. Written at most once per `api_token_last_used_interval`
+        per worker.
+        """
+        if token_hash in self.api_token_uses:
+            return
+
+        self.api_token_uses[token_hash] = True
+
+        connection: BaseDBAsyncClient = connections.get("default")
+        await connection.execute_query(TOUCH_API_TOKEN, [token_hash, pendulum.now(tz='UTC')])
     
     async def invalidate_api_token(self, user_id: str, token: str) -> None:
-        api_token = (
-            await ApiToken
-                .filter(user_id=user_id, token=token)
-                .first()
+        token_hash = hash_api_token(token)
+        connection: BaseDBAsyncClient = connections.get("default")
+        invalidated, _ = await connection.execute_query(
+            INVALIDATE_API_TOKEN,
+            [user_id, token_hash, pendulum.now(tz='UTC')],
         )
 
-        if not api_token:
+        if not invalidated:
             return
-        
-        api_token.invalidated_at = pendulum.now(tz='UTC')
-        await api_token.save()
+
+        self.api_tokens.invalidate(token_hash)
+        await self.publish_invalidation(InvalidationKind.ApiToken, user_id)
@@ -1,21 +1,91 @@
 import secrets
+import time
+from typing import Callable
+from cachetools import TTLCache
 import pendulum
 from tortoise.transactions import in_transaction
 
+from app.cache import CacheStats, SingleFlight
 from app.configuration import Configuration
-from app.identity.jwt import AccessToken, Jwt
+from app.identity.jwt import AccessToken, Jwt, Jwks, JwtKey, JwtKeyring, VerifiedJwtCache, import_key
 from app.models.encrypted import Encrypted
 from app.models.sql.refresh_token import RefreshToken
 from app.models.sql.user import User
+from app.services.invalidation import InvalidationBus, InvalidationKind
 
 
 def random_refresh_token() -> str:
     return secrets.token_urlsafe(32)
 
 
+class RotatedRefreshTokens:
+    """
+    Maps a just-rotated refresh token digest to the access token it was rotated
+    into, for `grace_period` seconds, so duplicate refreshes arriving shortly
+    after the rotation get the same result instead of being logged out.
+    """
+    def __init__(
+        self,
+        grace_period: float,
+        maxsize: int = 10_000,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.tokens: TTLCache = TTLCache(maxsize=maxsize, ttl=grace_period, timer=timer)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token_hash: str) -> AccessToken | None:
+        rotated: tuple[int, AccessToken] | None = self.tokens.get(token_hash)
+
+        if not rotated:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return rotated[1]
+
+    def set(self, token_hash: str, user_id: int, access_token: AccessToken) -> None:
+        self.tokens[token_hash] = (user_id, access_token)
+
+    def invalidate_user(self, user_id: int) -> None:
+        for token_hash, (rotated_user_id, _) in list(self.tokens.items()):
+            if rotated_user_id == user_id:
+                self.tokens.pop(token_hash, None)
+
+    def clear(self) -> None:
+        self.tokens.clear()
+
+    @property
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            size=len(self.tokens),
+        )
+
+
 class Identity:
-    def __init__(self, configuration: Configuration) -> None:
+    def __init__(self, configuration: Configuration, invalidation: InvalidationBus | None = None) -> None:
         self.configuration = configuration
+        self.invalidation = invalidation
+        self.jwt_keyring = JwtKeyring.from_configuration(configuration)
+        self.jwt_key: JwtKey = self.jwt_keyring or import_key(configuration.jwt_secret_key)
+        self.jwks = Jwks.from_keyring(self.jwt_keyring)
+        self.verified_jwts = VerifiedJwtCache()
+        self.rotated_refresh_tokens = RotatedRefreshTokens(configuration.refresh_token_grace_period)
+        self.single_flight = SingleFlight()
+
+        if invalidation:
+            # the user's refresh token was rotated elsewhere, so the successors
+            # we'd hand out are no longer valid
+            invalidation.subscribe(
+                InvalidationKind.RefreshToken,
+                lambda key: self.rotated_refresh_tokens.invalidate_user(*key),
+            )
+
+    async def publish_invalidation(self, kind: InvalidationKind, *key) -> None:
+        if self.invalidation:
+            await self.invalidation.publish(kind, *key)
 
     async def create_access_token(self, user: User) -> AccessToken:
         old_token = await RefreshToken.get_or_none(
@@ -37,6 +107,8 @@ class Identity:
         )
 
         await new_refresh_token.save()
+        self.rotated_refresh_tokens.invalidate_user(user.id)
+        await self.publish_invalidation(InvalidationKind.RefreshToken, user.id)
 
         jwt = Jwt.construct_jwt(
             user.id,
@@ -45,7 +117,7 @@ class Identity:
         )
 
         return AccessToken(
-            access_token=jwt.encode(self.configuration.jwt_secret_key),
+            access_token=jwt.encode(self.jwt_key),
             refresh_token=new_refresh_token.refresh_token,
             expires_in=self.configuration.jwt_expiration,
             scope=self.configuration.twitch_scope,
@@ -53,8 +125,24 @@ class Identity:
         )
 
     async def refresh_token(self, refresh_token: str) -> AccessToken | None:
+        """
+        Rotates the refresh token. Concurrent refreshes of the same token share
+        a single rotation, and refreshes arriving within the grace period after
+        it get the same access token.
+        """
         refresh_token_hash = Encrypted.hash(refresh_token)
-        old_token = await RefreshToken.get(
+        rotated = self.rotated_refresh_tokens.get(refresh_token_hash)
+
+        if rotated:
+            return rotated
+
+        return await self.single_flight.do(
+            refresh_token_hash,
+            lambda: self.rotate_refresh_token(refresh_token_hash),
+        )
+
+    async def rotate_refresh_token(self, refresh_token_hash: str) -> AccessToken | None:
+        old_token = await RefreshToken.get_or_none(
             refresh_token_hash=refresh_token_hash,
         )
 
@@ -67,6 +155,15 @@ class Identity:
             return None
         
         async with in_transaction():
+            # only one rotation wins, even across workers
+            invalidated = await RefreshToken.filter(
+                id=old_token.id,
+                invalidated_at__isnull=True,
+            ).update(invalidated_at=pendulum.now())
+
+            if not invalidated:
+                return None
+
             generated_secret = random_refresh_token()
 
             new_refresh_token = RefreshToken(
@@ -75,21 +172,26 @@ class Identity:
                 refresh_token_hash=Encrypted.hash(generated_secret),
             )
 
-            old_token.invalidated_at = pendulum.now()
-
             await new_refresh_token.save()
-            await old_token.save()
-        
+
         jwt = Jwt.construct_jwt(
             user.id, 
             user.username, 
             self.configuration.jwt_expiration,
         )
 
-        return AccessToken(
-            access_token=jwt.encode(self.configuration.jwt_secret_key), 
+        access_token = AccessToken(
+            access_token=jwt.encode(self.jwt_key), 
             refresh_token=new_refresh_token.refresh_token,
             expires_in=self.configuration.jwt_expiration,
             scope=self.configuration.twitch_scope,
             token_type="bearer",
         )
+
+        # earlier successors are no longer valid
+        self.rotated_refresh_tokens.invalidate_user(user.id)
+        self.rotated_refresh_tokens.set(refresh_token_hash, user.id, access_token)
+
+        await self.publish_invalidation(InvalidationKind.RefreshToken, user.id)
+
+        return access_token
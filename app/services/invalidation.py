@@ -0,0 +1,163 @@
+import asyncio
+from dataclasses import dataclass
+from enum import StrEnum
+import json
+import logging
+import secrets
+from typing import Any, Callable
+
+from tortoise import connections, BaseDBAsyncClient
+
+from app.cache import CacheRegistry
+
+
+CHANNEL = "cache_invalidation"
+
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidationKind(StrEnum):
+    AccessToken = "access_token" # key: [service, user_id]
+    ApiToken = "api_token" # key: [user_id]
+    RefreshToken = "refresh_token" # key: [user_id]
+    NowPlaying = "now_playing" # key: [user_id]
+
+
+Handler = Callable[[list[Any]], None]
+
+
+@dataclass(frozen=True)
+class Invalidation:
+    kind: InvalidationKind
+    key: list[Any]
+    sender: str
+
+    def encode(self) -> str:
+        return json.dumps(
+            {"k": self.kind, "v": self.key, "s": self.sender},
+            separators=(",", ":"),
+        )
+
+    @classmethod
+    def decode(cls, payload: str) -> "Invalidation":
+        message = json.loads(payload)
+
+        return cls(
+            kind=InvalidationKind(message["k"]),
+            key=message["v"],
+            sender=message["s"],
+        )
+
+
+class InvalidationBus:
+    """
+    Keeps process-local caches consistent across workers using Postgres
+    LISTEN/NOTIFY. Writers publish the keys they changed and every other worker
+    evicts them through the handlers subscribed for that kind.
+
+    Notifications sent while the listener is disconnected are lost, so every
+    registered cache is flushed when the connection drops and again once it's
+    listening again.
+    """
+    def __init__(
+        self,
+        caches: CacheRegistry,
+        reconnect_delay: float = 1.0,
+        keepalive: float = 30.0,
+        connection_name: str = "default",
+    ) -> None:
+        self.caches = caches
+        self.reconnect_delay = reconnect_delay
+        self.keepalive = keepalive
+        self.connection_name = connection_name
+
+        # identifies our own messages, which have already been applied locally
+        self.sender = secrets.token_hex(4)
+        self.handlers: dict[InvalidationKind, list[Handler]] = {}
+        self.listening = asyncio.Event()
+        self.reconnecting = False
+
+    def subscribe(self, kind: InvalidationKind, handler: Handler) -> None:
+        self.handlers.setdefault(kind, []).append(handler)
+
+    async def publish(self, kind: InvalidationKind, *key: Any) -> None:
+        invalidation = Invalidation(kind, list(key), self.sender)
+
+        try:
+            connection: BaseDBAsyncClient = connections.get(self.connection_name)
+            await connection.execute_query("SELECT pg_notify($1, $2)", [CHANNEL, invalidation.encode()])
+        except Exception as e:
+            logger.exception(
+                f"Failed to publish cache invalidation: {e}",
+                extra={
+                    "kind": str(kind),
+                },
+            )
+
+    def dispatch(self, invalidation: Invalidation) -> None:
+        if invalidation.sender == self.sender:
+            return
+
+        for handler in self.handlers.get(invalidation.kind, ()):
+            try:
+                handler(invalidation.key)
+            except Exception as e:
+                logger.exception(
+                    f"An error occurred while handling cache invalidation: {e}",
+                    extra={
+                        "kind": str(invalidation.kind),
+                    },
+                )
+
+    def on_notification(self, connection: Any, pid: int, channel: str, payload: str) -> None:
+        try:
+            invalidation = Invalidation.decode(payload)
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Ignoring malformed cache invalidation: {e}")
+            return
+
+        self.dispatch(invalidation)
+
+    async def listen(self, connection: Any) -> None:
+        """
+        Listens on an asyncpg connection until it's lost.
+        """
+        lost = asyncio.Event()
+        connection.add_termination_listener(lambda _: lost.set())
+
+        await connection.add_listener(CHANNEL, self.on_notification)
+        self.listening.set()
+
+        try:
+            # anything published while we were disconnected was missed
+            if self.reconnecting:
+                self.caches.clear()
+
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), self.keepalive)
+                except asyncio.TimeoutError:
+                    # the termination listener doesn't fire on a dead socket
+                    await connection.execute("SELECT 1")
+        finally:
+            self.listening.clear()
+            self.reconnecting = True
+
+            if not connection.is_closed():
+                await connection.remove_listener(CHANNEL, self.on_notification)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                client = connections.get(self.connection_name)
+
+                async with client.acquire_connection() as connection:
+                    await self.listen(connection)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cache invalidation listener disconnected: {e}")
+
+            self.caches.clear()
+            await asyncio.sleep(self.reconnect_delay)
@@ -0,0 +1,76 @@
+from dataclasses import dataclass
+import time
+from typing import Callable
+
+from cachetools import TTLCache
+
+from app.cache import CacheStats
+from app.models.spotify import CurrentlyPlaying, Song
+
+
+@dataclass
+class NowPlayingSnapshot:
+    song: Song
+    is_playing: bool
+    expires_at: float
+
+
+class NowPlaying:
+    """
+    Per-user snapshot of the currently playing song. A snapshot is served until
+    the track is expected to end, a player control changes state, or `max_ttl`
+    passes; whichever comes first.
+    """
+    def __init__(
+        self,
+        max_ttl: float,
+        maxsize: int = 4096,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_ttl = max_ttl
+        self.timer = timer
+        self.snapshots: TTLCache = TTLCache(maxsize=maxsize, ttl=max_ttl, timer=timer)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> Song | None:
+        snapshot: NowPlayingSnapshot | None = self.snapshots.get(user_id)
+
+        if not snapshot or snapshot.expires_at <= self.timer():
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return snapshot.song
+
+    def update(self, user_id: int, currently_playing: CurrentlyPlaying) -> Song:
+        ttl = self.max_ttl
+        remaining_ms = currently_playing.remaining_ms
+
+        # While playing, the snapshot is only good until the track ends
+        if currently_playing.is_playing and remaining_ms is not None:
+            ttl = min(ttl, remaining_ms / 1000)
+
+        song = Song.from_currently_playing_item(currently_playing.item)
+
+        self.snapshots[user_id] = NowPlayingSnapshot(
+            song=song,
+            is_playing=currently_playing.is_playing,
+            expires_at=self.timer() + ttl,
+        )
+
+        return song
+
+    def invalidate(self, user_id: int) -> None:
+        self.snapshots.pop(user_id, None)
+
+    def clear(self) -> None:
+        self.snapshots.clear()
+
+    @property
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            size=len(self.snapshots),
+        )
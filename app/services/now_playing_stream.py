@@ -0,0 +1,139 @@
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from enum import StrEnum
+from typing import AsyncIterator
+
+from app.clients.spotify import SpotifyClient
+from app.models.spotify import Song
+from app.models.sql.authorization_token import Origin
+from app.services.authorization import Authorization
+from app.services.now_playing import NowPlaying
+from app.services.scheduler import PollResult, PollScheduler
+
+
+class PlaybackState(StrEnum):
+    Playing = "playing"
+    Paused = "paused"
+    Stopped = "stopped"
+
+
+@dataclass(frozen=True)
+class NowPlayingEvent:
+    state: PlaybackState
+    song: Song | None = None
+
+    def encode(self) -> str:
+        data = self.song.model_dump_json() if self.song else "{}"
+        return f"event: {self.state}\ndata: {data}\n\n"
+
+
+class Subscription:
+    """
+    A single stream connection. The queue is bounded; a slow client loses the
+    oldest events rather than holding on to an ever-growing backlog.
+    """
+    def __init__(self, maxsize: int) -> None:
+        self.queue: asyncio.Queue[NowPlayingEvent] = asyncio.Queue(maxsize=maxsize)
+
+    def put(self, event: NowPlayingEvent) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()
+
+        self.queue.put_nowait(event)
+
+    async def get(self) -> NowPlayingEvent:
+        return await self.queue.get()
+
+
+class NowPlayingStream:
+    """
+    Fans now-playing changes out to stream subscribers. Polling is driven by the
+    shared `PollScheduler`, so each active user is polled once no matter how
+    many subscribers they have, and idle users aren't polled at all.
+    """
+    def __init__(
+        self,
+        authorization: Authorization,
+        spotify_client: SpotifyClient,
+        now_playing: NowPlaying,
+        scheduler: PollScheduler,
+        queue_size: int,
+    ) -> None:
+        self.authorization = authorization
+        self.spotify_client = spotify_client
+        self.now_playing = now_playing
+        self.scheduler = scheduler
+        self.queue_size = queue_size
+
+        self.subscribers: dict[int, set[Subscription]] = {}
+        self.last_events: dict[int, NowPlayingEvent] = {}
+
+    @asynccontextmanager
+    async def subscribe(self, user_id: int) -> AsyncIterator[Subscription]:
+        subscription = Subscription(self.queue_size)
+        subscribers = self.subscribers.setdefault(user_id, set())
+        subscribers.add(subscription)
+
+        # Late subscribers get the current state straight away; otherwise poll
+        # as soon as possible
+        if user_id in self.last_events:
+            subscription.put(self.last_events[user_id])
+            self.scheduler.touch(user_id)
+        else:
+            self.scheduler.touch(user_id, delay=0)
+
+        try:
+            yield subscription
+        finally:
+            subscribers.discard(subscription)
+
+            if not subscribers:
+                del self.subscribers[user_id]
+                self.last_events.pop(user_id, None)
+
+    def has_subscribers(self, user_id: int) -> bool:
+        return bool(self.subscribers.get(user_id))
+
+    def publish(self, user_id: int, event: NowPlayingEvent) -> None:
+        if user_id not in self.subscribers or self.last_events.get(user_id) == event:
+            return
+
+        self.last_events[user_id] = event
+
+        for subscription in self.subscribers.get(user_id, ()):
+            subscription.put(event)
+
+    async def fetch(self, user_id: int) -> tuple[NowPlayingEvent, float | None]:
+        access_token = await self.authorization.get_access_token(Origin.Spotify, user_id)
+
+        if not access_token:
+            return NowPlayingEvent(PlaybackState.Stopped), None
+
+        currently_playing = await self.spotify_client.get_current_song(access_token)
+
+        if not currently_playing:
+            return NowPlayingEvent(PlaybackState.Stopped), None
+
+        song = self.now_playing.update(user_id, currently_playing)
+        state = PlaybackState.Playing if currently_playing.is_playing else PlaybackState.Paused
+        remaining_ms = currently_playing.remaining_ms
+
+        return NowPlayingEvent(state, song), remaining_ms / 1000 if remaining_ms is not None else None
+
+    async def refresh(self, user_id: int) -> PollResult:
+        """
+        Polls a user's playback and publishes any change; called by the
+        scheduler.
+        """
+        # An open stream counts as activity
+        if self.subscribers.get(user_id):
+            self.scheduler.touch(user_id)
+
+        event, remaining = await self.fetch(user_id)
+        self.publish(user_id, event)
+
+        return PollResult(
+            playing=event.state == PlaybackState.Playing,
+            remaining=remaining,
+        )
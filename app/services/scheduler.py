@@ -0,0 +1,190 @@
+import asyncio
+from dataclasses import dataclass
+import heapq
+import logging
+import time
+from typing import Awaitable, Callable
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PollResult:
+    playing: bool
+    remaining: float | None = None # seconds until the current track ends
+
+
+Poll = Callable[[int], Awaitable[PollResult]]
+
+
+class PollScheduler:
+    """
+    Decides when to next poll each user's playback, using a heap of due times:
+
+    - while playing, just after the current track is expected to end (capped at
+      `max_interval` so changes made outside of the API are still picked up)
+    - while paused, or with no active device, backing off exponentially up to
+      `max_backoff`
+    - not at all once a user has had no activity for `idle_timeout`
+
+    Upstream calls are limited to `max_concurrency` across all users.
+    """
+    def __init__(
+        self,
+        min_interval: float,
+        max_interval: float,
+        max_backoff: float,
+        idle_timeout: float,
+        max_concurrency: int,
+        track_end_slack: float = 0.5,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_backoff = max_backoff
+        self.idle_timeout = idle_timeout
+        self.track_end_slack = track_end_slack
+        self.timer = timer
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+        # heap entries are only valid while they match `scheduled`
+        self.heap: list[tuple[float, int]] = []
+        self.scheduled: dict[int, float] = {}
+        self.polling: set[int] = set()
+        self.last_activity: dict[int, float] = {}
+        self.backoff: dict[int, float] = {}
+        # delays requested while the user was being polled
+        self.pending_delays: dict[int, float] = {}
+
+        self.tasks: set[asyncio.Task] = set()
+        self.wakeup = asyncio.Event()
+
+    def touch(self, user_id: int, delay: float | None = None) -> None:
+        """
+        Records activity for a user, scheduling them if they aren't already. A
+        `delay` brings the next poll forward, e.g. after a player control; if the
+        user is being polled, it's applied once that poll finishes.
+        """
+        self.last_activity[user_id] = self.timer()
+
+        if user_id in self.polling:
+            if delay is not None:
+                self.pending_delays[user_id] = min(delay, self.pending_delays.get(user_id, delay))
+
+            return
+
+        if user_id not in self.scheduled:
+            self.schedule(user_id, delay or 0)
+        elif delay is not None:
+            self.schedule(user_id, delay)
+
+    def schedule(self, user_id: int, delay: float) -> None:
+        due = self.timer() + delay
+        current = self.scheduled.get(user_id)
+
+        if current is not None and current <= due:
+            return
+
+        self.scheduled[user_id] = due
+        heapq.heappush(self.heap, (due, user_id))
+
+        if self.heap[0][1] == user_id:
+            self.wakeup.set()
+
+    def forget(self, user_id: int) -> None:
+        self.scheduled.pop(user_id, None)
+        self.last_activity.pop(user_id, None)
+        self.backoff.pop(user_id, None)
+        self.pending_delays.pop(user_id, None)
+
+    def is_idle(self, user_id: int) -> bool:
+        last_activity = self.last_activity.get(user_id)
+        return last_activity is None or self.timer() - last_activity > self.idle_timeout
+
+    def next_delay(self, user_id: int, result: PollResult | None) -> float:
+        if result and result.playing:
+            self.backoff.pop(user_id, None)
+
+            if result.remaining is None:
+                return self.min_interval
+
+            delay = result.remaining + self.track_end_slack
+            return min(max(delay, self.min_interval), self.max_interval)
+
+        # paused, nothing playing or the poll failed
+        backoff = self.backoff.get(user_id)
+        backoff = self.min_interval if backoff is None else min(backoff * 2, self.max_backoff)
+        self.backoff[user_id] = backoff
+
+        return backoff
+
+    def pop_due(self) -> list[int]:
+        now = self.timer()
+        due: list[int] = []
+
+        while self.heap and self.heap[0][0] <= now:
+            due_at, user_id = heapq.heappop(self.heap)
+
+            if self.scheduled.get(user_id) != due_at:
+                continue
+
+            del self.scheduled[user_id]
+            due.append(user_id)
+
+        return due
+
+    async def poll_user(self, poll: Poll, user_id: int) -> None:
+        result: PollResult | None = None
+
+        try:
+            async with self.semaphore:
+                result = await poll(user_id)
+        except Exception as e:
+            logger.exception(
+                f"An error occurred while polling playback: {e}",
+                extra={
+                    "user_id": user_id,
+                },
+            )
+        finally:
+            self.polling.discard(user_id)
+
+        delay = self.next_delay(user_id, result)
+        pending_delay = self.pending_delays.pop(user_id, None)
+
+        if pending_delay is not None:
+            delay = min(delay, pending_delay)
+
+        if user_id in self.last_activity:
+            self.schedule(user_id, delay)
+
+    async def run(self, poll: Poll) -> None:
+        while True:
+            self.wakeup.clear()
+
+            for user_id in self.pop_due():
+                if self.is_idle(user_id):
+                    self.forget(user_id)
+                    continue
+
+                self.polling.add(user_id)
+
+                task = asyncio.create_task(self.poll_user(poll, user_id))
+                task.add_done_callback(self.tasks.discard)
+                self.tasks.add(task)
+
+            timeout = max(self.heap[0][0] - self.timer(), 0) if self.heap else None
+
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def close(self) -> None:
+        tasks = list(self.tasks)
+
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Callable
+
+import pendulum
+from tortoise.queryset import ValuesListQuery
+
+from app.models.sql.authorization_token import AuthorizationToken, Origin
+from app.services.authorization import Authorization
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenRefresher:
+    """
+    Refreshes OAuth tokens ahead of their expiry so that requests find a valid
+    token rather than waiting on the provider. Every `interval` seconds, tokens
+    expiring within `window` seconds are refreshed, at most `concurrency` at a
+    time; each refresh is delayed by up to `jitter` seconds so they don't all
+    hit the provider at once.
+
+    A token whose refresh fails is retried with exponential backoff, from
+    twice the interval up to `max_backoff`, so a provider outage or a broken
+    token isn't retried every interval.
+    """
+    def __init__(
+        self,
+        authorization: Authorization,
+        interval: float,
+        window: int,
+        concurrency: int,
+        jitter: float,
+        batch_size: int,
+        max_backoff: float = 3600.0,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.authorization = authorization
+        self.interval = interval
+        self.window = window
+        self.jitter = jitter
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self.timer = timer
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+        # keyed by (service, user_id)
+        self.failures: dict[tuple[Origin, int], int] = {}
+        self.retry_at: dict[tuple[Origin, int], float] = {}
+
+    def backing_off(self) -> dict[Origin, list[int]]:
+        now = self.timer()
+        users: dict[Origin, list[int]] = {}
+
+        for (service, user_id), retry_at in self.retry_at.items():
+            if retry_at > now:
+                users.setdefault(service, []).append(user_id)
+
+        return users
+
+    def succeeded(self, service: Origin, user_id: int) -> None:
+        self.failures.pop((service, user_id), None)
+        self.retry_at.pop((service, user_id), None)
+
+    def failed(self, service: Origin, user_id: int) -> None:
+        failures = self.failures.get((service, user_id), 0) + 1
+        backoff = min(self.interval * 2 ** failures, self.max_backoff)
+
+        self.failures[(service, user_id)] = failures
+        self.retry_at[(service, user_id)] = self.timer() + backoff
+
+    def expiring(self) -> ValuesListQuery:
+        expires_before = pendulum.now().add(seconds=self.window)
+        query = AuthorizationToken.filter(invalid_token=False, expires_at__lte=expires_before)
+
+        # excluded in the query, so failing tokens don't crowd out the batch
+        for service, user_ids in self.backing_off().items():
+            query = query.exclude(origin=service, user_id__in=user_ids)
+
+        return (
+            query
+                .order_by("expires_at")
+                .limit(self.batch_size)
+                .values_list("origin", "user_id")
+        )
+
+    async def find_expiring(self) -> list[tuple[Origin, int]]:
+        return await self.expiring()
+
+    async def refresh(self, service: Origin, user_id: int) -> None:
+        await asyncio.sleep(random.uniform(0, self.jitter))
+
+        access_token: str | None = None
+
+        try:
+            async with self.semaphore:
+                access_token = await self.authorization.refresh_access_token(
+                    service,
+                    user_id,
+                    refresh_before=self.window,
+                )
+        except Exception as e:
+            logger.exception(
+                f"An error occurred while refreshing token in the background: {e}",
+                extra={
+                    "service": str(service),
+                    "user_id": user_id,
+                },
+            )
+
+        if access_token:
+            self.succeeded(service, user_id)
+        else:
+            self.failed(service, user_id)
+
+    async def refresh_expiring(self) -> int:
+        expiring = await self.find_expiring()
+
+        # tokens that are due a retry but no longer expiring (refreshed
+        # elsewhere, re-granted or invalidated) don't need their backoff
+        now = self.timer()
+        expiring_keys = set(expiring)
+
+        for key, retry_at in list(self.retry_at.items()):
+            if retry_at <= now and key not in expiring_keys:
+                self.succeeded(*key)
+
+        await asyncio.gather(*(
+            self.refresh(service, user_id)
+            for service, user_id in expiring
+        ))
+
+        return len(expiring)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.refresh_expiring()
+            except Exception as e:
+                logger.exception(f"An error occurred while refreshing tokens: {e}")
+
+            await asyncio.sleep(self.interval)
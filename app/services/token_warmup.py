@@ -0,0 +1,57 @@
+import asyncio
+import logging
+import time
+
+import pendulum
+
+from app.services.authorization import Authorization
+from app.services.invalidation import InvalidationBus
+
+
+logger = logging.getLogger(__name__)
+
+
+async def warm_access_tokens(
+    authorization: Authorization,
+    invalidation: InvalidationBus,
+    budget: float,
+    active_days: int,
+    batch_size: int,
+) -> None:
+    """
+    Prefills the access token cache at startup so the first requests after a
+    deploy don't all take the database + decrypt path at once. Gives up after
+    `budget` seconds, keeping whatever was cached by then.
+    """
+    started = time.monotonic()
+
+    async def warm() -> int:
+        # Wait for the invalidation listener so changes made while we're
+        # reading aren't missed
+        await invalidation.listening.wait()
+
+        return await authorization.warm_access_tokens(
+            active_since=pendulum.now().subtract(days=active_days),
+            batch_size=batch_size,
+        )
+
+    try:
+        warmed = await asyncio.wait_for(warm(), budget)
+    except asyncio.TimeoutError:
+        logger.warning(
+            f"Access token warmup ran out of its {budget}s budget",
+            extra={
+                "cached": authorization.access_tokens.stats.size,
+            },
+        )
+        return
+    except Exception as e:
+        logger.exception(f"An error occurred while warming access tokens: {e}")
+        return
+
+    logger.info(
+        f"Warmed {warmed} access tokens in {time.monotonic() - started:.2f}s",
+        extra={
+            "cached": warmed,
+        },
+    )
@@ -0,0 +1,119 @@
+"""
+Measures the per-request overhead of the session middleware on routes that
+don't use the session (webhooks, overlay polls), comparing:
+
+- no middleware at all
+- the previous `@api.middleware("http")` version (a `BaseHTTPMiddleware`),
+  which parsed the cookie on every request
+- `JwtMiddleware`, which only looks at the path
+
+Requests are driven straight through the ASGI interface, so the numbers are
+the middleware and routing overhead only.
+
+    python -m benchmarks.jwt_middleware
+"""
+import asyncio
+import time
+from typing import Any
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import PlainTextResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.identity.jwt import AccessToken, TokenException
+from app.middleware.jwt_middleware import JwtMiddleware
+
+
+COOKIE = AccessToken(
+    access_token="not.a.jwt",
+    refresh_token="refresh_token",
+    expires_in=3600,
+    scope=[],
+    token_type="bearer",
+).model_dump_json()
+
+
+async def legacy_jwt_middleware(request: Request, call_next: Any) -> Response:
+    """
+    The cookie handling the previous middleware did on every request, minus
+    the JWT verification (the cookie here never gets that far).
+    """
+    access_token_raw = request.cookies.get("access_token")
+
+    if not access_token_raw:
+        return await call_next(request)
+
+    try:
+        AccessToken.from_json(access_token_raw)
+    except TokenException:
+        pass
+
+    return await call_next(request)
+
+
+def application(middleware: str | None) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/twitch/webhook")
+    async def webhook() -> Response:
+        return PlainTextResponse("ok")
+
+    if middleware == "base":
+        app.add_middleware(BaseHTTPMiddleware, dispatch=legacy_jwt_middleware)
+    elif middleware == "asgi":
+        app.add_middleware(JwtMiddleware)
+
+    return app
+
+
+async def request(app: FastAPI) -> None:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/twitch/webhook",
+        "raw_path": b"/twitch/webhook",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"cookie", f"access_token={COOKIE}".encode())],
+        "client": ("127.0.0.1", 1234),
+        "server": ("127.0.0.1", 80),
+    }
+
+    async def receive() -> dict:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: dict) -> None:
+        pass
+
+    await app(scope, receive, send)
+
+
+async def bench(name: str, app: FastAPI, number: int = 5000) -> float:
+    for _ in range(100):
+        await request(app)
+
+    start = time.perf_counter()
+
+    for _ in range(number):
+        await request(app)
+
+    per_request = (time.perf_counter() - start) / number * 1e6
+    print(f"{name:36} {per_request:8.1f} us/request")
+
+    return per_request
+
+
+async def main() -> None:
+    baseline = await bench("no middleware", application(None))
+    legacy = await bench("BaseHTTPMiddleware (previous)", application("base"))
+    asgi = await bench("JwtMiddleware (ASGI, path check)", application("asgi"))
+
+    print()
+    print(f"overhead removed: {legacy - asgi:.1f} us/request ({asgi - baseline:.1f} us remaining)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,131 @@
+"""
+Compares the size and parse time of a default Spotify search response
+(`type=track,artist,album`, default page size of 20) with the lean search
+(`type=track`, `limit=1`, `market=from_token`).
+
+The payloads are synthetic but follow the shape of Spotify's search response,
+including the fields the API never uses (`available_markets`, images, external
+ids, ...). When a market is given, Spotify omits `available_markets`.
+
+    python -m benchmarks.search_payload
+"""
+import json
+import timeit
+
+from app.clients.spotify import SearchPayload
+
+
+MARKETS = ["AD", "AE", "AG", "AL", "AM", "AO", "AR", "AT", "AU", "AZ"] * 18
+
+
+def image(size: int) -> dict:
+    return {"url": f"https://i.scdn.co/image/{'a' * 40}", "height": size, "width": size}
+
+
+def artist(index: int, full: bool = False) -> dict:
+    value = {
+        "external_urls": {"spotify": f"https://open.spotify.com/artist/{index:022d}"},
+        "href": f"https://api.spotify.com/v1/artists/{index:022d}",
+        "id": f"{index:022d}",
+        "name": f"Artist {index}",
+        "type": "artist",
+        "uri": f"spotify:artist:{index:022d}",
+    }
+
+    if full:
+        value.update({
+            "followers": {"href": None, "total": 123456},
+            "genres": ["pop", "dance pop", "post-teen pop"],
+            "images": [image(640), image(320), image(160)],
+            "popularity": 80,
+        })
+
+    return value
+
+
+def album(index: int, markets: bool) -> dict:
+    value = {
+        "album_type": "album",
+        "artists": [artist(index)],
+        "external_urls": {"spotify": f"https://open.spotify.com/album/{index:022d}"},
+        "href": f"https://api.spotify.com/v1/albums/{index:022d}",
+        "id": f"{index:022d}",
+        "images": [image(640), image(300), image(64)],
+        "name": f"Album {index}",
+        "release_date": "2020-01-01",
+        "release_date_precision": "day",
+        "total_tracks": 12,
+        "type": "album",
+        "uri": f"spotify:album:{index:022d}",
+    }
+
+    if markets:
+        value["available_markets"] = MARKETS
+
+    return value
+
+
+def track(index: int, markets: bool) -> dict:
+    value = {
+        "album": album(index, markets),
+        "artists": [artist(index), artist(index + 1)],
+        "disc_number": 1,
+        "duration_ms": 213573,
+        "explicit": False,
+        "external_ids": {"isrc": "GBARL9300135"},
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{index:022d}"},
+        "href": f"https://api.spotify.com/v1/tracks/{index:022d}",
+        "id": f"{index:022d}",
+        "is_local": False,
+        "name": f"Track {index}",
+        "popularity": 75,
+        "preview_url": None,
+        "track_number": 1,
+        "type": "track",
+        "uri": f"spotify:track:{index:022d}",
+    }
+
+    if markets:
+        value["available_markets"] = MARKETS
+
+    return value
+
+
+def page(items: list[dict], kind: str) -> dict:
+    return {
+        "href": f"https://api.spotify.com/v1/search?query=never+gonna&type={kind}&offset=0&limit={len(items)}",
+        "items": items,
+        "limit": len(items),
+        "next": None,
+        "offset": 0,
+        "previous": None,
+        "total": 1000,
+    }
+
+
+def default_payload() -> bytes:
+    return json.dumps({
+        "tracks": page([track(i, markets=True) for i in range(20)], "track"),
+        "artists": page([artist(i, full=True) for i in range(20)], "artist"),
+        "albums": page([album(i, markets=True) for i in range(20)], "album"),
+    }).encode()
+
+
+def lean_payload() -> bytes:
+    return json.dumps({
+        "tracks": page([track(0, markets=False)], "track"),
+    }).encode()
+
+
+def bench(name: str, payload: bytes, number: int = 2000) -> None:
+    kwargs_parse = timeit.timeit(lambda: SearchPayload(**json.loads(payload)), number=number)
+    json_parse = timeit.timeit(lambda: SearchPayload.model_validate_json(payload), number=number)
+
+    print(f"{name}: {len(payload):,} bytes")
+    print(f"  json() + kwargs:       {kwargs_parse / number * 1e6:8.1f} us/parse")
+    print(f"  model_validate_json(): {json_parse / number * 1e6:8.1f} us/parse")
+
+
+if __name__ == "__main__":
+    bench("default search (track,artist,album; limit=20)", default_payload())
+    bench("lean search (track; limit=1; market)", lean_payload())
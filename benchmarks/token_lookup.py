@@ -0,0 +1,103 @@
+"""
+Compares the cold-request token lookups of the Spotify routes:
+
+- ORM: the same lookup by `token_hash`, joined through the user to their
+  authorization token, as one Tortoise query read into an `AuthorizationToken`
+- repository: `TokenRepository.get_api_token_authorization`; one prepared,
+  joined statement read into slotted records
+
+Reports the mean time per request and the memory allocated per request. Needs
+a migrated database (see `db/`):
+
+    DATABASE_URL=postgres://... python -m benchmarks.token_lookup
+"""
+import asyncio
+import os
+import secrets
+import time
+import tracemalloc
+from typing import Awaitable, Callable
+
+import pendulum
+from tortoise import Tortoise
+
+from app.models.sql.api_token import ApiToken
+from app.models.sql.authorization_token import AuthorizationToken, Origin
+from app.models.sql.user import User
+from app.repositories import TokenRepository
+from app.services.authorization import hash_api_token
+
+
+async def orm_lookup(token_hash: bytes) -> None:
+    await AuthorizationToken.filter(
+        user__api_token__token_hash=token_hash,
+        user__api_token__invalidated_at__isnull=True,
+        origin=Origin.Spotify,
+    ).first()
+
+
+async def bench(name: str, lookup: Callable[[], Awaitable[None]], number: int = 2000) -> None:
+    # warm up the pool and statement caches
+    for _ in range(50):
+        await lookup()
+
+    start = time.perf_counter()
+
+    for _ in range(number):
+        await lookup()
+
+    elapsed = time.perf_counter() - start
+
+    # peak memory allocated while handling a single request
+    allocated = 0
+    tracemalloc.start()
+
+    for _ in range(number):
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        await lookup()
+        _, peak = tracemalloc.get_traced_memory()
+        allocated += peak - current
+
+    tracemalloc.stop()
+
+    print(f"{name}:")
+    print(f"  {elapsed / number * 1e6:8.1f} us/request")
+    print(f"  {allocated / number:8.0f} bytes allocated/request")
+
+
+async def main() -> None:
+    await Tortoise.init(
+        db_url=os.environ["DATABASE_URL"],
+        modules={"models": ["app.models.sql"]},
+    )
+
+    user = await User.create(username="benchmark", external_user_id=f"benchmark-{secrets.token_hex(8)}")
+
+    try:
+        token = secrets.token_urlsafe(32)
+        token_hash = hash_api_token(token)
+
+        await ApiToken.create(user_id=user.id, token_hash=token_hash)
+        await AuthorizationToken.create(
+            user_id=user.id,
+            origin=Origin.Spotify,
+            access_token="access_token",
+            refresh_token="refresh_token",
+            expires_at=pendulum.now().add(hours=1),
+        )
+
+        repository = TokenRepository()
+
+        await bench("ORM (one joined query)", lambda: orm_lookup(token_hash))
+        await bench(
+            "repository (one joined query)",
+            lambda: repository.get_api_token_authorization(token_hash, Origin.Spotify),
+        )
+    finally:
+        await user.delete()
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,10 @@
+-- migrate:up
+
+-- Set while a worker is refreshing the token; other workers leave the row
+-- alone until the lease is released or runs out
+ALTER TABLE authorization_token ADD COLUMN refresh_lease_until TIMESTAMPTZ;
+
+
+-- migrate:down
+
+ALTER TABLE authorization_token DROP COLUMN refresh_lease_until;
@@ -0,0 +1,14 @@
+-- migrate:up
+
+-- Keep only the most recent token for each user and origin, so the unique
+-- index in the next migration can be built
+DELETE FROM authorization_token a
+    USING authorization_token b
+    WHERE a.user_id = b.user_id
+        AND a.origin = b.origin
+        AND a.id < b.id;
+
+
+-- migrate:down
+
+-- Removed duplicates can't be restored
@@ -0,0 +1,10 @@
+-- migrate:up transaction:false
+
+-- The conflict target of Authorization's upsert; built concurrently so the
+-- table stays writable meanwhile
+CREATE UNIQUE INDEX CONCURRENTLY authorization_token_user_id_origin_key ON authorization_token (user_id, origin);
+
+
+-- migrate:down transaction:false
+
+DROP INDEX CONCURRENTLY authorization_token_user_id_origin_key;
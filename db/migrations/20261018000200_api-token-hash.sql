@@ -0,0 +1,11 @@
+-- migrate:up
+
+-- API tokens are looked up by their SHA-256 digest; the plaintext column is
+-- kept (nullable) only until existing rows are backfilled
+ALTER TABLE api_token ADD COLUMN token_hash BYTEA;
+ALTER TABLE api_token ALTER COLUMN token DROP NOT NULL;
+
+
+-- migrate:down
+
+ALTER TABLE api_token DROP COLUMN token_hash;
@@ -0,0 +1,30 @@
+-- migrate:up transaction:false
+
+-- Hash existing tokens, committing every batch so no lock is held on more
+-- than a batch of rows at a time. The plaintext stays until every worker
+-- looks tokens up by digest; see 20261018000500_api-token-drop-plaintext
+DO $$
+DECLARE
+    updated INTEGER;
+BEGIN
+    LOOP
+        UPDATE api_token
+            SET token_hash = sha256(convert_to(token, 'UTF8'))
+            WHERE id IN (
+                SELECT id FROM api_token
+                    WHERE token_hash IS NULL AND token IS NOT NULL
+                    LIMIT 1000
+            );
+
+        GET DIAGNOSTICS updated = ROW_COUNT;
+        COMMIT;
+
+        EXIT WHEN updated = 0;
+    END LOOP;
+END
+$$;
+
+
+-- migrate:down
+
+UPDATE api_token SET token_hash = NULL WHERE token IS NOT NULL;
@@ -0,0 +1,8 @@
+-- migrate:up transaction:false
+
+CREATE UNIQUE INDEX CONCURRENTLY api_token_token_hash_key ON api_token (token_hash);
+
+
+-- migrate:down transaction:false
+
+DROP INDEX CONCURRENTLY api_token_token_hash_key;
@@ -0,0 +1,10 @@
+-- migrate:up
+
+-- Only the digest is written now; the legacy plaintext column is NULL for
+-- every new token and unique on token_hash instead
+ALTER TABLE api_token DROP CONSTRAINT api_token_token_key;
+
+
+-- migrate:down
+
+ALTER TABLE api_token ADD CONSTRAINT api_token_token_key UNIQUE (token);
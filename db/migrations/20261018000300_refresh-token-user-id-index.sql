@@ -0,0 +1,11 @@
+-- migrate:up transaction:false
+
+-- Identity.create_access_token looks up a user's active refresh token (a
+-- user has only a handful of rows, so the predicate needn't be in the index),
+-- and deleting a user cascades to their refresh tokens
+CREATE INDEX CONCURRENTLY refresh_token_user_id_idx ON refresh_token (user_id);
+
+
+-- migrate:down transaction:false
+
+DROP INDEX CONCURRENTLY refresh_token_user_id_idx;
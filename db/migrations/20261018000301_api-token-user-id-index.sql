@@ -0,0 +1,9 @@
+-- migrate:up transaction:false
+
+-- Revoking a user's API tokens, and cascading deletes of a user
+CREATE INDEX CONCURRENTLY api_token_user_id_idx ON api_token (user_id);
+
+
+-- migrate:down transaction:false
+
+DROP INDEX CONCURRENTLY api_token_user_id_idx;
@@ -0,0 +1,10 @@
+-- migrate:up transaction:false
+
+-- TokenRefresher scans for valid tokens about to expire; authorization_token
+-- (user_id, origin) is already covered by authorization_token_user_id_origin_key
+CREATE INDEX CONCURRENTLY authorization_token_expires_at_idx ON authorization_token (expires_at) WHERE NOT invalid_token;
+
+
+-- migrate:down transaction:false
+
+DROP INDEX CONCURRENTLY authorization_token_expires_at_idx;
@@ -0,0 +1,10 @@
+-- migrate:up
+
+-- When an API token last authenticated a request, so the access token cache
+-- warmup can find streamers who only use the overlay
+ALTER TABLE api_token ADD COLUMN last_used_at TIMESTAMPTZ;
+
+
+-- migrate:down
+
+ALTER TABLE api_token DROP COLUMN last_used_at;
@@ -0,0 +1,12 @@
+-- migrate:up
+
+-- Only ship this once no worker still reads api_token.token, i.e. in a
+-- release after the one that switched lookups to token_hash; until then old
+-- workers authenticate by plaintext during a rolling deploy
+ALTER TABLE api_token DROP COLUMN token;
+
+
+-- migrate:down
+
+-- Plaintext tokens can't be recovered from their digests
+ALTER TABLE api_token ADD COLUMN token CHARACTER VARYING;
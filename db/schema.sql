@@ -30,9 +30,10 @@ SET default_table_access_method = heap;
 CREATE TABLE public.api_token (
     id integer NOT NULL,
     user_id integer,
-    token character varying NOT NULL,
     created_at timestamp with time zone DEFAULT CURRENT_TIMESTAMP,
-    invalidated_at timestamp with time zone
+    invalidated_at timestamp with time zone,
+    token_hash bytea,
+    last_used_at timestamp with time zone
 );
 
 
@@ -100,7 +101,8 @@ CREATE TABLE public.authorization_token (
     access_token character varying NOT NULL,
     refresh_token character varying NOT NULL,
     invalid_token boolean DEFAULT false,
-    expires_at timestamp with time zone
+    expires_at timestamp with time zone,
+    refresh_lease_until timestamp with time zone
 );
 
 
@@ -203,14 +205,6 @@ ALTER TABLE ONLY public.api_token
     ADD CONSTRAINT api_token_pkey PRIMARY KEY (id);
 
 
---
--- Name: api_token api_token_token_key; Type: CONSTRAINT; Schema: public; Owner: -
---
-
-ALTER TABLE ONLY public.api_token
-    ADD CONSTRAINT api_token_token_key UNIQUE (token);
-
-
 --
 -- Name: application_user application_user_external_user_id_key; Type: CONSTRAINT; Schema: public; Owner: -
 --
@@ -267,6 +261,41 @@ ALTER TABLE ONLY public.schema_migrations
     ADD CONSTRAINT schema_migrations_pkey PRIMARY KEY (version);
 
 
+--
+-- Name: api_token_token_hash_key; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE UNIQUE INDEX api_token_token_hash_key ON public.api_token USING btree (token_hash);
+
+
+--
+-- Name: api_token_user_id_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX api_token_user_id_idx ON public.api_token USING btree (user_id);
+
+
+--
+-- Name: authorization_token_expires_at_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX authorization_token_expires_at_idx ON public.authorization_token USING btree (expires_at) WHERE (NOT invalid_token);
+
+
+--
+-- Name: authorization_token_user_id_origin_key; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE UNIQUE INDEX authorization_token_user_id_origin_key ON public.authorization_token USING btree (user_id, origin);
+
+
+--
+-- Name: refresh_token_user_id_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX refresh_token_user_id_idx ON public.refresh_token USING btree (user_id);
+
+
 --
 -- Name: api_token api_token_user_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: -
 --
@@ -301,4 +330,16 @@ ALTER TABLE ONLY public.refresh_token
 --
 
 INSERT INTO public.schema_migrations (version) VALUES
-    ('20240211001319');
+    ('20240211001319'),
+    ('20261018000000'),
+    ('20261018000100'),
+    ('20261018000101'),
+    ('20261018000200'),
+    ('20261018000201'),
+    ('20261018000202'),
+    ('20261018000203'),
+    ('20261018000300'),
+    ('20261018000301'),
+    ('20261018000302'),
+    ('20261018000400'),
+    ('20261018000500');
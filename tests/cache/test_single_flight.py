@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from app.cache import SingleFlight, coalesced
+
+
+class Client:
+    def __init__(self) -> None:
+        self.single_flight = SingleFlight()
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    @coalesced
+    async def fetch(self, key: str) -> str:
+        self.calls += 1
+        await self.release.wait()
+
+        if key == "error":
+            raise ValueError("upstream failed")
+
+        return f"result-{key}"
+
+
+class TestSingleFlight:
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_coalesced(self):
+        client = Client()
+
+        tasks = [asyncio.create_task(client.fetch("a")) for _ in range(5)]
+        other = asyncio.create_task(client.fetch("b"))
+        await asyncio.sleep(0)
+
+        client.release.set()
+        results = await asyncio.gather(*tasks, other)
+
+        assert results == ["result-a"] * 5 + ["result-b"]
+        assert client.calls == 2
+        assert not client.single_flight.in_flight
+
+    @pytest.mark.asyncio
+    async def test_errors_propagate_to_all_waiters(self):
+        client = Client()
+
+        tasks = [asyncio.create_task(client.fetch("error")) for _ in range(3)]
+        await asyncio.sleep(0)
+
+        client.release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        assert all(isinstance(result, ValueError) for result in results)
+        assert client.calls == 1
+
+    @pytest.mark.asyncio
+    async def test_nothing_cached_after_completion(self):
+        client = Client()
+        client.release.set()
+
+        await client.fetch("a")
+        await client.fetch("a")
+
+        assert client.calls == 2
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_does_not_cancel_others(self):
+        client = Client()
+
+        first = asyncio.create_task(client.fetch("a"))
+        second = asyncio.create_task(client.fetch("a"))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        client.release.set()
+
+        assert await second == "result-a"
+        assert first.cancelled()
@@ -0,0 +1,38 @@
+from app.cache import SizedTTLCache
+
+
+class TestSizedTTLCache:
+    def test_evicts_by_bytes(self):
+        cache = SizedTTLCache(max_entries=100, max_bytes=10, ttl=60, sizeof=len)
+
+        cache.set("a", b"aaaa")
+        cache.set("b", b"bbbb")
+        cache.get("a") # a is now the most recently used
+        cache.set("c", b"cccc")
+
+        assert cache.get("b") is None
+        assert cache.get("a") == b"aaaa"
+        assert cache.stats.bytes == 8
+
+    def test_evicts_by_entries(self):
+        cache = SizedTTLCache(max_entries=2, max_bytes=100, ttl=60, sizeof=len)
+
+        for key in "abc":
+            cache.set(key, b"x")
+
+        assert cache.stats.size == 2
+        assert cache.get("a") is None
+
+    def test_skips_oversized_values(self):
+        cache = SizedTTLCache(max_entries=2, max_bytes=4, ttl=60, sizeof=len)
+
+        cache.set("a", b"too large")
+
+        assert cache.get("a") is None
+        assert cache.stats.misses == 1
+
+    def test_bounded_by_bytes(self):
+        cache = SizedTTLCache(max_entries=2, max_bytes=100, ttl=60, sizeof=len)
+
+        assert cache.cache.maxsize == 100
+        assert cache.cache.getsizeof(b"abc") == 3
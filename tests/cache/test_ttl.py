@@ -0,0 +1,55 @@
+import pytest
+
+from app.cache import AsyncTTLCache
+
+
+class FakeTimer:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestAsyncTTLCache:
+    @pytest.mark.asyncio
+    async def test_get_or_load_caches_result(self):
+        cache = AsyncTTLCache(maxsize=16, ttl=5)
+        calls = 0
+
+        async def loader():
+            nonlocal calls
+            calls += 1
+            return "value"
+
+        assert await cache.get_or_load("key", loader) == "value"
+        assert await cache.get_or_load("key", loader) == "value"
+
+        assert calls == 1
+        assert cache.stats.hits == 1
+        assert cache.stats.misses == 1
+
+    @pytest.mark.asyncio
+    async def test_get_or_load_expires(self):
+        timer = FakeTimer()
+        cache = AsyncTTLCache(maxsize=16, ttl=5, timer=timer)
+        calls = 0
+
+        async def loader():
+            nonlocal calls
+            calls += 1
+            return calls
+
+        assert await cache.get_or_load("key", loader) == 1
+
+        timer.now = 6
+        assert await cache.get_or_load("key", loader) == 2
+
+    def test_invalidate(self):
+        cache = AsyncTTLCache(maxsize=16, ttl=5)
+        cache.set("key", "value")
+
+        cache.invalidate("key")
+        cache.invalidate("missing")
+
+        assert cache.get("key") is None
@@ -0,0 +1,29 @@
+import pytest
+
+from app.clients.http import SPOTIFY_API_URL, TWITCH_ID_URL, HttpClients
+
+
+class TestHttpClients:
+    @pytest.mark.asyncio
+    async def test_get_reuses_client(self):
+        http_clients = HttpClients()
+
+        client = http_clients.get(SPOTIFY_API_URL)
+
+        assert http_clients.get(SPOTIFY_API_URL) is client
+        assert http_clients.get(TWITCH_ID_URL) is not client
+        assert str(client.base_url).startswith(SPOTIFY_API_URL)
+
+        await http_clients.aclose()
+
+    @pytest.mark.asyncio
+    async def test_aclose(self):
+        http_clients = HttpClients()
+        client = http_clients.get(SPOTIFY_API_URL)
+
+        await http_clients.aclose()
+
+        assert client.is_closed
+        assert http_clients.get(SPOTIFY_API_URL) is not client
+
+        await http_clients.aclose()
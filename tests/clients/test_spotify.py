@@ -0,0 +1,143 @@
+import httpx
+import pytest
+
+from app.clients.spotify import TrackCache, track_size
+from app.exceptions import NoActiveDeviceException
+from app.models.spotify import Track
+
+
+DEVICES = {
+    "devices": [
+        {
+            "id": "device_id",
+            "is_active": True,
+            "is_private_session": False,
+            "is_restricted": False,
+            "name": "Speaker",
+            "type": "Computer",
+            "volume_percent": 50,
+            "supports_volume": True,
+        },
+    ],
+}
+
+
+class TestSpotifyClient:
+    @pytest.mark.asyncio
+    async def test_get_available_devices_cached(self, mock_spotify_client):
+        requests = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            return httpx.Response(200, json=DEVICES)
+
+        client = mock_spotify_client(handler)
+
+        first = await client.get_available_devices("access_token")
+        second = await client.get_available_devices("access_token")
+
+        assert first.active_device.id == "device_id"
+        assert second is first
+        assert len(requests) == 1
+
+        await client.get_available_devices("other_access_token")
+        assert len(requests) == 2
+
+    @pytest.mark.asyncio
+    async def test_no_active_device_evicts_devices(self, mock_spotify_client):
+        requests = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+
+            if request.url.path == "/v1/me/player/pause":
+                return httpx.Response(404, json={"error": {"status": 404, "reason": "NO_ACTIVE_DEVICE"}})
+
+            return httpx.Response(200, json=DEVICES)
+
+        client = mock_spotify_client(handler)
+
+        await client.get_available_devices("access_token")
+
+        with pytest.raises(NoActiveDeviceException):
+            await client.pause_song("access_token")
+
+        await client.get_available_devices("access_token")
+        assert len(requests) == 3
+
+    @pytest.mark.asyncio
+    async def test_other_not_found_propagates(self, mock_spotify_client):
+        def handler(request: httpx.Request) -> httpx.Response:
+            return httpx.Response(404, json={"error": {"status": 404, "message": "Non existing id"}})
+
+        client = mock_spotify_client(handler)
+
+        with pytest.raises(httpx.HTTPStatusError):
+            await client.enqueue_song("access_token", "spotify:track:unknown")
+
+    @pytest.mark.asyncio
+    async def test_search_track_cached_by_normalized_query(self, mock_spotify_client, spotify_track):
+        requests = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            return httpx.Response(200, json={"tracks": {"items": [spotify_track]}})
+
+        client = mock_spotify_client(handler)
+
+        first = await client.search_track("access_token", "Never  Gonna Give You Up")
+        second = await client.search_track("access_token", " never gonna give you up ")
+
+        assert first == second
+        assert len(requests) == 1
+        assert client.search_cache.stats.hits == 1
+
+        # Only tracks are requested
+        assert requests[0].url.params["type"] == "track"
+        assert requests[0].url.params["limit"] == "1"
+        assert requests[0].url.params["market"] == "from_token"
+
+        # The resolved track also fills the track cache
+        track = await client.get_track("access_token", "4uLU6hMCjMI75M1A2tKUQC")
+
+        assert track == first
+        assert len(requests) == 1
+
+    @pytest.mark.asyncio
+    async def test_search_cache_scoped_to_market(self, mock_spotify_client, spotify_track):
+        requests = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            return httpx.Response(200, json={"tracks": {"items": [spotify_track]}})
+
+        # With the user's own market, results aren't shared between users
+        client = mock_spotify_client(handler)
+
+        await client.search_track("access_token", "never gonna give you up")
+        await client.search_track("other_access_token", "never gonna give you up")
+
+        assert len(requests) == 2
+        assert client.get_cached_search("never gonna give you up") is None
+
+        # A fixed market is shared
+        client = mock_spotify_client(handler, search_market="US")
+
+        await client.search_track("access_token", "never gonna give you up")
+        await client.search_track("other_access_token", "never gonna give you up")
+
+        assert len(requests) == 3
+        assert requests[2].url.params["market"] == "US"
+        assert client.get_cached_search("never gonna give you up")
+
+
+class TestTrackCache:
+    def test_holds_validated_tracks(self, spotify_track):
+        cache = TrackCache(max_entries=10, max_bytes=10_000, ttl=60)
+        track = Track.model_validate(spotify_track)
+
+        cache.set("4uLU6hMCjMI75M1A2tKUQC", track)
+
+        # no re-parsing on a hit
+        assert cache.get("4uLU6hMCjMI75M1A2tKUQC") is track
+        assert cache.stats.bytes == track_size(track)
@@ -0,0 +1,108 @@
+import json
+from typing import Any
+
+import pendulum
+import pytest
+from tortoise import BaseDBAsyncClient
+
+from app.models.encrypted import Encrypted
+from app.models.sql.authorization_token import Origin
+from app.models.sql.refresh_token import RefreshToken
+from app.repositories.tokens import API_TOKEN, API_TOKEN_AUTHORIZATION, AUTHORIZATION_TOKEN
+from app.services.authorization import INVALIDATE_USER_API_TOKENS, hash_api_token
+from app.services.token_refresher import TokenRefresher
+
+
+async def index_names(connection: BaseDBAsyncClient, query: str, values: list[Any] | None = None) -> set[str]:
+    """
+    The indexes a query's plan scans.
+    """
+    rows = await connection.execute_query_dict(f"EXPLAIN (FORMAT JSON) {query}", values)
+    plan = rows[0]["QUERY PLAN"]
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    names: set[str] = set()
+    nodes = [plan[0]["Plan"]]
+
+    while nodes:
+        node = nodes.pop()
+
+        if "Index Name" in node:
+            names.add(node["Index Name"])
+
+        nodes.extend(node.get("Plans", []))
+
+    return names
+
+
+class TestQueryPlans:
+    """
+    Plans for the statements the app issues: the repository's SQL, and the
+    ORM queries as Tortoise renders them.
+    """
+    @pytest.mark.asyncio(scope="session")
+    async def test_access_token_lookup(self, seeded_users):
+        names = await index_names(seeded_users, AUTHORIZATION_TOKEN, [42, str(Origin.Spotify)])
+
+        assert "authorization_token_user_id_origin_key" in names
+
+    @pytest.mark.asyncio(scope="session")
+    async def test_expiring_access_tokens(self, seeded_users, mocker):
+        refresher = TokenRefresher(
+            mocker.Mock(),
+            interval=60,
+            window=600,
+            concurrency=1,
+            jitter=0,
+            batch_size=500,
+        )
+
+        names = await index_names(seeded_users, refresher.expiring().sql(params_inline=True))
+
+        assert "authorization_token_expires_at_idx" in names
+
+    @pytest.mark.asyncio(scope="session")
+    async def test_active_refresh_token_lookup(self, seeded_users):
+        # Identity.create_access_token
+        query = RefreshToken.filter(user_id=42, invalidated_at__isnull=True)
+        names = await index_names(seeded_users, query.sql(params_inline=True))
+
+        assert "refresh_token_user_id_idx" in names
+
+    @pytest.mark.asyncio(scope="session")
+    async def test_refresh_token_hash_lookup(self, seeded_users):
+        # Identity.rotate_refresh_token
+        query = RefreshToken.filter(refresh_token_hash=Encrypted.hash("refresh_token"))
+        names = await index_names(seeded_users, query.sql(params_inline=True))
+
+        assert "refresh_token_refresh_token_hash_key" in names
+
+    @pytest.mark.asyncio(scope="session")
+    async def test_api_token_lookup(self, seeded_users):
+        names = await index_names(seeded_users, API_TOKEN, [hash_api_token("token")])
+
+        assert "api_token_token_hash_key" in names
+
+    @pytest.mark.asyncio(scope="session")
+    async def test_api_token_authorization_lookup(self, seeded_users):
+        names = await index_names(
+            seeded_users,
+            API_TOKEN_AUTHORIZATION,
+            [hash_api_token("token"), str(Origin.Spotify)],
+        )
+
+        assert "api_token_token_hash_key" in names
+        assert "authorization_token_user_id_origin_key" in names
+
+    @pytest.mark.asyncio(scope="session")
+    async def test_api_tokens_by_user(self, seeded_users):
+        # Authorization.rotate_api_token
+        names = await index_names(
+            seeded_users,
+            INVALIDATE_USER_API_TOKENS,
+            [42, pendulum.now()],
+        )
+
+        assert "api_token_user_id_idx" in names
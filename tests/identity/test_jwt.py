@@ -0,0 +1,109 @@
+import json
+
+from joserfc import jwt as joserfc_jwt
+from joserfc.jwk import ECKey, KeySet, OctKey, OKPKey
+import pytest
+
+from app.configuration import Configuration
+from app.identity.jwt import Jwks, Jwt, JwtKeyring, TokenException, VerifiedJwtCache, import_key
+
+
+SECRET = "5d70a2b6386db77d88c4b7be20ccf37a"
+
+
+class TestJwt:
+    def test_round_trip(self):
+        key = import_key(SECRET)
+        jwt = Jwt.construct_jwt(1, "test_user", 3600)
+
+        assert isinstance(key, OctKey)
+        assert import_key(SECRET) is key
+        assert Jwt.decode(jwt.encode(key), SECRET) == jwt
+
+
+def keyring(*kids: str, algorithm: str = "EdDSA", signing_key_id: str | None = None) -> JwtKeyring:
+    keys = KeySet([
+        OKPKey.generate_key("Ed25519", parameters={"kid": kid}) if algorithm == "EdDSA"
+        else ECKey.generate_key("P-256", parameters={"kid": kid})
+        for kid in kids
+    ])
+
+    return JwtKeyring(algorithm, keys, signing_key_id=signing_key_id, secret=import_key(SECRET))
+
+
+class TestJwtKeyring:
+    @pytest.mark.parametrize("algorithm", ["EdDSA", "ES256"])
+    def test_round_trip(self, algorithm):
+        keys = keyring("current", algorithm=algorithm)
+        jwt = Jwt.construct_jwt(1, "test_user", 3600)
+
+        decoded = Jwt.decode(jwt.encode(keys), keys)
+
+        assert decoded.header.alg == algorithm
+        assert decoded.header.kid == "current"
+        assert decoded.claims == jwt.claims
+
+    def test_rotation(self):
+        old_keys = keyring("old", "new")
+        new_keys = JwtKeyring("EdDSA", old_keys.keys, signing_key_id="new")
+        jwt = Jwt.construct_jwt(1, "test_user", 3600)
+
+        assert Jwt.decode(jwt.encode(old_keys), new_keys).header.kid == "old"
+        assert Jwt.decode(jwt.encode(new_keys), old_keys).header.kid == "new"
+
+    def test_legacy_hs256(self):
+        keys = keyring("current")
+        jwt = Jwt.construct_jwt(1, "test_user", 3600)
+
+        assert Jwt.decode(jwt.encode(SECRET), keys).claims == jwt.claims
+
+        # the secret isn't a verification key for asymmetric algorithms
+        with pytest.raises(TokenException):
+            Jwt.decode(jwt.encode(keyring("current")), keys)
+
+        # nor can a published key be used as an HMAC secret
+        public_key = keys.signing_key.as_dict(private=False)["x"]
+        token = joserfc_jwt.encode(
+            {"alg": "HS256", "kid": "current"},
+            jwt.claims.model_dump(),
+            OctKey.import_key(public_key),
+        )
+
+        with pytest.raises(TokenException):
+            Jwt.decode(token, keys)
+
+    def test_from_configuration(self, monkeypatch):
+        assert JwtKeyring.from_configuration(Configuration()) is None
+
+        key = ECKey.generate_key("P-256")
+        monkeypatch.setenv("JWT_ALGORITHM", "ES256")
+        monkeypatch.setenv("JWT_SIGNING_KEYS", json.dumps({"keys": [key.as_dict(private=True)]}))
+
+        keys = JwtKeyring.from_configuration(Configuration())
+
+        assert keys.signing_key.kid == key.thumbprint()
+
+    def test_jwks(self):
+        keys = keyring("old", "new")
+        jwks = Jwks.from_keyring(keys)
+        document = json.loads(jwks.body)
+
+        assert [key["kid"] for key in document["keys"]] == ["old", "new"]
+        assert all("d" not in key for key in document["keys"])
+        assert Jwks.from_keyring(None).body == b'{"keys":[]}'
+
+
+class TestVerifiedJwtCache:
+    def test_expires_with_jwt(self):
+        now = 0.0
+        jwt = Jwt.construct_jwt(1, "test_user", 3600)
+        cache = VerifiedJwtCache(timer=lambda: now)
+
+        now = jwt.claims.exp - 1
+        cache.set("cookie", jwt)
+
+        assert cache.get("cookie") == jwt
+        assert cache.get("other") is None
+
+        now = jwt.claims.exp
+        assert cache.get("cookie") is None
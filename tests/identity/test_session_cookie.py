@@ -0,0 +1,53 @@
+import pytest
+
+from app.identity.jwt import AccessToken, Jwt, TokenException
+from app.identity.session_cookie import SessionCookie
+
+
+SECRET = "5d70a2b6386db77d88c4b7be20ccf37a"
+
+
+def access_token() -> AccessToken:
+    return AccessToken(
+        access_token=Jwt.construct_jwt(1, "test_user", 3600).encode(SECRET),
+        refresh_token="Yk7y-o_l3mQh2sZ1x0Vd4w",
+        expires_in=3600,
+        scope=["user:read:email"],
+        token_type="bearer",
+    )
+
+
+class TestSessionCookie:
+    def test_round_trip(self):
+        token = access_token()
+        cookie = SessionCookie.from_access_token(token).encode()
+
+        assert cookie.startswith("v1.")
+        assert len(cookie) < len(token.model_dump_json())
+
+        session = SessionCookie.decode(cookie)
+
+        assert session.refresh_token == token.refresh_token
+        assert session.access_token == token.access_token
+        assert Jwt.decode(session.access_token, SECRET).claims.user_id == 1
+
+    def test_legacy_cookie(self):
+        token = access_token()
+        session = SessionCookie.decode(token.model_dump_json())
+
+        assert session == SessionCookie.from_access_token(token)
+
+    @pytest.mark.parametrize(
+        "cookie",
+        [
+            "garbage",
+            "v1.",
+            "v1.refresh_token",
+            "v2.refresh_token.a.b.c",
+            "{not json",
+            "{}",
+        ],
+    )
+    def test_invalid_cookie(self, cookie):
+        with pytest.raises(TokenException):
+            SessionCookie.decode(cookie)
@@ -1,64 +1,166 @@
-# @api.middleware("http")
-#async def jwt_middleware(request: Request, call_next: Any) -> Response:
-
 import freezegun
 import pytest
 
 from app.configuration import Configuration
 from app.identity.jwt import AccessToken, Jwt
-from app.middleware.jwt_middleware import jwt_middleware
+from app.identity.session_cookie import SessionCookie
+from app.middleware.jwt_middleware import JwtMiddleware
 from app.services.identity import Identity
 
 
+class Endpoint:
+    """
+    An ASGI app that records the session it was called with.
+    """
+    def __init__(self) -> None:
+        self.called = False
+        self.jwt: Jwt | None = None
+
+    async def __call__(self, scope, receive, send) -> None:
+        self.called = True
+        self.jwt = scope.get("state", {}).get("jwt")
+
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+
+def http_scope(app, path: str, cookie: str | None = None) -> dict:
+    headers = [(b"cookie", f"access_token={cookie}".encode())] if cookie else []
+
+    return {
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "headers": headers,
+        "app": app,
+    }
+
+
+async def call(middleware: JwtMiddleware, scope: dict) -> list[dict]:
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        messages.append(message)
+
+    await middleware(scope, receive, send)
+    return messages
+
+
+def set_cookies(messages: list[dict]) -> list[str]:
+    return [
+        value.decode()
+        for name, value in messages[0]["headers"]
+        if name == b"set-cookie"
+    ]
+
+
 class TestJwtMiddleware:
     @pytest.mark.asyncio
-    async def test_jwt_middleware(self, mocker, setup_user):
-        request = mocker.Mock()
-        response = mocker.Mock()
+    async def test_jwt_middleware(self, mocker):
+        app = mocker.Mock()
+        configuration = Configuration()
+        identity = Identity(configuration)
+        endpoint = Endpoint()
+        middleware = JwtMiddleware(endpoint)
 
-        async def call_next(request):
-            return response
-        
         async def refresh_token(refresh_token):
             return AccessToken(
-                access_token="new_access_token",
+                access_token=Jwt.construct_jwt(1, "test_user", 3600).encode(identity.jwt_key),
                 refresh_token="new_refresh_token",
                 expires_in=3600,
                 scope=["user:read:email"],
                 token_type="bearer",
             )
-        
+
         mocked_identity = mocker.patch.object(
             Identity,
             "refresh_token",
             side_effect=refresh_token,
         )
 
-        configuration = Configuration()
-        request.app.state.jwt = "some_jwt"
-        request.app.state.configuration = configuration
-        request.app.state.identity = Identity(configuration)
+        app.state.configuration = configuration
+        app.state.identity = identity
 
         with freezegun.freeze_time("2021-01-01"):
-            jwt = Jwt.construct_jwt(
-                setup_user.id,
-                setup_user.username,
-                0,
-            )
+            jwt = Jwt.construct_jwt(1, "test_user", 0)
 
         access_token = AccessToken(
-            access_token=jwt.encode(configuration.jwt_secret_key),
+            access_token=jwt.encode(identity.jwt_key),
             refresh_token="abc123",
             expires_in=-15, #
             scope=["user:read:email"],
             token_type="bearer",
         )
 
-        request.cookies = {"access_token": access_token.model_dump_json()}
-        response = await jwt_middleware(request, call_next)
+        messages = await call(middleware, http_scope(app, "/userinfo", access_token.model_dump_json()))
+        cookies = set_cookies(messages)
 
         assert mocked_identity.called
-        assert response.set_cookie.called
+        assert len(cookies) == 1
+
+        # The refresh token is stored too, not just the JWT
+        assert cookies[0].startswith("access_token=v1.new_refresh_token.")
+
+        assert endpoint.jwt
+        assert endpoint.jwt.claims.user_id == 1
+
+    @pytest.mark.asyncio
+    async def test_invalid_cookie(self, mocker):
+        app = mocker.Mock()
+        configuration = Configuration()
+        app.state.configuration = configuration
+        app.state.identity = Identity(configuration)
+        endpoint = Endpoint()
+
+        messages = await call(JwtMiddleware(endpoint), http_scope(app, "/oauth/spotify/redirect", "garbage"))
+        cookies = set_cookies(messages)
+
+        assert endpoint.called
+        assert endpoint.jwt is None
+        assert len(cookies) == 1
+        assert cookies[0].startswith("access_token=")
+        assert "Max-Age=0" in cookies[0]
+
+    @pytest.mark.asyncio
+    async def test_verified_cookie_is_cached(self, mocker):
+        app = mocker.Mock()
+        configuration = Configuration()
+        identity = Identity(configuration)
+        app.state.identity = identity
+        endpoint = Endpoint()
+        middleware = JwtMiddleware(endpoint)
+
+        access_token = AccessToken(
+            access_token=Jwt.construct_jwt(1, "test_user", 3600).encode(identity.jwt_key),
+            refresh_token="abc123",
+            expires_in=3600,
+            scope=["user:read:email"],
+            token_type="bearer",
+        )
+        cookie = SessionCookie.from_access_token(access_token).encode()
+
+        await call(middleware, http_scope(app, "/userinfo", cookie))
+        decode = mocker.spy(Jwt, "decode")
+        await call(middleware, http_scope(app, "/userinfo", cookie))
+
+        assert not decode.called
+        assert endpoint.jwt.claims.user_id == 1
+
+    @pytest.mark.asyncio
+    async def test_skips_routes_without_session(self, mocker):
+        app = mocker.Mock()
+        endpoint = Endpoint()
+        middleware = JwtMiddleware(endpoint)
+
+        for path in ("/healthcheck", "/twitch/webhook", "/spotify/current-song", "/userinfo-other"):
+            messages = await call(middleware, http_scope(app, path, "garbage"))
+
+            assert endpoint.called
+            assert endpoint.jwt is None
+            assert not set_cookies(messages)
 
-        assert request.state.jwt
-        assert request.state.jwt.claims.user_id == setup_user.id
\ No newline at end of file
+        # Configuration is never looked at
+        assert not app.state.mock_calls
@@ -0,0 +1,23 @@
+import pendulum
+
+from app.models.sql.authorization_token import Origin
+from app.repositories.tokens import AuthorizationTokenRecord
+
+
+class TestAuthorizationTokenRecord:
+    def test_from_row(self):
+        expires_at = pendulum.now()
+        record = AuthorizationTokenRecord.from_row({
+            "id": 1,
+            "user_id": 2,
+            "origin": "spotify",
+            "access_token": "access_token",
+            "refresh_token": "refresh_token",
+            "invalid_token": False,
+            "expires_at": expires_at,
+        })
+
+        assert record.origin is Origin.Spotify
+        assert record.user_id == 2
+        assert record.expires_at == expires_at
+        assert not hasattr(record, "__dict__")
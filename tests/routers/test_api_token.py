@@ -0,0 +1,21 @@
+import pytest
+
+from app.identity.jwt import Jwt
+from app.routers.api_token import create_api_token
+from app.services.authorization import Authorization
+
+
+class TestApiTokenRoute:
+    @pytest.mark.asyncio
+    async def test_create_api_token(self, mocker):
+        request = mocker.Mock()
+        authorization = mocker.Mock(spec=Authorization)
+        authorization.rotate_api_token.return_value = "api_token"
+        request.app.state.token_manager = authorization
+
+        response = await create_api_token(request, Jwt.construct_jwt(1, "test_user", 3600))
+
+        assert response.status_code == 201
+        assert response.body == b'{"token":"api_token"}'
+        assert response.headers["cache-control"] == "no-store"
+        authorization.rotate_api_token.assert_awaited_once_with(1)
@@ -0,0 +1,324 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import httpx
+import pytest
+
+from app.clients.spotify import AvailableDevicePayload, QueuePayload, SpotifyClient
+from app.exception_handlers import no_active_device_handler, token_refresh_pending_handler
+from app.exceptions import NoActiveDeviceException, TokenRefreshPendingException
+from app.models.spotify import CurrentlyPlaying, Device, Track
+from app.routers import spotify_router
+from app.services.authorization import AuthenticatedApiToken, Authorization
+from app.services.invalidation import InvalidationBus, InvalidationKind
+from app.services.now_playing import NowPlaying
+from app.services.now_playing_stream import NowPlayingStream
+from app.services.scheduler import PollScheduler
+
+
+NO_ACTIVE_DEVICE = {"error": {"status": 404, "message": "Player command failed: No active device found", "reason": "NO_ACTIVE_DEVICE"}}
+
+
+def application(mocker, spotify_client, access_token: str | None = "access_token") -> FastAPI:
+    app = FastAPI()
+    app.include_router(spotify_router)
+    app.add_exception_handler(NoActiveDeviceException, no_active_device_handler)
+    app.add_exception_handler(TokenRefreshPendingException, token_refresh_pending_handler)
+
+    authorization = mocker.Mock(spec=Authorization)
+    authorization.authenticate_api_token.return_value = AuthenticatedApiToken(user_id=1)
+    authorization.get_access_token.return_value = access_token
+
+    app.state.token_manager = authorization
+    app.state.spotify_client = spotify_client
+    app.state.now_playing = NowPlaying(max_ttl=30)
+    app.state.poll_scheduler = PollScheduler(
+        min_interval=2,
+        max_interval=30,
+        max_backoff=60,
+        idle_timeout=300,
+        max_concurrency=1,
+    )
+    app.state.now_playing_stream = NowPlayingStream(
+        authorization,
+        spotify_client,
+        app.state.now_playing,
+        app.state.poll_scheduler,
+        queue_size=8,
+    )
+    app.state.invalidation = mocker.Mock(spec=InvalidationBus)
+
+    return app
+
+
+class TestPlayerRoutes:
+    def test_spotify_not_connected(self, mocker, mock_spotify_client):
+        client = mock_spotify_client(lambda request: httpx.Response(204))
+        app = application(mocker, client, access_token=None)
+
+        response = TestClient(app).post("/spotify/pause-song", params={"token": "api_token"})
+
+        assert response.status_code == 403
+
+    def test_token_refresh_pending(self, mocker, mock_spotify_client):
+        client = mock_spotify_client(lambda request: httpx.Response(204))
+        app = application(mocker, client)
+        app.state.token_manager.get_access_token.side_effect = TokenRefreshPendingException()
+
+        response = TestClient(app).post("/spotify/pause-song", params={"token": "api_token"})
+
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "1"
+
+    def test_no_active_device(self, mocker, mock_spotify_client):
+        client = mock_spotify_client(lambda request: httpx.Response(404, json=NO_ACTIVE_DEVICE))
+        app = application(mocker, client)
+
+        response = TestClient(app).post("/spotify/pause-song", params={"token": "api_token"})
+
+        assert response.status_code == 200
+        assert response.json() == {"message": "No active device found"}
+
+    def test_player_change_invalidates_now_playing(self, mocker, mock_spotify_client, spotify_track):
+        client = mock_spotify_client(lambda request: httpx.Response(204))
+        app = application(mocker, client)
+        app.state.now_playing.update(1, CurrentlyPlaying(
+            currently_playing_type="track",
+            is_playing=True,
+            item=Track.model_validate(spotify_track),
+            progress_ms=1000,
+        ))
+
+        response = TestClient(app).post("/spotify/skip-song", params={"token": "api_token"})
+
+        assert response.status_code == 204
+        assert app.state.now_playing.get(1) is None
+
+        # Other workers drop their snapshot too
+        app.state.invalidation.publish.assert_awaited_once_with(InvalidationKind.NowPlaying, 1)
+
+    def test_player_change_schedules_poll(self, mocker, mock_spotify_client):
+        client = mock_spotify_client(lambda request: httpx.Response(204))
+        app = application(mocker, client)
+        app.state.now_playing_stream.subscribers[1] = {mocker.Mock()}
+
+        response = TestClient(app).post("/spotify/skip-song", params={"token": "api_token"})
+
+        assert response.status_code == 204
+        assert 1 in app.state.poll_scheduler.scheduled
+
+    def test_player_change_without_subscribers(self, mocker, mock_spotify_client):
+        client = mock_spotify_client(lambda request: httpx.Response(204))
+        app = application(mocker, client)
+
+        response = TestClient(app).post("/spotify/skip-song", params={"token": "api_token"})
+
+        assert response.status_code == 204
+        assert 1 not in app.state.poll_scheduler.scheduled
+
+    def test_enqueue_song_by_url(self, mocker, mock_spotify_client, spotify_track):
+        requests = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+
+            if request.url.path == "/v1/tracks/4uLU6hMCjMI75M1A2tKUQC":
+                return httpx.Response(200, json=spotify_track)
+
+            return httpx.Response(204)
+
+        app = application(mocker, mock_spotify_client(handler))
+
+        response = TestClient(app).post(
+            "/spotify/enqueue-song",
+            params={"token": "api_token", "song": "https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC"},
+        )
+
+        assert response.status_code == 200
+        assert response.json()["song_title"] == "Never Gonna Give You Up"
+        assert [request.url.path for request in requests] == ["/v1/tracks/4uLU6hMCjMI75M1A2tKUQC", "/v1/me/player/queue"]
+        assert requests[1].url.params["uri"] == "spotify:track:4uLU6hMCjMI75M1A2tKUQC"
+
+    @pytest.mark.parametrize("status_code", [400, 404])
+    def test_enqueue_unknown_track(self, mocker, status_code, mock_spotify_client):
+        requests = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+
+            if request.url.path.startswith("/v1/tracks/"):
+                return httpx.Response(status_code, json={"error": {"status": status_code, "message": "invalid id"}})
+
+            return httpx.Response(204)
+
+        app = application(mocker, mock_spotify_client(handler))
+
+        response = TestClient(app).post(
+            "/spotify/enqueue-song",
+            params={"token": "api_token", "song": "https://open.spotify.com/track/not-a-track"},
+        )
+
+        # Nothing was queued
+        assert response.status_code == 404
+        assert [request.url.path for request in requests] == ["/v1/tracks/not-a-track"]
+
+    def test_enqueue_no_active_device(self, mocker, mock_spotify_client, spotify_track):
+        def handler(request: httpx.Request) -> httpx.Response:
+            if request.url.path == "/v1/me/player/queue":
+                return httpx.Response(404, json=NO_ACTIVE_DEVICE)
+
+            return httpx.Response(200, json={"tracks": {"items": [spotify_track]}})
+
+        app = application(mocker, mock_spotify_client(handler))
+
+        response = TestClient(app).post(
+            "/spotify/enqueue-song",
+            params={"token": "api_token", "song": "never gonna give you up"},
+        )
+
+        assert response.status_code == 200
+        assert response.json() == {"message": "No active device found"}
+
+
+DEVICE = {
+    "id": "device_id",
+    "is_active": True,
+    "is_private_session": False,
+    "is_restricted": False,
+    "name": "Speaker",
+    "type": "Computer",
+    "volume_percent": 50,
+    "supports_volume": True,
+}
+
+
+def player_spotify_client(mocker, track: dict, playing: bool = True):
+    client = mocker.Mock(spec=SpotifyClient)
+    tracks = [Track.model_validate({**track, "name": f"Song {i}"}) for i in range(5)]
+
+    client.get_current_song.return_value = CurrentlyPlaying(
+        currently_playing_type="track",
+        is_playing=True,
+        item=Track.model_validate(track),
+        progress_ms=1000,
+    ) if playing else None
+    client.get_next_songs.return_value = QueuePayload(queue=tracks)
+    client.get_available_devices.return_value = AvailableDevicePayload(devices=[Device.model_validate(DEVICE)])
+
+    return client
+
+
+class TestPlayerState:
+    def get(self, app: FastAPI, **params) -> httpx.Response:
+        return TestClient(app).get("/spotify/player-state", params={"token": "api_token", **params})
+
+    def test_all_fields(self, mocker, spotify_track):
+        client = player_spotify_client(mocker, spotify_track)
+        app = application(mocker, client)
+
+        response = self.get(app)
+
+        assert response.status_code == 200
+        assert response.json() == {
+            "current": {
+                "album_title": "Whenever You Need Somebody",
+                "song_title": "Never Gonna Give You Up",
+                "artists": "Rick Astley",
+            },
+            "is_playing": True,
+            "queue": [
+                {"album_title": "Whenever You Need Somebody", "song_title": f"Song {i}", "artists": "Rick Astley"}
+                for i in range(3)
+            ],
+            "device": DEVICE,
+        }
+
+        # The snapshot is shared with /current-song
+        assert app.state.now_playing.get(1).song_title == "Never Gonna Give You Up"
+
+    @pytest.mark.parametrize(
+        ("fields", "keys", "calls"),
+        [
+            ("current", {"current", "is_playing"}, {"get_current_song"}),
+            ("queue", {"queue"}, {"get_next_songs"}),
+            ("device", {"device"}, {"get_available_devices"}),
+            ("current, device", {"current", "is_playing", "device"}, {"get_current_song", "get_available_devices"}),
+            ("queue,device", {"queue", "device"}, {"get_next_songs", "get_available_devices"}),
+        ],
+    )
+    def test_fields(self, mocker, fields, keys, calls, spotify_track):
+        client = player_spotify_client(mocker, spotify_track)
+
+        response = self.get(application(mocker, client), fields=fields)
+
+        # Unselected fields are left out, not null
+        assert response.status_code == 200
+        assert set(response.json()) == keys
+
+        called = {
+            name
+            for name in ("get_current_song", "get_next_songs", "get_available_devices")
+            if getattr(client, name).called
+        }
+        assert called == calls
+
+    @pytest.mark.parametrize("fields", ["", "current,volume", ","])
+    def test_invalid_fields(self, mocker, fields, spotify_track):
+        response = self.get(application(mocker, player_spotify_client(mocker, spotify_track)), fields=fields)
+
+        assert response.status_code == 400
+
+    @pytest.mark.parametrize(("limit", "length"), [(0, 0), (1, 1), (20, 5)])
+    def test_limit(self, mocker, limit, length, spotify_track):
+        response = self.get(application(mocker, player_spotify_client(mocker, spotify_track)), fields="queue", limit=limit)
+
+        assert response.status_code == 200
+        assert len(response.json()["queue"]) == length
+
+    def test_limit_out_of_range(self, mocker, spotify_track):
+        response = self.get(application(mocker, player_spotify_client(mocker, spotify_track)), limit=21)
+
+        assert response.status_code == 422
+
+    def test_nothing_playing(self, mocker, spotify_track):
+        client = player_spotify_client(mocker, spotify_track, playing=False)
+        client.get_next_songs.side_effect = NoActiveDeviceException()
+        client.get_available_devices.return_value = AvailableDevicePayload(devices=[])
+
+        response = self.get(application(mocker, client))
+
+        assert response.status_code == 200
+        assert response.json() == {
+            "current": None,
+            "is_playing": False,
+            "queue": [],
+            "device": None,
+        }
+
+    def test_fetches_concurrently(self, mocker, spotify_track):
+        client = player_spotify_client(mocker, spotify_track)
+        running = 0
+        peak = 0
+
+        def track_concurrency(result):
+            async def fetch(*args, **kwargs):
+                nonlocal running, peak
+                running += 1
+                peak = max(peak, running)
+
+                await asyncio.sleep(0.02)
+
+                running -= 1
+                return result
+
+            return fetch
+
+        for name in ("get_current_song", "get_next_songs", "get_available_devices"):
+            method = getattr(client, name)
+            method.side_effect = track_concurrency(method.return_value)
+
+        response = self.get(application(mocker, client))
+
+        assert response.status_code == 200
+        assert peak == 3
@@ -1,13 +1,16 @@
+import asyncio
 import freezegun
 import httpx
 import pendulum
 import pytest
+from app.exceptions import TokenRefreshPendingException
 from app.models.encrypted import Encrypted
 
-from app.services.authorization import Authorization
+from app.services.authorization import REDUCED_EXPIRATION, AccessTokenCache, ApiTokenCache, AuthenticatedApiToken, Authorization, hash_api_token
 from app.clients.twitch import TwitchClient
 from app.configuration import Configuration
 from app.models.oauth_token import OAuthToken
+from app.models.sql.api_token import ApiToken
 from app.models.sql.authorization_token import AuthorizationToken, Origin
 from app.models.sql.user import User
 
@@ -93,6 +96,33 @@ class TestAuthorization:
         assert refresh_token == "new_refresh_token"
         assert db_token.expires_at == now.add(seconds=360)
 
+    @pytest.mark.asyncio(scope="session")
+    async def test_upsert_access_token_concurrent(self, setup_user):
+        configuration = Configuration()
+        access_token_manager = Authorization(configuration)
+        encrypted = Encrypted(configuration.aes_encryption_key)
+        setup_user: User = setup_user
+
+        def oauth_token(index: int) -> OAuthToken:
+            return OAuthToken(
+                access_token=f"access_token_{index}",
+                expires_in=360,
+                refresh_token=f"refresh_token_{index}",
+                scope=[],
+                token_type="bearer",
+            )
+
+        results = await asyncio.gather(*(
+            access_token_manager.upsert_access_token(Origin.Twitch, setup_user.id, oauth_token(index))
+            for index in range(10)
+        ))
+
+        tokens = await AuthorizationToken.filter(user_id=setup_user.id, origin=Origin.Twitch)
+
+        assert len(tokens) == 1
+        assert {result.id for result in results} == {tokens[0].id}
+        assert encrypted.decrypt(tokens[0].access_token) in {f"access_token_{index}" for index in range(10)}
+
     @freezegun.freeze_time("2021-01-01T00:00:00Z")
     @pytest.mark.asyncio(scope="session")
     async def test_get_access_token(self, setup_user):
@@ -223,5 +253,436 @@ class TestAuthorization:
 
         assert db_token.invalid_token
 
+    @freezegun.freeze_time("2021-01-01T00:00:00Z")
+    @pytest.mark.asyncio(scope="session")
+    async def test_refresh_access_token_ahead_of_expiry(self, setup_user, mocker):
+        configuration = Configuration()
+        access_token_manager = Authorization(configuration)
+        encrypted = Encrypted(configuration.aes_encryption_key)
+        setup_user: User = setup_user
+
+        now = pendulum.now()
+
+        mocked_client = mocker.patch.object(
+            TwitchClient,
+            'refresh_token',
+            return_value=OAuthToken(
+                access_token="new_access_token",
+                expires_in=3600,
+                scope=[],
+                token_type="bearer",
+            )
+        )
+
+        # Still valid, but inside the refresh window
+        existing_token = await AuthorizationToken.create(
+            user_id=setup_user.id,
+            origin=Origin.Twitch,
+            access_token=encrypted.encrypt("access_token"),
+            refresh_token=encrypted.encrypt("refresh_token"),
+            expires_at=now + pendulum.duration(seconds=300),
+        )
+
+        token = await access_token_manager.refresh_access_token(
+            Origin.Twitch,
+            setup_user.id,
+            refresh_before=600,
+        )
+
+        assert token == "new_access_token"
+        mocked_client.assert_awaited_once_with("refresh_token")
+        assert access_token_manager.access_tokens.get(Origin.Twitch, setup_user.id) == "new_access_token"
+
+        db_token = await AuthorizationToken.get(id=existing_token.id)
+
+        assert encrypted.decrypt(db_token.access_token) == "new_access_token"
+        assert encrypted.decrypt(db_token.refresh_token) == "refresh_token"
+        assert db_token.expires_at == now + pendulum.duration(seconds=3600)
+        assert db_token.refresh_lease_until is None
+
+    @freezegun.freeze_time("2021-01-01T00:00:00Z")
+    @pytest.mark.asyncio(scope="session")
+    async def test_warm_access_tokens_by_activity(self, setup_user, mocker):
+        configuration = Configuration()
+        access_token_manager = Authorization(configuration)
+        encrypted = Encrypted(configuration.aes_encryption_key)
+        setup_user: User = setup_user
+
+        now = pendulum.now()
+        active_since = now.subtract(days=7)
+
+        mocker.patch.object(
+            TwitchClient,
+            'refresh_token',
+            return_value=OAuthToken(
+                access_token="new_access_token",
+                expires_in=3600,
+                scope=[],
+                token_type="bearer",
+            )
+        )
+
+        await AuthorizationToken.create(
+            user_id=setup_user.id,
+            origin=Origin.Twitch,
+            access_token=encrypted.encrypt("access_token"),
+            refresh_token=encrypted.encrypt("refresh_token"),
+            expires_at=now + pendulum.duration(seconds=300),
+        )
+
+        # Refreshed in the background, as TokenRefresher does, without the
+        # user doing anything
+        await access_token_manager.refresh_access_token(Origin.Twitch, setup_user.id, refresh_before=600)
+        access_token_manager.access_tokens.clear()
+
+        await access_token_manager.warm_access_tokens(active_since, batch_size=100)
+        assert access_token_manager.access_tokens.get(Origin.Twitch, setup_user.id) is None
+
+        # An overlay request: no dashboard sign-in, just the API token
+        api_token = await access_token_manager.generate_api_token(setup_user.id)
+        await access_token_manager.authenticate_api_token(api_token)
+        access_token_manager.access_tokens.clear()
+
+        await access_token_manager.warm_access_tokens(active_since, batch_size=100)
+        assert access_token_manager.access_tokens.get(Origin.Twitch, setup_user.id) == "new_access_token"
+
+    @freezegun.freeze_time("2021-01-01T00:00:00Z")
+    @pytest.mark.asyncio(scope="session")
+    async def test_refresh_access_token_leased(self, setup_user, mocker):
+        configuration = Configuration()
+        access_token_manager = Authorization(configuration)
+        encrypted = Encrypted(configuration.aes_encryption_key)
+        setup_user: User = setup_user
+
+        now = pendulum.now()
+        mocked_client = mocker.patch.object(TwitchClient, 'refresh_token')
+
+        # Another worker is refreshing, but the current token hasn't expired
+        await AuthorizationToken.create(
+            user_id=setup_user.id,
+            origin=Origin.Twitch,
+            access_token=encrypted.encrypt("access_token"),
+            refresh_token=encrypted.encrypt("refresh_token"),
+            expires_at=now + pendulum.duration(seconds=30),
+            refresh_lease_until=now + pendulum.duration(seconds=10),
+        )
+
+        token = await access_token_manager.get_access_token(Origin.Twitch, setup_user.id)
+
+        assert token == "access_token"
+        assert not mocked_client.called
+
+    @pytest.mark.asyncio(scope="session")
+    async def test_refresh_access_token_expired_lease(self, setup_user, mocker):
+        configuration = Configuration()
+        access_token_manager = Authorization(configuration)
+        encrypted = Encrypted(configuration.aes_encryption_key)
+        setup_user: User = setup_user
+
+        now = pendulum.now()
+
+        mocked_client = mocker.patch.object(
+            TwitchClient,
+            'refresh_token',
+            return_value=OAuthToken(
+                access_token="new_access_token",
+                expires_in=3600,
+                scope=[],
+                token_type="bearer",
+            )
+        )
+
+        # The worker holding the lease went away
+        existing_token = await AuthorizationToken.create(
+            user_id=setup_user.id,
+            origin=Origin.Twitch,
+            access_token=encrypted.encrypt("access_token"),
+            refresh_token=encrypted.encrypt("refresh_token"),
+            expires_at=now - pendulum.duration(seconds=30),
+            refresh_lease_until=now - pendulum.duration(seconds=1),
+        )
+
+        token = await access_token_manager.get_access_token(Origin.Twitch, setup_user.id)
+
+        assert token == "new_access_token"
+        assert mocked_client.called
+
+        db_token = await AuthorizationToken.filter(id=existing_token.id).first()
+
+        assert encrypted.decrypt(db_token.access_token) == "new_access_token"
+        assert db_token.refresh_lease_until is None
+
+    @pytest.mark.asyncio(scope="session")
+    async def test_refresh_access_token_provider_timeout(self, setup_user, mocker):
+        configuration = Configuration()
+        access_token_manager = Authorization(configuration)
+        encrypted = Encrypted(configuration.aes_encryption_key)
+        setup_user: User = setup_user
+
+        mocker.patch.object(
+            TwitchClient,
+            'refresh_token',
+            side_effect=httpx.ReadTimeout("timed out"),
+        )
+
+        existing_token = await AuthorizationToken.create(
+            user_id=setup_user.id,
+            origin=Origin.Twitch,
+            access_token=encrypted.encrypt("access_token"),
+            refresh_token=encrypted.encrypt("refresh_token"),
+            expires_at=pendulum.now() - pendulum.duration(seconds=30),
+        )
+
+        with pytest.raises(TokenRefreshPendingException):
+            await access_token_manager.get_access_token(Origin.Twitch, setup_user.id)
+
+        # Released for the retry, and the token is left as it was
+        db_token = await AuthorizationToken.get(id=existing_token.id)
+
+        assert db_token.refresh_lease_until is None
+        assert not db_token.invalid_token
+        assert encrypted.decrypt(db_token.access_token) == "access_token"
+
+    @pytest.mark.asyncio(scope="session")
+    async def test_refresh_access_token_waits_for_lease(self, setup_user, mocker):
+        configuration = Configuration(token_refresh_wait=0.2)
+        access_token_manager = Authorization(configuration)
+        encrypted = Encrypted(configuration.aes_encryption_key)
+        setup_user: User = setup_user
+
+        now = pendulum.now()
+        mocked_client = mocker.patch.object(TwitchClient, 'refresh_token')
+
+        # Expired, and another worker is refreshing it but never finishes
+        await AuthorizationToken.create(
+            user_id=setup_user.id,
+            origin=Origin.Twitch,
+            access_token=encrypted.encrypt("access_token"),
+            refresh_token=encrypted.encrypt("refresh_token"),
+            expires_at=now - pendulum.duration(seconds=30),
+            refresh_lease_until=now + pendulum.duration(seconds=10),
+        )
+
+        # Retryable, rather than looking like a missing connection
+        with pytest.raises(TokenRefreshPendingException):
+            await access_token_manager.get_access_token(Origin.Twitch, setup_user.id)
+
+        assert not mocked_client.called
+
+    @pytest.mark.asyncio(scope="session")
+    async def test_refresh_access_token_lease_lost(self, setup_user, mocker):
+        configuration = Configuration()
+        access_token_manager = Authorization(configuration)
+        encrypted = Encrypted(configuration.aes_encryption_key)
+        setup_user: User = setup_user
+
+        now = pendulum.now()
+        other_lease = now.add(seconds=60)
+
+        existing_token = await AuthorizationToken.create(
+            user_id=setup_user.id,
+            origin=Origin.Twitch,
+            access_token=encrypted.encrypt("access_token"),
+            refresh_token=encrypted.encrypt("refresh_token"),
+            expires_at=now - pendulum.duration(seconds=30),
+        )
+
+        async def refresh_token(refresh_token):
+            # The provider was slow; our lease ran out and another worker took it
+            await AuthorizationToken.filter(id=existing_token.id).update(refresh_lease_until=other_lease)
+
+            return OAuthToken(
+                access_token="new_access_token",
+                refresh_token="rotated_refresh_token",
+                expires_in=3600,
+                scope=[],
+                token_type="bearer",
+            )
+
+        mocker.patch.object(TwitchClient, 'refresh_token', side_effect=refresh_token)
+
+        token = await access_token_manager.get_access_token(Origin.Twitch, setup_user.id)
+
+        assert token == "new_access_token"
+
+        # The rotated refresh token is kept, and the other worker's lease left alone
+        db_token = await AuthorizationToken.get(id=existing_token.id)
+
+        assert encrypted.decrypt(db_token.refresh_token) == "rotated_refresh_token"
+        assert encrypted.decrypt(db_token.access_token) == "new_access_token"
+        assert db_token.refresh_lease_until == other_lease
+
+    @freezegun.freeze_time("2021-01-01T00:00:00Z")
+    @pytest.mark.asyncio(scope="session")
+    async def test_get_access_token_cached(self, setup_user, mocker):
+        configuration = Configuration()
+        access_token_manager = Authorization(configuration)
+        encrypted = Encrypted(configuration.aes_encryption_key)
+        setup_user: User = setup_user
+
+        now = pendulum.now()
+
+        await AuthorizationToken.create(
+            user_id=setup_user.id,
+            origin=Origin.Twitch,
+            access_token=encrypted.encrypt("access_token"),
+            refresh_token=encrypted.encrypt("refresh_token"),
+            expires_at=now + pendulum.duration(seconds=360),
+        )
+
+        token = await access_token_manager.get_access_token(Origin.Twitch, setup_user.id)
+        assert token == "access_token"
+
+        # The second lookup is served without touching the database
+        mocked_get = mocker.patch.object(access_token_manager.repository, "get_authorization_token")
+
+        token = await access_token_manager.get_access_token(Origin.Twitch, setup_user.id)
+
+        assert token == "access_token"
+        assert not mocked_get.called
+
+    @freezegun.freeze_time("2021-01-01T00:00:00Z")
+    @pytest.mark.asyncio(scope="session")
+    async def test_upsert_access_token_replaces_cached_token(self, setup_user):
+        configuration = Configuration()
+        access_token_manager = Authorization(configuration)
+        setup_user: User = setup_user
+
+        access_token_manager.access_tokens.set(
+            Origin.Twitch,
+            setup_user.id,
+            "old_access_token",
+            pendulum.now().add(seconds=360),
+        )
+
+        await access_token_manager.upsert_access_token(
+            Origin.Twitch,
+            setup_user.id,
+            OAuthToken(
+                access_token="new_access_token",
+                expires_in=360,
+                refresh_token="new_refresh_token",
+                scope=[],
+                token_type="bearer",
+            ),
+        )
+
+        token = await access_token_manager.get_access_token(Origin.Twitch, setup_user.id)
+        assert token == "new_access_token"
+
+
+    @pytest.mark.asyncio(scope="session")
+    async def test_authenticate_api_token(self, setup_user, mocker):
+        configuration = Configuration()
+        access_token_manager = Authorization(configuration)
+        setup_user: User = setup_user
+
+        token = await access_token_manager.generate_api_token(setup_user.id)
+        find_api_token = mocker.spy(access_token_manager, "find_api_token")
+
+        # Only the digest is stored
+        db_token = await ApiToken.filter(user_id=setup_user.id).first()
+        assert db_token.token_hash == hash_api_token(token)
+
+        assert await access_token_manager.authenticate_api_token(token) == AuthenticatedApiToken(setup_user.id)
+        assert await access_token_manager.authenticate_api_token(token) == AuthenticatedApiToken(setup_user.id)
+        assert find_api_token.call_count == 1
+
+        # Use is recorded for the access token warmup
+        db_token = await ApiToken.get(id=db_token.id)
+        assert db_token.last_used_at is not None
+
+        # Revocation takes effect straight away
+        await access_token_manager.invalidate_api_token(setup_user.id, token)
+
+        assert await access_token_manager.authenticate_api_token(token) is None
+        assert await access_token_manager.authenticate_api_token(token) is None
+        assert find_api_token.call_count == 2
+
+    @pytest.mark.asyncio(scope="session")
+    async def test_rotate_api_token(self, setup_user):
+        configuration = Configuration()
+        access_token_manager = Authorization(configuration)
+        setup_user: User = setup_user
+
+        old_token = await access_token_manager.generate_api_token(setup_user.id)
+        assert await access_token_manager.authenticate_api_token(old_token)
+
+        new_token = await access_token_manager.rotate_api_token(setup_user.id)
+
+        assert new_token != old_token
+        assert await access_token_manager.authenticate_api_token(old_token) is None
+        assert await access_token_manager.authenticate_api_token(new_token) == AuthenticatedApiToken(setup_user.id)
+        assert await ApiToken.filter(user_id=setup_user.id, invalidated_at__isnull=True).count() == 1
+
+
+    @pytest.mark.asyncio(scope="session")
+    async def test_authenticate_api_token_prefetches_access_token(self, setup_user, mocker):
+        configuration = Configuration()
+        access_token_manager = Authorization(configuration)
+        encrypted = Encrypted(configuration.aes_encryption_key)
+        setup_user: User = setup_user
+
+        await AuthorizationToken.create(
+            user_id=setup_user.id,
+            origin=Origin.Spotify,
+            access_token=encrypted.encrypt("access_token"),
+            refresh_token=encrypted.encrypt("refresh_token"),
+            expires_at=pendulum.now() + pendulum.duration(seconds=360),
+        )
+
+        token = await access_token_manager.generate_api_token(setup_user.id)
+        api_token = await access_token_manager.authenticate_api_token(token, Origin.Spotify)
+
+        assert api_token == AuthenticatedApiToken(setup_user.id)
+
+        # The access token came back with the API token
+        mocked_get = mocker.patch.object(access_token_manager.repository, "get_authorization_token")
+
+        assert await access_token_manager.get_access_token(Origin.Spotify, setup_user.id) == "access_token"
+        assert not mocked_get.called
+
+
+class TestAccessTokenCache:
+    @freezegun.freeze_time("2021-01-01T00:00:00Z")
+    def test_expires_early(self):
+        cache = AccessTokenCache()
+
+        cache.set(Origin.Spotify, 1, "access_token", pendulum.now().add(seconds=REDUCED_EXPIRATION + 10))
+        assert cache.get(Origin.Spotify, 1) == "access_token"
+
+        with freezegun.freeze_time("2021-01-01T00:00:11Z"):
+            assert cache.get(Origin.Spotify, 1) is None
+
+    def test_invalidate(self):
+        cache = AccessTokenCache()
+        cache.set(Origin.Spotify, 1, "access_token", pendulum.now().add(hours=1))
+
+        cache.invalidate(Origin.Spotify, 1)
+
+        assert cache.get(Origin.Spotify, 1) is None
+        assert cache.get(Origin.Twitch, 2) is None
+
+
+class TestApiTokenCache:
+    def test_negative_cache_expires(self):
+        now = 0.0
+        cache = ApiTokenCache(maxsize=10, ttl=60, negative_ttl=5, timer=lambda: now)
+
+        cache.set(b"unknown", None)
+        assert cache.is_unknown(b"unknown")
+
+        now = 6.0
+        assert not cache.is_unknown(b"unknown")
+
+    def test_invalidate_user(self):
+        cache = ApiTokenCache(maxsize=10, ttl=60, negative_ttl=5)
+        cache.set(b"first", AuthenticatedApiToken(1))
+        cache.set(b"second", AuthenticatedApiToken(1))
+        cache.set(b"third", AuthenticatedApiToken(2))
 
+        cache.invalidate_user(1)
 
+        assert cache.get(b"first") is None
+        assert cache.get(b"second") is None
+        assert cache.get(b"third") == AuthenticatedApiToken(2)
@@ -1,3 +1,5 @@
+import asyncio
+
 import freezegun
 import pendulum
 import pytest
@@ -6,7 +8,7 @@ from app.identity.jwt import AccessToken, Jwt
 from app.models.encrypted import Encrypted
 from app.models.sql.refresh_token import RefreshToken
 
-from app.services.identity import Identity
+from app.services.identity import Identity, RotatedRefreshTokens
 
 
 class TestIdentity:
@@ -74,3 +76,107 @@ class TestIdentity:
         tokens: AccessToken | None = await identity.refresh_token("old_token")
 
         assert tokens is None
+
+    @pytest.mark.asyncio
+    async def test_refresh_token_unknown(self, setup_user):
+        identity = Identity(Configuration())
+
+        assert await identity.refresh_token("unknown_token") is None
+
+    @pytest.mark.asyncio
+    async def test_refresh_token_concurrently(self, setup_user):
+        configuration = Configuration()
+        identity = Identity(configuration)
+
+        await RefreshToken.create(
+            user_id=setup_user.id,
+            refresh_token="old_token",
+            refresh_token_hash=Encrypted.hash("old_token"),
+        )
+
+        results = await asyncio.gather(*(identity.refresh_token("old_token") for _ in range(5)))
+
+        assert all(tokens == results[0] for tokens in results)
+        assert await RefreshToken.filter(user_id=setup_user.id, invalidated_at__isnull=True).count() == 1
+
+        # a late duplicate gets the same successor
+        assert await identity.refresh_token("old_token") == results[0]
+
+    @pytest.mark.asyncio
+    async def test_refresh_token_rotated_elsewhere(self, setup_user):
+        configuration = Configuration()
+        identity = Identity(configuration)
+        other_identity = Identity(configuration)
+
+        await RefreshToken.create(
+            user_id=setup_user.id,
+            refresh_token="old_token",
+            refresh_token_hash=Encrypted.hash("old_token"),
+        )
+
+        assert await other_identity.refresh_token("old_token")
+
+        # outside the other worker's grace window
+        assert await identity.refresh_token("old_token") is None
+        assert await RefreshToken.filter(user_id=setup_user.id, invalidated_at__isnull=True).count() == 1
+
+    @pytest.mark.asyncio
+    async def test_refresh_token_single_flight(self, mocker):
+        identity = Identity(Configuration())
+        tokens = AccessToken(
+            access_token="access_token",
+            refresh_token="new_token",
+            expires_in=3600,
+            scope=[],
+            token_type="bearer",
+        )
+
+        async def rotate_refresh_token(refresh_token_hash):
+            await asyncio.sleep(0.01)
+            return tokens
+
+        rotate = mocker.patch.object(identity, "rotate_refresh_token", side_effect=rotate_refresh_token)
+
+        results = await asyncio.gather(*(identity.refresh_token("old_token") for _ in range(5)))
+
+        assert results == [tokens] * 5
+        rotate.assert_called_once_with(Encrypted.hash("old_token"))
+
+
+class TestRotatedRefreshTokens:
+    def test_grace_period(self):
+        now = 0.0
+        rotated = RotatedRefreshTokens(grace_period=10, timer=lambda: now)
+        tokens = AccessToken(
+            access_token="access_token",
+            refresh_token="new_token",
+            expires_in=3600,
+            scope=[],
+            token_type="bearer",
+        )
+
+        rotated.set("old_token_hash", 1, tokens)
+
+        assert rotated.get("old_token_hash") == tokens
+        assert rotated.get("other_token_hash") is None
+
+        now = 10.0
+        assert rotated.get("old_token_hash") is None
+
+    def test_invalidate_user(self):
+        rotated = RotatedRefreshTokens(grace_period=10)
+        tokens = AccessToken(
+            access_token="access_token",
+            refresh_token="new_token",
+            expires_in=3600,
+            scope=[],
+            token_type="bearer",
+        )
+
+        rotated.set("first_hash", 1, tokens)
+        rotated.set("second_hash", 2, tokens)
+        rotated.invalidate_user(1)
+
+        assert rotated.get("first_hash") is None
+        assert rotated.get("second_hash") == tokens
+        assert rotated.stats.size == 1
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from app.cache import CacheRegistry
+from app.services.invalidation import CHANNEL, Invalidation, InvalidationBus, InvalidationKind
+
+
+class FakeConnection:
+    def __init__(self) -> None:
+        self.listeners = {}
+        self.termination_listeners = []
+        self.closed = False
+
+    def add_termination_listener(self, callback) -> None:
+        self.termination_listeners.append(callback)
+
+    async def add_listener(self, channel, callback) -> None:
+        self.listeners[channel] = callback
+
+    async def remove_listener(self, channel, callback) -> None:
+        self.listeners.pop(channel, None)
+
+    async def execute(self, query: str) -> None:
+        pass
+
+    def is_closed(self) -> bool:
+        return self.closed
+
+    def notify(self, payload: str) -> None:
+        self.listeners[CHANNEL](self, 1, CHANNEL, payload)
+
+    def terminate(self) -> None:
+        self.closed = True
+
+        for callback in self.termination_listeners:
+            callback(self)
+
+
+class TestInvalidation:
+    def test_round_trip(self):
+        invalidation = Invalidation(InvalidationKind.AccessToken, ["spotify", 1], "abcd")
+        payload = invalidation.encode()
+
+        assert payload == '{"k":"access_token","v":["spotify",1],"s":"abcd"}'
+        assert Invalidation.decode(payload) == invalidation
+
+
+class TestInvalidationBus:
+    def test_dispatch(self, mocker):
+        bus = InvalidationBus(CacheRegistry())
+        handler = mocker.Mock()
+        bus.subscribe(InvalidationKind.AccessToken, handler)
+
+        bus.dispatch(Invalidation(InvalidationKind.AccessToken, ["spotify", 1], "other"))
+        bus.dispatch(Invalidation(InvalidationKind.ApiToken, [1], "other"))
+
+        handler.assert_called_once_with(["spotify", 1])
+
+    def test_dispatch_ignores_own_messages(self, mocker):
+        bus = InvalidationBus(CacheRegistry())
+        handler = mocker.Mock()
+        bus.subscribe(InvalidationKind.AccessToken, handler)
+
+        bus.dispatch(Invalidation(InvalidationKind.AccessToken, ["spotify", 1], bus.sender))
+
+        assert not handler.called
+
+    @pytest.mark.asyncio
+    async def test_listen(self, mocker):
+        caches = CacheRegistry()
+        cache = mocker.Mock()
+        caches.register("cache", cache)
+
+        bus = InvalidationBus(caches)
+        handler = mocker.Mock()
+        bus.subscribe(InvalidationKind.NowPlaying, handler)
+
+        connection = FakeConnection()
+        listener = asyncio.create_task(bus.listen(connection))
+        await asyncio.wait_for(bus.listening.wait(), 1)
+
+        # nothing to flush on the first connection
+        assert not cache.clear.called
+
+        connection.notify('{"k":"now_playing","v":[1],"s":"other"}')
+        connection.notify("not json")
+        handler.assert_called_once_with([1])
+
+        connection.terminate()
+        await asyncio.wait_for(listener, 1)
+
+        # a reconnect flushes whatever may have been missed
+        connection = FakeConnection()
+        listener = asyncio.create_task(bus.listen(connection))
+        await asyncio.wait_for(bus.listening.wait(), 1)
+
+        assert cache.clear.call_count == 1
+
+        connection.terminate()
+        await asyncio.wait_for(listener, 1)
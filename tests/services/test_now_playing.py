@@ -0,0 +1,62 @@
+from app.models.spotify import Album, Artist, CurrentlyPlaying, Track
+from app.services.now_playing import NowPlaying
+
+
+class FakeTimer:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def currently_playing(is_playing: bool = True, progress_ms: int = 0, duration_ms: int = 60_000) -> CurrentlyPlaying:
+    return CurrentlyPlaying(
+        currently_playing_type="track",
+        is_playing=is_playing,
+        progress_ms=progress_ms,
+        item=Track(
+            name="Song",
+            album=Album(name="Album"),
+            artists=[Artist(name="Artist A"), Artist(name="Artist B")],
+            uri="spotify:track:abc",
+            duration_ms=duration_ms,
+        ),
+    )
+
+
+class TestNowPlaying:
+    def test_served_until_track_ends(self):
+        timer = FakeTimer()
+        now_playing = NowPlaying(max_ttl=30, timer=timer)
+
+        song = now_playing.update(1, currently_playing(progress_ms=50_000))
+
+        assert song.artists == "Artist A, Artist B"
+        assert now_playing.get(1) == song
+
+        timer.now = 10
+        assert now_playing.get(1) is None
+
+        assert now_playing.stats.hits == 1
+        assert now_playing.stats.misses == 1
+
+    def test_max_ttl(self):
+        timer = FakeTimer()
+        now_playing = NowPlaying(max_ttl=30, timer=timer)
+
+        now_playing.update(1, currently_playing(is_playing=False, progress_ms=50_000))
+
+        timer.now = 20
+        assert now_playing.get(1) is not None
+
+        timer.now = 31
+        assert now_playing.get(1) is None
+
+    def test_invalidate(self):
+        now_playing = NowPlaying(max_ttl=30)
+        now_playing.update(1, currently_playing())
+
+        now_playing.invalidate(1)
+
+        assert now_playing.get(1) is None
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from app.models.spotify import Album, Artist, CurrentlyPlaying, Track
+from app.services.now_playing import NowPlaying
+from app.services.now_playing_stream import NowPlayingEvent, NowPlayingStream, PlaybackState, Subscription
+from app.services.scheduler import PollScheduler
+
+
+def currently_playing(name: str, is_playing: bool = True) -> CurrentlyPlaying:
+    return CurrentlyPlaying(
+        currently_playing_type="track",
+        is_playing=is_playing,
+        progress_ms=0,
+        item=Track(
+            name=name,
+            album=Album(name="Album"),
+            artists=[Artist(name="Artist")],
+            uri=f"spotify:track:{name}",
+            duration_ms=60_000,
+        ),
+    )
+
+
+@pytest_asyncio.fixture
+async def stream(mocker):
+    authorization = mocker.Mock()
+    authorization.get_access_token = mocker.AsyncMock(return_value="access_token")
+
+    spotify_client = mocker.Mock()
+    spotify_client.get_current_song = mocker.AsyncMock(return_value=currently_playing("first"))
+
+    scheduler = PollScheduler(
+        min_interval=0.01,
+        max_interval=0.01,
+        max_backoff=0.01,
+        idle_timeout=60,
+        max_concurrency=1,
+    )
+
+    stream = NowPlayingStream(
+        authorization,
+        spotify_client,
+        NowPlaying(max_ttl=30),
+        scheduler,
+        queue_size=2,
+    )
+
+    runner = asyncio.create_task(scheduler.run(stream.refresh))
+    yield stream
+
+    runner.cancel()
+    await scheduler.close()
+
+
+class TestNowPlayingStream:
+    @pytest.mark.asyncio
+    async def test_publishes_only_changes(self, stream):
+        async with stream.subscribe(1) as subscription:
+            first = await asyncio.wait_for(subscription.get(), 1)
+
+            assert first.state == PlaybackState.Playing
+            assert first.song.song_title == "first"
+
+            # Several polls of the same song publish nothing new
+            await asyncio.sleep(0.05)
+            assert subscription.queue.empty()
+
+            stream.spotify_client.get_current_song.return_value = currently_playing("first", is_playing=False)
+            paused = await asyncio.wait_for(subscription.get(), 1)
+
+            assert paused.state == PlaybackState.Paused
+
+    @pytest.mark.asyncio
+    async def test_single_poll_per_user(self, stream):
+        async with stream.subscribe(1) as first, stream.subscribe(1) as second:
+            await asyncio.wait_for(first.get(), 1)
+            await asyncio.wait_for(second.get(), 1)
+
+            assert stream.spotify_client.get_current_song.await_count == 1
+
+        assert not stream.subscribers
+
+    @pytest.mark.asyncio
+    async def test_nothing_playing(self, stream):
+        stream.spotify_client.get_current_song.return_value = None
+
+        async with stream.subscribe(1) as subscription:
+            event = await asyncio.wait_for(subscription.get(), 1)
+
+        assert event == NowPlayingEvent(PlaybackState.Stopped)
+        assert event.encode() == "event: stopped\ndata: {}\n\n"
+
+
+class TestSubscription:
+    def test_drops_oldest_when_full(self):
+        subscription = Subscription(maxsize=2)
+
+        for state in PlaybackState:
+            subscription.put(NowPlayingEvent(state))
+
+        assert subscription.queue.get_nowait().state == PlaybackState.Paused
+        assert subscription.queue.get_nowait().state == PlaybackState.Stopped
@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+from app.services.scheduler import PollResult, PollScheduler
+
+
+class FakeTimer:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def scheduler(timer=None, **kwargs) -> PollScheduler:
+    options = dict(
+        min_interval=2,
+        max_interval=30,
+        max_backoff=16,
+        idle_timeout=300,
+        max_concurrency=2,
+    )
+    options.update(kwargs)
+
+    return PollScheduler(timer=timer or FakeTimer(), **options)
+
+
+class TestPollScheduler:
+    def test_polls_just_after_track_ends(self):
+        poll_scheduler = scheduler()
+
+        assert poll_scheduler.next_delay(1, PollResult(playing=True, remaining=10)) == 10.5
+        assert poll_scheduler.next_delay(1, PollResult(playing=True, remaining=120)) == 30
+        assert poll_scheduler.next_delay(1, PollResult(playing=True, remaining=0)) == 2
+
+    def test_backs_off_while_paused(self):
+        poll_scheduler = scheduler()
+
+        delays = [poll_scheduler.next_delay(1, PollResult(playing=False)) for _ in range(5)]
+        assert delays == [2, 4, 8, 16, 16]
+
+        # playing again resets the backoff
+        poll_scheduler.next_delay(1, PollResult(playing=True, remaining=10))
+        assert poll_scheduler.next_delay(1, None) == 2
+
+    def test_pop_due(self):
+        timer = FakeTimer()
+        poll_scheduler = scheduler(timer)
+
+        poll_scheduler.touch(1)
+        poll_scheduler.touch(2, delay=5)
+        # rescheduling earlier replaces the previous entry
+        poll_scheduler.touch(2, delay=1)
+
+        assert poll_scheduler.pop_due() == [1]
+
+        timer.now = 1
+        assert poll_scheduler.pop_due() == [2]
+
+        timer.now = 10
+        assert poll_scheduler.pop_due() == []
+
+    @pytest.mark.asyncio
+    async def test_delay_during_poll(self):
+        timer = FakeTimer()
+        poll_scheduler = scheduler(timer)
+
+        async def poll(user_id: int) -> PollResult:
+            # a player control while the poll is in flight
+            poll_scheduler.touch(user_id, delay=1)
+            return PollResult(playing=True, remaining=20)
+
+        poll_scheduler.touch(1)
+        assert poll_scheduler.pop_due() == [1]
+
+        poll_scheduler.polling.add(1)
+        await poll_scheduler.poll_user(poll, 1)
+
+        assert poll_scheduler.scheduled[1] == 1
+        assert 1 not in poll_scheduler.pending_delays
+
+    @pytest.mark.asyncio
+    async def test_run_drops_idle_users(self):
+        poll_scheduler = scheduler(
+            min_interval=0.01,
+            max_interval=0.01,
+            max_backoff=0.01,
+            idle_timeout=0.05,
+            timer=asyncio.get_running_loop().time,
+        )
+        polls: list[int] = []
+
+        async def poll(user_id: int) -> PollResult:
+            polls.append(user_id)
+            return PollResult(playing=True, remaining=0)
+
+        poll_scheduler.touch(1)
+        runner = asyncio.create_task(poll_scheduler.run(poll))
+
+        await asyncio.sleep(0.2)
+        count = len(polls)
+
+        await asyncio.sleep(0.1)
+
+        runner.cancel()
+        await poll_scheduler.close()
+
+        assert count > 1
+        assert len(polls) == count
+        assert 1 not in poll_scheduler.last_activity
+
+    @pytest.mark.asyncio
+    async def test_concurrency_limited(self):
+        poll_scheduler = scheduler(max_concurrency=2, timer=asyncio.get_running_loop().time)
+        running = 0
+        peak = 0
+
+        async def poll(user_id: int) -> PollResult:
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+
+            await asyncio.sleep(0.02)
+
+            running -= 1
+            return PollResult(playing=False)
+
+        for user_id in range(6):
+            poll_scheduler.touch(user_id)
+
+        runner = asyncio.create_task(poll_scheduler.run(poll))
+        await asyncio.sleep(0.1)
+
+        runner.cancel()
+        await poll_scheduler.close()
+
+        assert peak == 2
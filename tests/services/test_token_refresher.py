@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+from app.models.sql.authorization_token import Origin
+from app.services.token_refresher import TokenRefresher
+
+
+class FakeTimer:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def token_refresher(authorization, concurrency: int = 2, timer=None) -> TokenRefresher:
+    return TokenRefresher(
+        authorization,
+        interval=60,
+        window=600,
+        concurrency=concurrency,
+        jitter=0,
+        batch_size=100,
+        max_backoff=300,
+        timer=timer or FakeTimer(),
+    )
+
+
+class TestTokenRefresher:
+    @pytest.mark.asyncio
+    async def test_refreshes_expiring_tokens(self, mocker):
+        authorization = mocker.Mock()
+        authorization.refresh_access_token = mocker.AsyncMock(return_value="access_token")
+
+        refresher = token_refresher(authorization)
+        mocker.patch.object(
+            refresher,
+            "find_expiring",
+            return_value=[(Origin.Spotify, 1), (Origin.Twitch, 2)],
+        )
+
+        assert await refresher.refresh_expiring() == 2
+
+        authorization.refresh_access_token.assert_any_await(Origin.Spotify, 1, refresh_before=600)
+        authorization.refresh_access_token.assert_any_await(Origin.Twitch, 2, refresh_before=600)
+
+    @pytest.mark.asyncio
+    async def test_limits_concurrency(self, mocker):
+        running = 0
+        peak = 0
+
+        async def refresh_access_token(service, user_id, refresh_before):
+            nonlocal running, peak
+
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        authorization = mocker.Mock()
+        authorization.refresh_access_token = refresh_access_token
+
+        refresher = token_refresher(authorization, concurrency=2)
+        mocker.patch.object(
+            refresher,
+            "find_expiring",
+            return_value=[(Origin.Spotify, user_id) for user_id in range(6)],
+        )
+
+        await refresher.refresh_expiring()
+
+        assert peak == 2
+
+    @pytest.mark.asyncio
+    async def test_failure_does_not_stop_other_refreshes(self, mocker):
+        authorization = mocker.Mock()
+        authorization.refresh_access_token = mocker.AsyncMock(
+            side_effect=[RuntimeError("boom"), "access_token"],
+        )
+
+        refresher = token_refresher(authorization, concurrency=1)
+        mocker.patch.object(
+            refresher,
+            "find_expiring",
+            return_value=[(Origin.Spotify, 1), (Origin.Spotify, 2)],
+        )
+
+        assert await refresher.refresh_expiring() == 2
+        assert authorization.refresh_access_token.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_backs_off_failing_tokens(self, mocker):
+        timer = FakeTimer()
+        authorization = mocker.Mock()
+        authorization.refresh_access_token = mocker.AsyncMock(side_effect=[None, RuntimeError("boom"), None, "access_token"])
+
+        refresher = token_refresher(authorization, timer=timer)
+        mocker.patch.object(refresher, "find_expiring", return_value=[(Origin.Spotify, 1)])
+
+        delays = []
+
+        for _ in range(3):
+            await refresher.refresh_expiring()
+            delays.append(refresher.retry_at[(Origin.Spotify, 1)] - timer.now)
+
+        assert delays == [120, 240, 300]
+        assert refresher.backing_off() == {Origin.Spotify: [1]}
+
+        timer.now += 300
+        assert refresher.backing_off() == {}
+
+        # a successful refresh resets the backoff
+        await refresher.refresh_expiring()
+        assert not refresher.failures
+        assert not refresher.retry_at
+
+    @pytest.mark.asyncio
+    async def test_forgets_tokens_no_longer_expiring(self, mocker):
+        timer = FakeTimer()
+        authorization = mocker.Mock()
+        authorization.refresh_access_token = mocker.AsyncMock(return_value=None)
+
+        refresher = token_refresher(authorization, timer=timer)
+        find_expiring = mocker.patch.object(refresher, "find_expiring", return_value=[(Origin.Spotify, 1)])
+
+        await refresher.refresh_expiring()
+        assert (Origin.Spotify, 1) in refresher.retry_at
+
+        # e.g. the user connected Spotify again
+        timer.now += 120
+        find_expiring.return_value = []
+
+        await refresher.refresh_expiring()
+        assert not refresher.retry_at
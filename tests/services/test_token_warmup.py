@@ -0,0 +1,96 @@
+import asyncio
+
+import pendulum
+import pytest
+
+from app.cache import CacheRegistry
+from app.configuration import Configuration
+from app.models.encrypted import Encrypted
+from app.models.sql.authorization_token import Origin
+from app.repositories import AuthorizationTokenRecord
+from app.services.authorization import Authorization
+from app.services.invalidation import InvalidationBus
+from app.services.token_warmup import warm_access_tokens
+
+
+def record(user_id: int, access_token: str, encrypted: Encrypted) -> AuthorizationTokenRecord:
+    return AuthorizationTokenRecord(
+        id=user_id,
+        user_id=user_id,
+        origin=Origin.Spotify,
+        access_token=encrypted.encrypt(access_token),
+        refresh_token=encrypted.encrypt("refresh_token"),
+        invalid_token=False,
+        expires_at=pendulum.now().add(hours=1),
+    )
+
+
+class TestWarmAccessTokens:
+    @pytest.mark.asyncio
+    async def test_prefills_cache(self, mocker):
+        configuration = Configuration()
+        authorization = Authorization(configuration)
+        encrypted = Encrypted(configuration.aes_encryption_key)
+
+        async def stream(*args, **kwargs):
+            yield [record(1, "first", encrypted), record(2, "second", encrypted)]
+            yield [record(3, "third", encrypted)]
+
+        mocker.patch.object(authorization.repository, "stream_active_authorization_tokens", stream)
+
+        invalidation = InvalidationBus(CacheRegistry())
+        invalidation.listening.set()
+
+        await warm_access_tokens(authorization, invalidation, budget=1, active_days=7, batch_size=2)
+
+        assert authorization.access_tokens.get(Origin.Spotify, 1) == "first"
+        assert authorization.access_tokens.get(Origin.Spotify, 3) == "third"
+
+    @pytest.mark.asyncio
+    async def test_budget(self, mocker):
+        configuration = Configuration()
+        authorization = Authorization(configuration)
+        encrypted = Encrypted(configuration.aes_encryption_key)
+        closed = False
+
+        async def stream(*args, **kwargs):
+            nonlocal closed
+
+            try:
+                yield [record(1, "first", encrypted)]
+                await asyncio.sleep(10)
+                yield [record(2, "second", encrypted)]
+            finally:
+                closed = True
+
+        mocker.patch.object(authorization.repository, "stream_active_authorization_tokens", stream)
+
+        invalidation = InvalidationBus(CacheRegistry())
+        invalidation.listening.set()
+
+        await warm_access_tokens(authorization, invalidation, budget=0.05, active_days=7, batch_size=1)
+
+        # whatever was cached before running out of time is kept
+        assert authorization.access_tokens.get(Origin.Spotify, 1) == "first"
+        assert authorization.access_tokens.get(Origin.Spotify, 2) is None
+        assert closed
+
+    @pytest.mark.asyncio
+    async def test_skips_undecryptable(self, mocker):
+        configuration = Configuration()
+        authorization = Authorization(configuration)
+        encrypted = Encrypted(configuration.aes_encryption_key)
+        corrupted = record(2, "second", encrypted)
+        corrupted.access_token = "not encrypted"
+
+        async def stream(*args, **kwargs):
+            yield [record(1, "first", encrypted), corrupted, record(3, "third", encrypted)]
+
+        mocker.patch.object(authorization.repository, "stream_active_authorization_tokens", stream)
+
+        warmed = await authorization.warm_access_tokens(pendulum.now().subtract(days=7), batch_size=3)
+
+        assert warmed == 2
+        assert authorization.access_tokens.get(Origin.Spotify, 1) == "first"
+        assert authorization.access_tokens.get(Origin.Spotify, 2) is None
+        assert authorization.access_tokens.get(Origin.Spotify, 3) == "third"